@@ -0,0 +1,252 @@
+# asyncio interface to the AM03127 LED display module.
+
+import asyncio
+from LedDisplay import LedDisplay, CommunicationError
+
+class AsyncLedDisplay(LedDisplay):
+    """A LedDisplay for use with asyncio.
+
+       The command methods (send, setSchedule, setGraphicsBlock, ...) are the same as those of
+       LedDisplay, but return awaitables. Waiting for the device response does not block the
+       event loop: the serial port is watched using loop.add_reader().
+
+       Commands are serialized; a command that is cancelled (or runs past its deadline) while waiting
+       for its response is treated as failed. Before the next command is sent, we wait for the late
+       response of the abandoned command, up to the response timeout, and for the line to go quiet.
+    """
+
+    def __init__(self, device, device_id = 1, timeout = 1.0, **options):
+
+        super().__init__(device, device_id, timeout, **options)
+
+        # Make reads non-blocking; we wait for data using the event loop.
+        self._port.timeout = 0
+
+        self._lock = asyncio.Lock()
+        self._buffer = bytearray()
+
+        # (deadline, expected response) of a command that was abandoned while its response may still arrive.
+        self._abandoned = None
+
+    async def _waitReadable(self, timeout):
+        """Wait until the serial port has data available, or until the timeout expires."""
+
+        loop = asyncio.get_running_loop()
+
+        readable = loop.create_future()
+
+        def set_readable():
+            if not readable.done():
+                readable.set_result(None)
+
+        fd = self._port.fileno()
+
+        loop.add_reader(fd, set_readable)
+        try:
+            await asyncio.wait_for(readable, timeout)
+        finally:
+            loop.remove_reader(fd)
+
+    async def _read(self, size, timeout):
+        """Read up to 'size' bytes; return fewer bytes if the timeout expires."""
+
+        loop = asyncio.get_running_loop()
+
+        deadline = loop.time() + timeout
+
+        while len(self._buffer) < size:
+
+            remaining = deadline - loop.time()
+
+            if remaining <= 0:
+                break
+
+            try:
+                await self._waitReadable(remaining)
+            except asyncio.TimeoutError:
+                break
+
+            self._buffer.extend(self._port.read(max(1, self._port.in_waiting)))
+
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+
+        return data
+
+    def _discardInput(self):
+        """Discard pending input, e.g. a late response to a command that was cancelled."""
+        self._port.reset_input_buffer()
+        del self._buffer[:]
+
+    async def _resync(self):
+        """Read and return garbage from the serial port, until the line goes quiet. See LedDisplay._resync()."""
+
+        loop = asyncio.get_running_loop()
+
+        start_time = loop.time()
+
+        if self._resync_gap is None:
+            garbage = await self._read(1000, self._timeout) # Read garbage, if any (will timeout).
+        else:
+            garbage = b""
+            while loop.time() - start_time < self._timeout:
+                data = await self._read(1000, self._resync_gap)
+                if len(data) == 0:
+                    break # The line is quiet.
+                garbage += data
+
+        self.stats.resyncs += 1
+        self.stats.resync_time += loop.time() - start_time
+
+        return garbage
+
+    async def _settle(self):
+        """Discard the late response to an abandoned command, and anything else, until the line goes quiet."""
+
+        loop = asyncio.get_running_loop()
+
+        (deadline, expected_response) = self._abandoned
+
+        garbage = await self._read(len(expected_response), deadline - loop.time())
+        garbage += await self._resync()
+
+        self._abandoned = None
+
+        if len(garbage) > 0:
+            self._logger.info("Discarded response to abandoned command: {!r}".format(garbage))
+
+    async def _broadcast(self, command):
+        """Send a command to all devices on the bus. No response is expected. See LedDisplay._broadcast()."""
+
+        async with self._lock:
+
+            if self._abandoned is not None:
+                await self._settle()
+
+            self.stats.commands += 1
+
+            command_statistics = self.stats.commandStatistics(command)
+            command_statistics.count += 1
+
+            self._logger.info("Broadcasting: %r", command)
+
+            self._discardInput()
+            self._port.write(command)
+
+            command_statistics.bytes_written += len(command)
+
+            # Wait until the command has been transmitted, and give the devices time to execute it.
+            await asyncio.sleep(self.wireTime(len(command)) + self.BROADCAST_GAP)
+
+    async def _exchange(self, command, expected_response, max_retry):
+
+        async with self._lock:
+
+            if self._abandoned is not None:
+                await self._settle()
+
+            self._discardInput()
+
+            try:
+                await self._exchangeLocked(command, expected_response, max_retry)
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                # A response to the command may still be on its way.
+                self._abandoned = (asyncio.get_running_loop().time() + self._timeout, expected_response)
+                raise
+
+    async def _exchangeLocked(self, command, expected_response, max_retry):
+
+        loop = asyncio.get_running_loop()
+
+        self.stats.commands += 1
+
+        command_statistics = self.stats.commandStatistics(command)
+        command_statistics.count += 1
+
+        # Try up to "max_retry" times...
+
+        for i in range(max_retry):
+
+            if i > 0:
+                self.stats.retries += 1
+                command_statistics.retries += 1
+
+            self._logger.info("Sending to device: %r", command)
+
+            # Commands are much smaller than the kernel's serial buffer, so this does not block.
+            write_time = loop.time()
+            self._port.write(command)
+
+            command_statistics.bytes_written += len(command)
+
+            response = await self._read(len(expected_response), self._responseTimeout(command, expected_response))
+
+            if response == expected_response:
+                elapsed = loop.time() - write_time
+                self._responseReceived(command, response, elapsed)
+                command_statistics.latency.observe(elapsed)
+                self._logger.debug("Received expected response: %r.", response)
+                return # Success!
+
+            if len(response) == 0:
+                command_statistics.timeouts += 1
+
+            response = response + await self._resync()
+
+            if response == expected_response:
+                # The response was late; the command did arrive. See LedDisplay._exchange().
+                self.stats.late_acks += 1
+                self._logger.warning("Received late response: {!r}".format(response))
+                return
+
+            self._logger.warning("Received unexpected response: {!r}".format(response))
+
+        # If we get here, we didn't get an acknowledgement after retries.
+        command_statistics.errors += 1
+        raise CommunicationError("Command {!r} was not acknowledged by device.".format(command))
+
+    async def send(self, data_packet, max_retry = LedDisplay.DEFAULT_RETRY, deadline = None):
+        """Assemble standard packet and send command.
+
+           If 'deadline' is given, the command (including retries) fails with a CommunicationError
+           if it is not acknowledged within that many seconds.
+        """
+
+        prepared = self._prepare(data_packet)
+
+        if prepared is None:
+            return
+
+        (data_packet, command) = prepared
+
+        if self._device_id == self.BROADCAST_ID:
+            await self._broadcast(command)
+            return
+
+        try:
+            await asyncio.wait_for(self._exchange(command, b"ACK", max_retry), deadline)
+        except asyncio.TimeoutError:
+            self.stats.commandStatistics(command).errors += 1
+            self._failed(data_packet)
+            raise CommunicationError("Command {!r} was not acknowledged within {} seconds.".format(command, deadline))
+        except BaseException:
+            # Including cancellation: the device may or may not have executed the command.
+            self._failed(data_packet)
+            raise
+
+        self._acknowledged(data_packet)
+
+    async def setDeviceId(self, new_device_id, max_retry = LedDisplay.DEFAULT_RETRY):
+        """Paragraph 4.1: ID setting. See LedDisplay.setDeviceId()."""
+
+        command = "<ID><{:02X}><E>".format(new_device_id).encode("ASCII")
+
+        expected_response = "{:02X}".format(new_device_id).encode("ASCII")
+
+        await self._exchange(command, expected_response, max_retry)
+
+    async def setGraphicsPage(self, graphicsPage, image):
+        """Send all 8 graphics blocks of a graphics page. See LedDisplay.setGraphicsPage()."""
+
+        for (graphicsBlock, data) in self._encodeGraphicsPage(graphicsPage, image):
+            await self.setGraphicsBlockData(graphicsPage, graphicsBlock, data)
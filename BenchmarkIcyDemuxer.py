@@ -0,0 +1,203 @@
+#! /usr/bin/env python3
+
+# Benchmarks for the IcyDemuxer, using a synthetic ICY stream. The correctness tests are in test_IcyDemuxer.py.
+
+import sys, time, random, socket, threading, logging
+from setup_logging import setup_logging
+from IcyDemuxer import IcyDemuxer
+
+def make_stream(audio_size, metadata_interval = 16000, seed = 0):
+    """Make a synthetic ICY response. Returns (stream, audio data, list of metadata strings)."""
+
+    rng = random.Random(seed)
+
+    audio = bytes(rng.getrandbits(8) for i in range(min(audio_size, 65536)))
+    audio = (audio * (audio_size // len(audio) + 1))[:audio_size]
+
+    header = "ICY 200 OK\r\ncontent-type:audio/mpeg\r\nicy-metaint:{}\r\n\r\n".format(metadata_interval).encode()
+
+    parts = [header]
+    metadata_list = []
+
+    for offset in range(0, audio_size, metadata_interval):
+        chunk = audio[offset:offset + metadata_interval]
+        parts.append(chunk)
+        if len(chunk) == metadata_interval:
+            if rng.random() < 0.1:
+                metadata = "StreamTitle='Artist {} - Title {}';".format(offset, rng.randrange(1000))
+                encoded = metadata.encode()
+                encoded += b"\0" * (-len(encoded) % 16)
+                metadata_list.append(metadata)
+            else:
+                encoded = b""
+                metadata_list.append("")
+            parts.append(bytes([len(encoded) // 16]) + encoded)
+
+    return (b"".join(parts), audio, metadata_list)
+
+def random_chunks(data, max_chunk_size, seed = 0):
+    """Split data into chunks of random sizes (1 .. max_chunk_size)."""
+
+    rng = random.Random(seed)
+
+    chunks = []
+    offset = 0
+
+    while offset < len(data):
+        size = rng.randint(1, max_chunk_size)
+        chunks.append(data[offset:offset + size])
+        offset += size
+
+    return chunks
+
+def legacy_demux(chunks, audio_receiver, metadata_receiver):
+    """The bytearray-based state machine that PlayInternetRadio used before the IcyDemuxer."""
+
+    stream_buffer = bytearray()
+
+    in_header = True
+    icy_metadata_interval = None
+
+    for packet in chunks:
+
+        stream_buffer.extend(packet)
+
+        while True:
+
+            if in_header:
+                idx = stream_buffer.find(b"\r\n")
+                if idx < 0:
+                    break
+                headerline = stream_buffer[:idx].decode(errors = "replace")
+                del stream_buffer[:idx + 2]
+                if headerline.startswith("icy-metaint:"):
+                    icy_metadata_interval = int(headerline[12:])
+                elif len(headerline) == 0:
+                    stream_audio_bytes_until_metadata = icy_metadata_interval
+                    in_header = False
+
+            elif stream_audio_bytes_until_metadata > 0:
+                if len(stream_buffer) == 0:
+                    break
+                stream_audio_bytes = min(stream_audio_bytes_until_metadata, len(stream_buffer))
+                audio_receiver(stream_buffer[:stream_audio_bytes])
+                del stream_buffer[:stream_audio_bytes]
+                stream_audio_bytes_until_metadata -= stream_audio_bytes
+
+            else:
+                if len(stream_buffer) == 0:
+                    break
+                metadata_size = 16 * stream_buffer[0]
+                if len(stream_buffer) < 1 + metadata_size:
+                    break
+                metadata_receiver(stream_buffer[1:1 + metadata_size].rstrip(b"\0").decode(errors = "replace"))
+                del stream_buffer[:1 + metadata_size]
+                stream_audio_bytes_until_metadata = icy_metadata_interval
+
+def benchmark_feed(logger, stream, max_chunk_size = 4096):
+    """Compare the parsing throughput of the legacy bytearray code and the IcyDemuxer, without I/O."""
+
+    chunks = random_chunks(stream, max_chunk_size)
+
+    def audio_receiver(data):
+        pass
+
+    def metadata_receiver(metadata):
+        pass
+
+    start_time = time.perf_counter()
+    legacy_demux(chunks, audio_receiver, metadata_receiver)
+    legacy_time = time.perf_counter() - start_time
+
+    demuxer = IcyDemuxer(None, audio_receiver, metadata_receiver)
+
+    start_time = time.perf_counter()
+    for chunk in chunks:
+        demuxer.feed(chunk)
+    demuxer_time = time.perf_counter() - start_time
+
+    logger.info("legacy bytearray: {:8.1f} MB/s".format(len(stream) / legacy_time / 1e6))
+    logger.info("IcyDemuxer:       {:8.1f} MB/s ({:.1f}x speedup)".format(len(stream) / demuxer_time / 1e6, legacy_time / demuxer_time))
+
+def benchmark_socket(logger, stream, recv_size = 4096):
+    """Compare recv() + bytearray with IcyDemuxer.receiveFrom() (recv_into) on a local socket pair."""
+
+    def audio_receiver(data):
+        pass
+
+    def metadata_receiver(metadata):
+        pass
+
+    def legacy_receive(sock):
+        def packets():
+            while True:
+                packet = sock.recv(recv_size)
+                if len(packet) == 0:
+                    return
+                yield packet
+        legacy_demux(packets(), audio_receiver, metadata_receiver)
+
+    def demuxer_receive(sock):
+        demuxer = IcyDemuxer(None, audio_receiver, metadata_receiver)
+        while demuxer.receiveFrom(sock, recv_size) != 0:
+            pass
+
+    def measure(receive):
+
+        (receiver_socket, sender_socket) = socket.socketpair()
+
+        def send():
+            sender_socket.sendall(stream)
+            sender_socket.close()
+
+        sender = threading.Thread(target = send)
+
+        start_time = time.perf_counter()
+        sender.start()
+        receive(receiver_socket)
+        duration = time.perf_counter() - start_time
+
+        sender.join()
+        receiver_socket.close()
+
+        return duration
+
+    # Best of three runs; the socket transfer is noisy.
+    legacy_time  = min(measure(legacy_receive) for i in range(3))
+    demuxer_time = min(measure(demuxer_receive) for i in range(3))
+
+    logger.info("legacy recv():    {:8.1f} MB/s".format(len(stream) / legacy_time / 1e6))
+    logger.info("IcyDemuxer:       {:8.1f} MB/s ({:.1f}x speedup)".format(len(stream) / demuxer_time / 1e6, legacy_time / demuxer_time))
+
+def main():
+
+    if "--debug" in sys.argv[1:]:
+        log_level = logging.DEBUG
+    else:
+        log_level = logging.INFO
+
+    with setup_logging(level = log_level, noisy = False):
+
+        logger = logging.getLogger("main")
+
+        (stream, audio, metadata_list) = make_stream(64 * 1000 * 1000)
+
+        logger.info("Synthetic stream: {} bytes, {} metadata chunks.".format(len(stream), len(metadata_list)))
+
+        logger.info("Benchmark: parsing, random chunks of up to 4096 bytes ...")
+        benchmark_feed(logger, stream)
+
+        logger.info("Benchmark: parsing, random chunks of up to 100 bytes ...")
+        benchmark_feed(logger, stream, max_chunk_size = 100)
+
+        logger.info("Benchmark: parsing, random chunks of up to 65536 bytes ...")
+        benchmark_feed(logger, stream, max_chunk_size = 65536)
+
+        logger.info("Benchmark: receiving from a local socket, 4096 bytes per receive ...")
+        benchmark_socket(logger, stream)
+
+        logger.info("Benchmark: receiving from a local socket, 65536 bytes per receive ...")
+        benchmark_socket(logger, stream, recv_size = 65536)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+#! /usr/bin/env python3
+
+# Benchmarks for the LedDisplay module, run against the LedDisplayEmulator.
+
+import sys, time, logging, timeit, functools, operator
+from setup_logging import setup_logging
+from LedDisplay import LedDisplay, CommunicationError, Replacements, encodeMessage, frameCommand
+from LedDisplayEmulator import LedDisplayEmulator
+from LedDisplayGroup import LedDisplayGroup
+from LedAnimation import AnimationPlayer, encodeFrames, FRAME_WIDTH
+from LedDisplayScheduler import LedDisplayScheduler
+from LedTransport import FakeTransport
+import numpy as np
+
+def benchmark_send(logger, count = 50, led_display_options = {}, **emulator_options):
+    """Measure throughput and acknowledgement latency of LedDisplay.send()."""
+
+    with LedDisplayEmulator(**emulator_options) as emulator, LedDisplay(emulator.device, **led_display_options) as led_display:
+
+        latencies = []
+        failures = 0
+
+        start_time = time.monotonic()
+
+        for i in range(count):
+            command = "<L1><PA><FA><MA><WA><FK><AC><CD>Message {:6d}".format(i)
+            send_time = time.monotonic()
+            try:
+                led_display.send(command)
+            except CommunicationError:
+                failures += 1
+            else:
+                latencies.append(time.monotonic() - send_time)
+
+        duration = time.monotonic() - start_time
+
+        stats = led_display.stats
+
+    latencies.sort()
+
+    logger.info("{} commands in {:.3f} s: {:.1f} commands/s, {} failures".format(count, duration, count / duration, failures))
+
+    if len(latencies) > 0:
+        logger.info("latency: min {:.1f} ms, median {:.1f} ms, max {:.1f} ms".format(
+            1000.0 * latencies[0], 1000.0 * latencies[len(latencies) // 2], 1000.0 * latencies[-1]))
+
+    if stats.retries > 0:
+        logger.info("{} retries, {} late ACKs, {:.3f} s spent resynchronizing".format(stats.retries, stats.late_acks, stats.resync_time))
+
+    bytes_written = sum(command_statistics.bytes_written for command_statistics in stats.by_type.values())
+
+    logger.info("{} bytes written: {:.0f}% of the link capacity".format(bytes_written, 100.0 * bytes_written * 10 / LedDisplay.BAUDRATE / duration))
+
+def benchmark_group(logger, ports = 4, count = 10):
+    """Compare updating several displays one after another with a LedDisplayGroup."""
+
+    emulators = [LedDisplayEmulator() for i in range(ports)]
+
+    try:
+        start_time = time.monotonic()
+
+        for emulator in emulators:
+            with LedDisplay(emulator.device) as led_display:
+                for i in range(count):
+                    led_display.send("<L1><PA>Message {:6d}".format(i))
+
+        sequential_time = time.monotonic() - start_time
+
+        with LedDisplayGroup({emulator.device: [1] for emulator in emulators}) as led_display_group:
+
+            start_time = time.monotonic()
+
+            for i in range(count):
+                led_display_group.send("<L1><PA>Message {:6d}".format(i))
+
+            group_time = time.monotonic() - start_time
+
+    finally:
+        for emulator in emulators:
+            emulator.close()
+
+    logger.info("{} displays, {} commands: sequential {:.3f} s, group {:.3f} s ({:.1f}x speedup)".format(
+        ports, count, sequential_time, group_time, sequential_time / group_time))
+
+def benchmark_animation(logger, count = 24):
+    """Measure the frame rate of full-width animations: frames that change everywhere, and a moving bar."""
+
+    rng = np.random.default_rng(1)
+
+    noise_frames = encodeFrames([rng.integers(0, 4, size = (7, FRAME_WIDTH)) for i in range(count)])
+
+    bar_frames = []
+    for i in range(count):
+        frame = np.zeros((7, FRAME_WIDTH), dtype = np.uint8)
+        frame[:, (i * 4) % FRAME_WIDTH:(i * 4) % FRAME_WIDTH + 4] = 2
+        bar_frames.append(frame)
+
+    bar_frames = encodeFrames(bar_frames)
+
+    with LedDisplayEmulator() as emulator, LedDisplay(emulator.device) as led_display:
+
+        led_display.setSchedule("A", "A")
+
+        for (name, frames) in (("noise", noise_frames), ("moving bar", bar_frames)):
+
+            player = AnimationPlayer(led_display)
+
+            fps = player.play(frames, fps = 25.0)
+
+            logger.info("{}: {:.2f} frames/s, {:.2f} graphics blocks per frame".format(name, fps, player.blocks_sent / player.frames_shown))
+
+def check_scheduler_commands(logger):
+    """Check that every LedDisplay command method sends the same data packets through a LedDisplayScheduler."""
+
+    import datetime
+    from LedDisplay import PageContent
+
+    timestamp = datetime.datetime(2024, 2, 29, 12, 34, 56)
+
+    commands = [
+            ("send"                                       , ("<L1><PA>Hello", )),
+            ("setRealtimeClock"                           , (timestamp, )),
+            ("setPageContent"                             , (PageContent(2, "B").text("Hello"), )),
+            ("setSchedule"                                , ("A", "AB", timestamp, timestamp)),
+            ("setGraphicsBlock"                           , ("A", 1, "RGO." * 56)),
+            ("setGraphicsBlockData"                       , ("B", 2, bytes(range(64)))),
+            ("setGraphicsPage"                            , ("C", "RGBO" * 448)),
+            ("deletePage"                                 , (1, "A")),
+            ("deleteSchedule"                             , ("A", )),
+            ("deleteAll"                                  , ()),
+            ("setDefaultRunPage"                          , ("A", )),
+            ("setBrightnessLevel"                         , ("B", )),
+            ("changeFactoryDefaultEuropeanCharacterTable" , ("A", 0x01, bytes(8))),
+            ("recallFactoryDefaultEuropeanCharacterTable" , ())
+        ]
+
+    # All public command methods except setDeviceId, which cannot be scheduled.
+    command_methods = {name for name in dir(LedDisplay) if name.startswith(("send", "set", "delete", "change", "recall")) and name != "setDeviceId"}
+
+    assert command_methods == {name for (name, args) in commands}, command_methods.symmetric_difference(name for (name, args) in commands)
+
+    direct_port = FakeTransport()
+    scheduled_port = FakeTransport()
+
+    with LedDisplay("direct", port = direct_port) as led_display:
+        for (name, args) in commands:
+            getattr(led_display, name)(*args)
+
+    with LedDisplay("scheduled", port = scheduled_port) as led_display, LedDisplayScheduler(led_display, max_utilization = 1.0) as scheduler:
+        futures = [getattr(scheduler, name)(*args) for (name, args) in commands]
+        for future in futures:
+            future.result()
+
+    # The scheduler sends commands in order of priority.
+    assert sorted(scheduled_port.data_packets) == sorted(direct_port.data_packets)
+
+    logger.info("{} command methods sent {} identical data packets through the scheduler.".format(len(commands), len(direct_port.data_packets)))
+
+def legacy_frame_command(device_id, data_packet, logger):
+    """The framing code of LedDisplay.send() before the fast path, for comparison."""
+
+    for (a, b) in Replacements.items():
+        data_packet = data_packet.replace(a, b)
+    data_packet = data_packet.encode("ASCII")
+
+    checksum = functools.reduce(operator.__xor__, data_packet, 0)
+
+    command_prefix = "<ID{:02X}>".format(device_id).encode()
+    command_suffix = "{:02X}<E>".format(checksum).encode()
+
+    command = command_prefix + data_packet + command_suffix
+
+    logger.info("Sending to device: {!r}".format(command))
+
+    return command
+
+def fast_frame_command(device_id, data_packet, logger):
+    """The framing code of LedDisplay.send(), using encodeMessage() and frameCommand()."""
+
+    command = frameCommand(device_id, encodeMessage(data_packet))
+
+    logger.info("Sending to device: %r", command)
+
+    return command
+
+def benchmark_framing(logger, count = 20000):
+    """Compare the legacy framing code with the fast path, with INFO logging disabled."""
+
+    message = "<L1><PA><FE><MA><WB><FE><AC><CG>Bob Marley - Three Little Birds → 2:59          <CD><KD> <KT>"
+
+    quiet_logger = logging.getLogger("benchmark")
+    quiet_logger.setLevel(logging.WARNING)
+
+    assert legacy_frame_command(1, message, quiet_logger) == fast_frame_command(1, message, quiet_logger)
+
+    legacy_time = min(timeit.repeat(lambda: legacy_frame_command(1, message, quiet_logger), number = count, repeat = 5))
+    fast_time   = min(timeit.repeat(lambda: fast_frame_command(1, message, quiet_logger), number = count, repeat = 5))
+
+    logger.info("legacy framing: {:.2f} us/command".format(1e6 * legacy_time / count))
+    logger.info("fast framing:   {:.2f} us/command ({:.1f}x speedup)".format(1e6 * fast_time / count, legacy_time / fast_time))
+
+def main():
+
+    if "--debug" in sys.argv[1:]:
+        log_level = logging.DEBUG
+    else:
+        log_level = logging.INFO
+
+    # LedDisplay logs every command at INFO level; keep the benchmark output readable.
+
+    with setup_logging(level = max(log_level, logging.WARNING), noisy = False):
+
+        logger = logging.getLogger("main")
+        logger.setLevel(log_level)
+
+        logger.info("Check: LedDisplay command methods through the LedDisplayScheduler ...")
+        check_scheduler_commands(logger)
+
+        logger.info("Benchmark: command framing ...")
+        benchmark_framing(logger)
+
+        logger.info("Benchmark: send() at 9600 baud, immediate ACK ...")
+        benchmark_send(logger)
+
+        logger.info("Benchmark: send() at 9600 baud, 20 ms ACK delay ...")
+        benchmark_send(logger, ack_delay = 0.020)
+
+        logger.info("Benchmark: LedDisplayGroup fan-out to displays on separate serial ports ...")
+        benchmark_group(logger)
+
+        logger.info("Benchmark: double-buffered animation, 80 columns ...")
+        benchmark_animation(logger)
+
+        logger.info("Benchmark: send() retry path, 10% dropped and 10% garbled responses, full-timeout drain ...")
+        benchmark_send(logger, count = 20, led_display_options = {"resync_gap": None}, drop_probability = 0.1, garble_probability = 0.1, seed = 1)
+
+        logger.info("Benchmark: send() retry path, 10% dropped and 10% garbled responses, fast resync ...")
+        benchmark_send(logger, count = 20, drop_probability = 0.1, garble_probability = 0.1, seed = 1)
+
+        logger.info("Benchmark: send() retry path, 10% dropped and 10% garbled responses, fast resync and adaptive timeout ...")
+        benchmark_send(logger, count = 20, led_display_options = {"adaptive_timeout": True}, drop_probability = 0.1, garble_probability = 0.1, seed = 1)
+
+if __name__ == "__main__":
+    main()
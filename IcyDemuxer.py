@@ -0,0 +1,240 @@
+# Demultiplexer for ICY (SHOUTcast/Icecast) audio streams with in-band metadata.
+#
+# The response to an ICY request consists of an HTTP-like header, followed by audio data. If the
+# header specifies an "icy-metaint", a metadata chunk follows after every 'icy-metaint' bytes of audio.
+# A metadata chunk is a length byte N, followed by 16 * N bytes of metadata, padded with NUL bytes.
+
+class IcyDemuxer:
+    """Split an ICY stream into header lines, audio data, and metadata.
+
+       Data is received into a preallocated buffer, either directly from a socket (receiveFrom(), which uses
+       recv_into) or from bytes (feed()); the stream may be split into chunks at arbitrary points.
+
+       Audio data is passed to the audio receiver without copying, as memoryview slices of the buffer
+       (or the data given to feed()). A slice is only valid during the call; a receiver that keeps the
+       data must copy it.
+
+       Audio is handed out as soon as it arrives, so the only data that remains in the buffer is an
+       incomplete header line or metadata chunk. Those few bytes are moved to the start of the buffer
+       when the free space runs low.
+    """
+
+    DEFAULT_BUFFER_SIZE = 65536
+
+    # Space needed for the largest metadata chunk, plus some room to receive.
+    MIN_BUFFER_SIZE = 1 + 16 * 255 + 4096
+
+    def __init__(self, header_receiver = None, audio_receiver = None, metadata_receiver = None, buffer_size = DEFAULT_BUFFER_SIZE):
+
+        assert buffer_size >= self.MIN_BUFFER_SIZE
+
+        self._header_receiver   = header_receiver
+        self._audio_receiver    = audio_receiver
+        self._metadata_receiver = metadata_receiver
+
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+
+        self._start = 0 # Start of the unprocessed data.
+        self._end   = 0 # End of the unprocessed data.
+
+        self._in_header = True
+        self._audio_bytes_until_metadata = None
+
+        self.icy_metadata_interval = None
+        self.icy_content_type = None
+
+        self.header_lines = []
+        self.audio_bytes = 0
+        self.metadata_count = 0
+
+    def _makeRoom(self, size):
+        """Make sure that at least 'size' bytes are free at the end of the buffer."""
+
+        if len(self._buffer) - self._end >= size:
+            return
+
+        # Move the unprocessed data to the start of the buffer.
+
+        unprocessed = self._end - self._start
+
+        self._buffer[:unprocessed] = self._view[self._start:self._end]
+
+        self._start = 0
+        self._end = unprocessed
+
+    def receiveFrom(self, sock, size = 4096):
+        """Receive up to 'size' bytes from a socket, and process them. Returns the number of bytes received; 0 at end of stream."""
+
+        audio_bytes_until_metadata = self._audio_bytes_until_metadata
+
+        if self._end == 0 and not self._in_header and (audio_bytes_until_metadata is None or audio_bytes_until_metadata >= size):
+
+            # Fast path: nothing is pending, and all data that we can receive is audio.
+
+            count = sock.recv_into(self._view, size)
+
+            if audio_bytes_until_metadata is not None:
+                self._audio_bytes_until_metadata = audio_bytes_until_metadata - count
+
+            self.audio_bytes += count
+
+            if count > 0 and self._audio_receiver is not None:
+                self._audio_receiver(self._view[:count])
+
+            return count
+
+        self._makeRoom(size)
+
+        count = sock.recv_into(self._view[self._end:], min(size, len(self._buffer) - self._end))
+
+        self._end += count
+
+        self._start = self._process(self._view, self._start, self._end)
+
+        if self._start == self._end:
+            # All data has been processed; start at the beginning of the buffer again.
+            self._start = self._end = 0
+
+        return count
+
+    def feed(self, data):
+        """Process data (any bytes-like object), e.g. received by other means.
+
+           If the data fits in the buffer, the audio slices passed on by one call remain valid until the next call.
+        """
+
+        audio_bytes_until_metadata = self._audio_bytes_until_metadata
+
+        if self._end == 0 and not self._in_header and (audio_bytes_until_metadata is None or audio_bytes_until_metadata >= len(data)):
+
+            # Fast path: nothing is pending, and all data is audio.
+
+            if audio_bytes_until_metadata is not None:
+                self._audio_bytes_until_metadata = audio_bytes_until_metadata - len(data)
+
+            self.audio_bytes += len(data)
+
+            if len(data) > 0 and self._audio_receiver is not None:
+                self._audio_receiver(data)
+
+            return
+
+        data = memoryview(data)
+
+        if self._start == self._end and not self._in_header:
+
+            # Nothing is pending; process the data in place, and keep only the unprocessed tail.
+            start = self._process(data, 0, len(data))
+            data = data[start:]
+
+        while len(data) > 0:
+
+            # Make room for all of the data at once, if possible, rather than moving data between slices.
+            self._makeRoom(min(len(data), len(self._buffer) - (self._end - self._start)))
+
+            count = min(len(data), len(self._buffer) - self._end)
+
+            self._view[self._end:self._end + count] = data[:count]
+            self._end += count
+            data = data[count:]
+
+            self._start = self._process(self._view, self._start, self._end)
+
+        if self._start == self._end:
+            self._start = self._end = 0
+
+    def _process(self, view, start, end):
+        """Process view[start:end]. Returns the offset of the unprocessed data: an incomplete header line or metadata chunk.
+
+           While in the header, 'view' must be the view of the buffer.
+        """
+
+        audio_receiver = self._audio_receiver
+
+        while start < end:
+
+            if self._in_header:
+
+                idx = self._buffer.find(b"\r\n", start, end)
+
+                if idx < 0:
+                    if start == 0 and end == len(self._buffer):
+                        raise ValueError("Header line too long.")
+                    break # CR/LF not found. We need more data to proceed.
+
+                # Found CR/LF; extract the header line, and discard it and the CR/LF characters.
+
+                headerline = self._buffer[start:idx].decode(errors = "replace")
+
+                start = idx + 2
+
+                self._processHeaderLine(headerline)
+
+                continue
+
+            audio_bytes_until_metadata = self._audio_bytes_until_metadata
+
+            if audio_bytes_until_metadata is None:
+
+                # Audio data only.
+
+                count = end - start
+
+            elif audio_bytes_until_metadata > 0:
+
+                # Audio data, up to the next metadata chunk.
+
+                count = min(end - start, audio_bytes_until_metadata)
+
+                self._audio_bytes_until_metadata = audio_bytes_until_metadata - count
+
+            else:
+
+                # We are expecting a metadata chunk.
+
+                metadata_size = 16 * view[start]
+
+                if end - start < 1 + metadata_size:
+                    break # More data needed; metadata chunk incomplete.
+
+                metadata = bytes(view[start + 1:start + 1 + metadata_size]).rstrip(b"\0").decode(errors = "replace")
+
+                # Discard the metadata size byte as well as the metadata itself.
+                start += 1 + metadata_size
+
+                self._audio_bytes_until_metadata = self.icy_metadata_interval
+
+                self.metadata_count += 1
+
+                if self._metadata_receiver is not None:
+                    self._metadata_receiver(metadata)
+
+                continue
+
+            if audio_receiver is not None:
+                audio_receiver(view[start:start + count])
+
+            start += count
+
+            self.audio_bytes += count
+
+        return start
+
+    def _processHeaderLine(self, headerline):
+
+        self.header_lines.append(headerline)
+
+        if self._header_receiver is not None:
+            self._header_receiver(headerline)
+
+        lowercase_headerline = headerline.lower()
+
+        if lowercase_headerline.startswith("icy-metaint:"):
+            self.icy_metadata_interval = int(headerline[12:])
+        elif lowercase_headerline.startswith("content-type:"):
+            self.icy_content_type = headerline[13:].strip()
+        elif len(headerline) == 0:
+            # Empty line terminates the header! Without icy-metaint, the stream has no metadata.
+            self._audio_bytes_until_metadata = self.icy_metadata_interval
+            self._in_header = False
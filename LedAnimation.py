@@ -0,0 +1,148 @@
+# Double-buffered animation on the AM03127 LED display module.
+#
+# A frame is 7 rows x 80 columns: the width of the display. It is stored in the first three blocks
+# of a graphics page (96 columns), and shown by a page that consists of the graphics block
+# directives <Gp1><Gp2><Gp3>. Two graphics pages are used: while one is shown, the next frame is
+# written into the other one. The display then flips to the new frame by changing the page content,
+# which is a single short command, so a frame is never shown half-written.
+
+import time, logging
+import numpy as np
+from LedDisplay import PageContent, LeadingEffect, LaggingEffect, DisplayMethod
+from LedGraphics import graphicsToArray, encodeGraphicsBlocks, ROWS, BLOCK_WIDTH
+
+FRAME_WIDTH  = 80
+FRAME_BLOCKS = 3 # Graphics blocks needed for one frame.
+
+def encodeFrames(frames):
+    """Encode frames ahead of time. Returns a list with a tuple of FRAME_BLOCKS graphics blocks (bytes) for each frame.
+
+       Each frame is given as a (7, 80) array of color codes, or as a string; see LedGraphics.graphicsToArray().
+    """
+
+    frames = [graphicsToArray(frame, FRAME_WIDTH) for frame in frames]
+
+    if len(frames) == 0:
+        return []
+
+    # Pad the frames to whole blocks, and encode all of them in one go.
+    padded = np.zeros((ROWS, len(frames), FRAME_BLOCKS * BLOCK_WIDTH), dtype = np.uint8)
+    padded[:, :, :FRAME_WIDTH] = np.stack(frames, axis = 1)
+
+    blocks = encodeGraphicsBlocks(padded.reshape(ROWS, -1)).reshape(len(frames), FRAME_BLOCKS, -1)
+
+    return [tuple(block.tobytes() for block in frame) for frame in blocks]
+
+class AnimationPlayer:
+    """Show pre-encoded frames on a line and page of the display, using two graphics pages."""
+
+    def __init__(self, led_display, line = 1, page = "A", graphics_pages = "AB"):
+        """The 'led_display' is a LedDisplay or a LedDisplayConnection."""
+
+        assert len(graphics_pages) == 2
+
+        self._logger = logging.getLogger("AnimationPlayer")
+
+        self._led_display = led_display
+
+        self._line = line
+        self._page = page
+
+        # Page content that shows each graphics page.
+        self._flip_pages = {}
+
+        for graphics_page in graphics_pages:
+            page_content = PageContent(line, page, LeadingEffect.IMMEDIATE, DisplayMethod.NORMAL, 0.5, LaggingEffect.HOLD)
+            for graphics_block in range(1, FRAME_BLOCKS + 1):
+                page_content.graphic(graphics_page, graphics_block)
+            self._flip_pages[graphics_page] = page_content
+
+        self._graphics_pages = list(graphics_pages)
+
+        # The frame blocks in each graphics page, as acknowledged by the device; None if unknown.
+        self._blocks = {graphics_page: [None] * FRAME_BLOCKS for graphics_page in graphics_pages}
+
+        self._shown_page = None
+
+        # Smoothed time needed to show a frame, in seconds.
+        self.frame_time = None
+
+        self.frames_shown = 0
+        self.blocks_sent  = 0
+
+    def invalidate(self):
+        """Forget what the device shows, e.g. after LedDisplay.deleteAll()."""
+        self._blocks = {graphics_page: [None] * FRAME_BLOCKS for graphics_page in self._graphics_pages}
+        self._shown_page = None
+
+    def show(self, frame):
+        """Show a frame, as returned by encodeFrames(). Returns the number of graphics blocks sent."""
+
+        start_time = time.monotonic()
+
+        # Write the frame into the graphics page that is not shown.
+
+        back_page = self._graphics_pages[0] if self._shown_page != self._graphics_pages[0] else self._graphics_pages[1]
+
+        back_blocks = self._blocks[back_page]
+
+        count = 0
+
+        for (index, data) in enumerate(frame):
+            if back_blocks[index] != data:
+                back_blocks[index] = None # Unknown, until acknowledged.
+                self._led_display.setGraphicsBlockData(back_page, index + 1, data)
+                back_blocks[index] = data
+                count += 1
+
+        # Flip.
+
+        self._led_display.setPageContent(self._flip_pages[back_page])
+
+        self._shown_page = back_page
+
+        elapsed = time.monotonic() - start_time
+
+        if self.frame_time is None:
+            self.frame_time = elapsed
+        else:
+            self.frame_time = 0.75 * self.frame_time + 0.25 * elapsed
+
+        self.frames_shown += 1
+        self.blocks_sent  += count
+
+        return count
+
+    def play(self, frames, fps = 10.0, repeat = 1):
+        """Show a sequence of frames, as returned by encodeFrames(), 'repeat' times.
+
+           Frames are shown at 'fps' frames per second, or slower if the link cannot keep up: the frame
+           interval adapts to the time measured for showing a frame. Returns the achieved frame rate.
+        """
+
+        start_time = time.monotonic()
+        count = 0
+
+        next_frame_time = start_time
+
+        for i in range(repeat):
+            for frame in frames:
+
+                delay = next_frame_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+                frame_start_time = time.monotonic()
+
+                self.show(frame)
+                count += 1
+
+                next_frame_time = frame_start_time + max(1.0 / fps, self.frame_time)
+
+        duration = time.monotonic() - start_time
+
+        achieved_fps = count / duration if duration > 0 else 0.0
+
+        self._logger.info("Showed {} frames in {:.3f} s ({:.2f} frames/s; requested {:.2f} frames/s).".format(count, duration, achieved_fps, fps))
+
+        return achieved_fps
@@ -0,0 +1,230 @@
+#! /usr/bin/env python3
+
+# Capture and replay of the serial traffic of the AM03127 LED display module.
+#
+# A capture file starts with the 8-byte signature b"LEDCAP1\n", followed by records. Each record
+# consists of a header (little-endian float64 timestamp in seconds since the start of the capture,
+# one direction byte: b"W" for data written to the device or b"R" for data read from it, and a
+# uint32 length) followed by the data.
+
+import sys, time, struct, logging
+from setup_logging import setup_logging
+from LedDisplay import LedDisplay, CommunicationError
+
+SIGNATURE = b"LEDCAP1\n"
+
+WRITE = b"W"
+READ  = b"R"
+
+_RecordHeader = struct.Struct("<dcI")
+
+class RecordingPort:
+    """Wrap a serial port, and record all data written to and read from it in a capture file.
+
+       Use it as the 'port' of a LedDisplay:
+
+           with RecordingPort(openTransport(device), "session.ledcap") as port, LedDisplay(device, port = port) as led_display:
+               ...
+
+       The wrapped port is closed when the RecordingPort is closed.
+    """
+
+    def __init__(self, port, filename):
+
+        self._port = port
+        self._file = open(filename, "wb")
+        self._file.write(SIGNATURE)
+
+        self._start_time = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._file is not None:
+            self.close()
+
+    def close(self):
+
+        assert self._file is not None
+
+        self._file.close()
+        self._file = None
+
+        self._port.close()
+
+    def _record(self, direction, data):
+        self._file.write(_RecordHeader.pack(time.monotonic() - self._start_time, direction, len(data)))
+        self._file.write(data)
+
+    def write(self, data):
+        self._record(WRITE, bytes(data))
+        return self._port.write(data)
+
+    def read(self, size = 1):
+        data = self._port.read(size)
+        if len(data) > 0:
+            self._record(READ, data)
+        return data
+
+    @property
+    def timeout(self):
+        return self._port.timeout
+
+    @timeout.setter
+    def timeout(self, timeout):
+        self._port.timeout = timeout
+
+    def __getattr__(self, name):
+        """Provide the other methods of the port (flush, reset_input_buffer, fileno, ...)."""
+        return getattr(self._port, name)
+
+def readCapture(filename):
+    """Read a capture file. Returns a list of (timestamp, direction, data) records."""
+
+    with open(filename, "rb") as f:
+        capture = f.read()
+
+    if not capture.startswith(SIGNATURE):
+        raise ValueError("{!r} is not a capture file.".format(filename))
+
+    records = []
+
+    offset = len(SIGNATURE)
+
+    while offset < len(capture):
+        if len(capture) - offset < _RecordHeader.size:
+            raise ValueError("Capture file {!r} is truncated.".format(filename))
+        (timestamp, direction, size) = _RecordHeader.unpack_from(capture, offset)
+        offset += _RecordHeader.size
+        records.append((timestamp, direction, capture[offset:offset + size]))
+        offset += size
+
+    if offset != len(capture):
+        raise ValueError("Capture file {!r} is truncated.".format(filename))
+
+    return records
+
+def capturedCommands(records, max_retry = LedDisplay.DEFAULT_RETRY):
+    """Return the (timestamp, data packet) of each command in a capture, leaving out retries and set-ID commands.
+
+       A frame that is written again before it was acknowledged is a retry, unless it was already written
+       'max_retry' times (the 'max_retry' of the captured session): then the command had failed, and the
+       frame was sent again deliberately.
+    """
+
+    commands = []
+
+    previous_frame = None
+    acknowledged = True
+    attempts = 0
+
+    for (timestamp, direction, data) in records:
+
+        if direction == READ:
+            if b"ACK" in data:
+                acknowledged = True
+            continue
+
+        if data == previous_frame and not acknowledged and attempts < max_retry:
+            attempts += 1
+            continue
+
+        previous_frame = data
+        acknowledged = False
+        attempts = 1
+
+        # Standard frames are <IDxx>, the data packet, two checksum digits, and <E>.
+        if data[:3] == b"<ID" and data[5:6] == b">" and data[-3:] == b"<E>":
+            commands.append((timestamp, data[6:-5]))
+
+    return commands
+
+def _waitUntil(start_time, timestamp, speed):
+    """Sleep until the moment 'timestamp' of the capture, played at 'speed' times the original speed."""
+
+    if speed is None:
+        return # As fast as possible.
+
+    delay = start_time + timestamp / speed - time.monotonic()
+
+    if delay > 0:
+        time.sleep(delay)
+
+def replayFrames(records, port, speed = 1.0):
+    """Write the captured frames to a port (e.g. of the emulator, or a mock port), without waiting for responses.
+
+       Frames are written at the captured moments, 'speed' times faster; if 'speed' is None, as fast as
+       possible. Returns the duration of the replay, in seconds.
+    """
+
+    start_time = time.monotonic()
+
+    for (timestamp, direction, data) in records:
+        if direction == WRITE:
+            _waitUntil(start_time, timestamp, speed)
+            port.write(data)
+
+    return time.monotonic() - start_time
+
+def replayCommands(records, led_display, speed = 1.0):
+    """Send the captured commands through a LedDisplay (or anything that provides send()).
+
+       This exercises the encoder, the retry logic, and any scheduling layer. Commands are sent at the
+       captured moments, 'speed' times faster, or later if the previous command is still busy; if 'speed'
+       is None, as fast as possible. Returns (duration in seconds, number of commands, number of failures).
+    """
+
+    commands = capturedCommands(records)
+
+    failures = 0
+
+    start_time = time.monotonic()
+
+    for (timestamp, data_packet) in commands:
+        _waitUntil(start_time, timestamp, speed)
+        try:
+            led_display.send(data_packet)
+        except CommunicationError:
+            failures += 1
+
+    return (time.monotonic() - start_time, len(commands), failures)
+
+def main():
+    """Replay a capture against the emulator: LedCapture.py <capture file> [speed | max]"""
+
+    from LedDisplayEmulator import LedDisplayEmulator
+
+    if len(sys.argv) not in (2, 3):
+        print("Usage: LedCapture.py <capture file> [speed | max]")
+        sys.exit(1)
+
+    filename = sys.argv[1]
+
+    if len(sys.argv) < 3:
+        speed = 1.0
+    elif sys.argv[2] == "max":
+        speed = None
+    else:
+        speed = float(sys.argv[2])
+
+    with setup_logging(level = logging.WARNING, noisy = False):
+
+        logger = logging.getLogger("main")
+        logger.setLevel(logging.INFO)
+
+        records = readCapture(filename)
+
+        logger.info("Capture {!r}: {} records, {:.3f} s.".format(filename, len(records), records[-1][0] if records else 0.0))
+
+        with LedDisplayEmulator() as emulator, LedDisplay(emulator.device) as led_display:
+
+            (duration, count, failures) = replayCommands(records, led_display, speed)
+
+            stats = led_display.stats
+
+        logger.info("Replayed {} commands in {:.3f} s ({} failures, {} retries, {} late ACKs).".format(
+            count, duration, failures, stats.retries, stats.late_acks))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# Custom European character tables of the AM03127 LED display module.
+
+import os, json, logging
+from LedDisplay import LedDisplay
+
+FONTS = "ABC"
+ENTRIES = 0x80 # Entries <U00> .. <U7F> of each font.
+ENTRY_SIZE = 8 # Bytes of font data per entry.
+
+class CharacterTableManager:
+    """Keep the custom character tables of a display up to date.
+
+       The manager keeps a copy of the custom entries that are on the device in a small JSON file.
+       On upload(), only the entries that differ from that copy are sent. The factory default table
+       is only recalled if an entry that is currently custom has to be restored.
+
+       If there is no cache file, the content of the device is unknown; the first upload() then
+       recalls the factory default table, unless all entries are given.
+    """
+
+    def __init__(self, led_display, cache_filename = None):
+        """The 'led_display' is a LedDisplay or a LedDisplayConnection."""
+
+        self._logger = logging.getLogger("CharacterTableManager")
+
+        self._led_display = led_display
+        self._cache_filename = cache_filename
+
+        self._entries = None # (fontSelect, fontEntry) -> font data of the custom entries on the device; None if unknown.
+
+        if self._cache_filename is not None and os.path.exists(self._cache_filename):
+            self._logger.debug("Loading character tables from {!r} ...".format(self._cache_filename))
+            try:
+                with open(self._cache_filename, "r") as f:
+                    self._entries = {(key[0], int(key[1:], 16)): bytes.fromhex(value) for (key, value) in json.load(f).items()}
+            except (OSError, ValueError, IndexError) as exception:
+                self._logger.warning("Unable to load character tables: {!r}".format(exception))
+
+    def invalidate(self):
+        """Forget what the device holds, e.g. after it was reprogrammed by other means."""
+        self._entries = None
+        self._save()
+
+    def _save(self):
+
+        if self._cache_filename is None:
+            return
+
+        if self._entries is None:
+            if os.path.exists(self._cache_filename):
+                os.remove(self._cache_filename)
+            return
+
+        temp_filename = self._cache_filename + ".tmp"
+
+        with open(temp_filename, "w") as f:
+            json.dump({"{}{:02X}".format(*key): value.hex() for (key, value) in self._entries.items()}, f, indent = 4, sort_keys = True)
+
+        os.replace(temp_filename, self._cache_filename)
+
+    @staticmethod
+    def _tableEntries(tables):
+        """Convert {fontSelect: table} to {(fontSelect, fontEntry): font data}.
+
+           A table holds the font data of consecutive entries, starting at entry 0x00.
+        """
+
+        entries = {}
+
+        for (fontSelect, table) in tables.items():
+
+            LedDisplay._checkFontSelect(fontSelect)
+
+            table = bytes(table)
+
+            if len(table) % ENTRY_SIZE != 0 or len(table) > ENTRIES * ENTRY_SIZE:
+                raise ValueError("Character table of font {} has an invalid size: {} bytes.".format(fontSelect, len(table)))
+
+            for fontEntry in range(len(table) // ENTRY_SIZE):
+                entries[(fontSelect, fontEntry)] = table[fontEntry * ENTRY_SIZE:(fontEntry + 1) * ENTRY_SIZE]
+
+        return entries
+
+    def upload(self, tables):
+        """Make the custom entries of the device equal to 'tables'; all other entries show the factory default.
+
+           The 'tables' map fonts ("A", "B", "C") to bytes; see _tableEntries(). Returns the number of commands sent.
+        """
+
+        wanted = self._tableEntries(tables)
+
+        count = 0
+
+        try:
+            if self._entries is None:
+                restore = len(wanted) < len(FONTS) * ENTRIES
+            else:
+                restore = any(key not in wanted for key in self._entries)
+
+            if restore:
+                self._recall()
+                count += 1
+
+            for (key, fontData) in sorted(wanted.items()):
+                if self._entries is not None and self._entries.get(key) == fontData:
+                    continue
+                (fontSelect, fontEntry) = key
+                if self._entries is not None:
+                    # Until the device acknowledges, the entry holds either the old or the new font data.
+                    self._entries[key] = b""
+                self._led_display.changeFactoryDefaultEuropeanCharacterTable(fontSelect, fontEntry, fontData)
+                if self._entries is not None:
+                    self._entries[key] = fontData
+                count += 1
+
+            if self._entries is None:
+                # All entries were sent, so we now know the content of the device.
+                self._entries = wanted
+        finally:
+            self._save()
+
+        self._logger.info("Character tables: {} of {} custom entries up to date, {} commands sent.".format(
+            len(wanted) - count + (1 if restore else 0), len(wanted), count))
+
+        return count
+
+    def restoreFactoryDefault(self):
+        """Recall the factory default character table, unless the device already uses it. Returns the number of commands sent."""
+
+        if self._entries is not None and len(self._entries) == 0:
+            return 0
+
+        try:
+            self._recall()
+        finally:
+            self._save()
+
+        return 1
+
+    def _recall(self):
+
+        # If the command fails, we don't know what the device holds.
+        self._entries = None
+
+        self._led_display.recallFactoryDefaultEuropeanCharacterTable()
+
+        self._entries = {}
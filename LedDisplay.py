@@ -3,7 +3,8 @@
 
 # The device has 16 elements of 7 rows x 5 columns == 7 rows x 80 columns
 
-import serial, operator, datetime, functools, re, logging
+import serial, datetime, logging, threading, time, codecs, collections, os, json, enum
+from LedTransport import openTransport
 
 class CommunicationError(Exception):
     """This exception is raised if a communication error is detected."""
@@ -17,10 +18,612 @@ Replacements = {
         "←" : "<U27>"
     }
 
+def _makeTranslationTable():
+    """Make a table that maps non-ASCII characters to <Uxx> directives.
+
+       The European character table of the device (<U00> .. <U7F>) follows the upper half of
+       the Windows-1252 code page, except for the arrows listed in the Replacements.
+    """
+
+    table = {}
+
+    for code in range(0x80, 0x100):
+        try:
+            character = bytes([code]).decode("cp1252")
+        except UnicodeDecodeError:
+            continue # Undefined in Windows-1252.
+        directive = "<U{:02X}>".format(code - 0x80)
+        if directive not in Replacements.values():
+            table[ord(character)] = directive
+
+    for (character, directive) in Replacements.items():
+        table[ord(character)] = directive
+
+    return table
+
+TranslationTable = _makeTranslationTable()
+
+def _encodeErrorHandler(exception, replacement):
+    """Codec error handler that substitutes the <Uxx> directives of the TranslationTable.
+
+       Using an error handler (rather than str.translate) keeps encoding of plain ASCII text in C.
+    """
+
+    directives = []
+
+    for character in exception.object[exception.start:exception.end]:
+        directive = TranslationTable.get(ord(character), replacement)
+        if directive is None:
+            raise exception
+        directives.append(directive)
+
+    return ("".join(directives), exception.end)
+
+codecs.register_error("leddisplay-strict" , lambda exception: _encodeErrorHandler(exception, None))
+codecs.register_error("leddisplay-replace", lambda exception: _encodeErrorHandler(exception, "?"))
+
+_CommandPrefixes = ["<ID{:02X}>".format(device_id).encode("ASCII") for device_id in range(256)]
+_CommandSuffixes = ["{:02X}<E>".format(checksum).encode("ASCII") for checksum in range(256)]
+
+def encodeMessage(message, errors = "strict"):
+    """Encode a message string to bytes, using <Uxx> directives for European characters.
+
+       Other non-ASCII characters raise a UnicodeEncodeError (errors = "strict") or are
+       replaced by a question mark (errors = "replace").
+    """
+
+    if errors not in ("strict", "replace"):
+        raise ValueError("{!r} is not a valid error handling scheme.".format(errors))
+
+    return message.encode("ASCII", "leddisplay-" + errors)
+
+def checksum(data_packet):
+    """Calculate the XOR of all bytes in the data packet.
+
+       Rather than processing one byte at a time, the data packet is converted to a single integer
+       that is repeatedly folded in half.
+    """
+
+    size = len(data_packet)
+    value = int.from_bytes(data_packet, "little")
+
+    while size > 1:
+        half = (size + 1) // 2
+        value = (value & ((1 << (8 * half)) - 1)) ^ (value >> (8 * half))
+        size = half
+
+    return value
+
+def pageSlot(data_packet):
+    """Return the (line, page) of a page content command (<Ln><Pn>...), or None for other commands.
+
+       The data packet can be given as a string or as bytes.
+    """
+
+    if isinstance(data_packet, str):
+        data_packet = data_packet[:8].encode("ASCII", errors = "replace")
+
+    if data_packet[:2] == b"<L" and data_packet[3:6] == b"><P" and data_packet[7:8] == b">":
+        return (data_packet[2:3].decode(), data_packet[6:7].decode())
+
+    return None
+
+def frameCommand(device_id, data_packet):
+    """Assemble a standard packet: <IDxx>, the data packet, the checksum, and <E>."""
+    return _CommandPrefixes[device_id] + data_packet + _CommandSuffixes[checksum(data_packet)]
+
+class DeviceStateMirror:
+    """Mirror of the configuration of a display, as acknowledged by the device.
+
+       The mirror records brightness, default run page, schedules, page contents, graphics blocks
+       and custom font entries. A LedDisplay that uses a mirror skips commands that would not change
+       anything. The mirror can be kept in a small JSON file, so it survives restarts; the LedDisplay
+       saves it after each change. Note that it cannot notice changes made to the device by other means.
+    """
+
+    def __init__(self, filename = None):
+
+        self._logger = logging.getLogger("DeviceStateMirror")
+
+        self._filename = filename
+        self._state = {} # key -> data packet of the command that set the state
+
+        if self._filename is not None and os.path.exists(self._filename):
+            self._logger.debug("Loading device state from {!r} ...".format(self._filename))
+            try:
+                with open(self._filename, "r") as f:
+                    self._state = {key: bytes.fromhex(value) for (key, value) in json.load(f).items()}
+            except (OSError, ValueError) as exception:
+                self._logger.warning("Unable to load device state: {!r}".format(exception))
+
+        self._modified = False
+
+    @staticmethod
+    def key(data_packet):
+        """Return the key of the state set by a command, or None if the command does not set mirrored state."""
+
+        slot = pageSlot(data_packet)
+
+        if slot is not None:
+            return "page {}{}".format(*slot)
+
+        command = data_packet[:6]
+
+        if command[:2] == b"<T" and command[3:4] == b">":
+            return "schedule {}".format(command[2:3].decode())
+        if command[:2] == b"<G" and command[4:5] == b">":
+            return "graphics {}".format(command[2:4].decode())
+        if command[:2] == b"<F" and command[5:6] == b">":
+            return "font {}".format(command[2:5].decode())
+        if command[:2] == b"<B" and command[3:4] == b">":
+            return "brightness"
+        if command[:3] == b"<RP" and command[4:5] == b">":
+            return "default run page"
+
+        return None
+
+    def isRedundant(self, data_packet):
+        """Return True if the command would not change the state of the device."""
+
+        key = self.key(data_packet)
+
+        return key is not None and self._state.get(key) == data_packet
+
+    def acknowledged(self, data_packet):
+        """Update the mirror with a command that was acknowledged by the device."""
+
+        key = self.key(data_packet)
+
+        if key is not None:
+            self._state[key] = data_packet
+        elif data_packet[:3] == b"<DL":
+            # <DLnPn>
+            self._state.pop("page {}{}".format(data_packet[3:4].decode(), data_packet[5:6].decode()), None)
+        elif data_packet[:3] == b"<DT":
+            self._state.pop("schedule {}".format(data_packet[3:4].decode()), None)
+        elif data_packet == b"<D*>":
+            self._state.clear()
+        elif data_packet == b"<DU>":
+            self._state = {key: value for (key, value) in self._state.items() if not key.startswith("font ")}
+        else:
+            return
+
+        self._modified = True
+
+    def forget(self, data_packet):
+        """Forget the state set by a command that may or may not have been executed by the device."""
+
+        key = self.key(data_packet)
+
+        if key is not None:
+            if self._state.pop(key, None) is not None:
+                self._modified = True
+        elif data_packet[:2] == b"<D":
+            # A delete command may have removed anything.
+            self.invalidate()
+
+    def invalidate(self):
+        """Forget everything we know about the device."""
+        self._state.clear()
+        self._modified = True
+
+    def save(self):
+        """Write the mirror to its file, if it has one and it was modified."""
+
+        if self._filename is None or not self._modified:
+            return
+
+        self._logger.debug("Saving device state to {!r} ...".format(self._filename))
+
+        temp_filename = self._filename + ".tmp"
+
+        with open(temp_filename, "w") as f:
+            json.dump({key: value.hex() for (key, value) in self._state.items()}, f, indent = 4, sort_keys = True)
+
+        os.replace(temp_filename, self._filename)
+
+        self._modified = False
+
+# Types of commands, by the start of their data packet. See commandType().
+_CommandTypes = [
+        (b"<L" , "page"            ),
+        (b"<T" , "schedule"        ),
+        (b"<G" , "graphics"        ),
+        (b"<SC", "clock"           ),
+        (b"<B" , "brightness"      ),
+        (b"<D" , "delete"          ),
+        (b"<F" , "font"            ),
+        (b"<RP", "default run page")
+    ]
+
+def commandType(command):
+    """Return the type of a framed command ("page", "schedule", "graphics", "clock", ...), for statistics."""
+
+    if command[:5] == b"<ID><":
+        return "device id"
+
+    data_packet = command[6:] # Skip <IDxx>.
+
+    for (prefix, command_type) in _CommandTypes:
+        if data_packet.startswith(prefix):
+            return command_type
+
+    return "other"
+
+class LatencyHistogram:
+    """Cumulative histogram of latencies, with the bucket boundaries used by Prometheus."""
+
+    BUCKETS = (0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1) # The last bucket is +Inf.
+        self.count  = 0
+        self.sum    = 0.0
+
+    def observe(self, latency):
+
+        for (i, bound) in enumerate(self.BUCKETS):
+            if latency <= bound:
+                break
+        else:
+            i = len(self.BUCKETS)
+
+        self.counts[i] += 1
+        self.count     += 1
+        self.sum       += latency
+
+    def cumulativeCounts(self):
+        """Return a list of (upper bound, number of latencies <= upper bound); the last upper bound is infinite."""
+
+        result = []
+        total = 0
+
+        for (bound, count) in zip(self.BUCKETS + (float("inf"), ), self.counts):
+            total += count
+            result.append((bound, total))
+
+        return result
+
+def _observeAckLatency(statistics, latency):
+    """Update the smoothed ACK latency and its mean deviation, like TCP calculates its round trip time."""
+
+    if statistics.ack_latency is None:
+        statistics.ack_latency = latency
+        statistics.ack_latency_deviation = latency / 2
+    else:
+        statistics.ack_latency_deviation = 0.75 * statistics.ack_latency_deviation + 0.25 * abs(latency - statistics.ack_latency)
+        statistics.ack_latency = 0.875 * statistics.ack_latency + 0.125 * latency
+
+class CommandStatistics:
+    """Counters of a single type of command."""
+
+    def __init__(self):
+
+        self.count         = 0 # Commands sent, not counting retries.
+        self.bytes_written = 0 # Including retries.
+        self.retries       = 0
+        self.timeouts      = 0 # Attempts that received no response at all.
+        self.errors        = 0 # Commands that failed with a CommunicationError.
+
+        self.latency = LatencyHistogram() # Time from writing the command until the response was received.
+
+        # Smoothed ACK latency (excluding wire time) and its mean deviation, in seconds.
+        # Some commands (e.g. deletes, graphics blocks) take the device much longer than others.
+        self.ack_latency           = None
+        self.ack_latency_deviation = None
+
+    def observeAckLatency(self, latency):
+        _observeAckLatency(self, latency)
+
+    def snapshot(self):
+        return {
+            "count"         : self.count,
+            "bytes_written" : self.bytes_written,
+            "retries"       : self.retries,
+            "timeouts"      : self.timeouts,
+            "errors"        : self.errors,
+            "latency"       : {
+                "buckets" : [["+Inf" if bound == float("inf") else bound, count] for (bound, count) in self.latency.cumulativeCounts()],
+                "count"   : self.latency.count,
+                "sum"     : self.latency.sum
+            }
+        }
+
+def _prometheusLabels(labels):
+    escaped = ("{}=\"{}\"".format(name, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) for (name, value) in labels.items())
+    return "{" + ",".join(escaped) + "}" if labels else ""
+
+class LinkStatistics:
+    """Counters of the serial link to the display: retries, resynchronizations, and ACK latency.
+
+       The counters per command type are in 'by_type'; see commandType().
+    """
+
+    def __init__(self):
+
+        self.commands    = 0   # Commands sent, not counting retries.
+        self.retries     = 0
+        self.late_acks   = 0   # Responses found while resynchronizing.
+        self.resyncs     = 0
+        self.resync_time = 0.0 # Total time spent resynchronizing, in seconds.
+
+        # Smoothed ACK latency (excluding wire time) and its mean deviation, in seconds,
+        # calculated like TCP calculates its round trip time.
+        self.ack_latency           = None
+        self.ack_latency_deviation = None
+
+        self.by_type = {} # command type -> CommandStatistics
+
+        self.start_time = time.monotonic()
+
+    def commandStatistics(self, command):
+        """Return the CommandStatistics of the type of a framed command."""
+
+        command_type = commandType(command)
+
+        command_statistics = self.by_type.get(command_type)
+
+        if command_statistics is None:
+            command_statistics = self.by_type[command_type] = CommandStatistics()
+
+        return command_statistics
+
+    def observeAckLatency(self, latency):
+        _observeAckLatency(self, latency)
+
+    def snapshot(self):
+        """Return the statistics as a dictionary that can be serialized as JSON."""
+
+        return {
+            "uptime"      : time.monotonic() - self.start_time,
+            "commands"    : self.commands,
+            "retries"     : self.retries,
+            "late_acks"   : self.late_acks,
+            "resyncs"     : self.resyncs,
+            "resync_time" : self.resync_time,
+            "by_type"     : {command_type: command_statistics.snapshot() for (command_type, command_statistics) in sorted(self.by_type.items())}
+        }
+
+    def prometheusText(self, labels = {}):
+        """Return the statistics in the Prometheus text exposition format. The 'labels' are added to all samples."""
+
+        lines = []
+
+        def metric(name, metric_type, description, samples):
+            lines.append("# HELP leddisplay_{} {}".format(name, description))
+            lines.append("# TYPE leddisplay_{} {}".format(name, metric_type))
+            for (suffix, sample_labels, value) in samples:
+                lines.append("leddisplay_{}{}{} {}".format(name, suffix, _prometheusLabels(dict(labels, **sample_labels)), repr(float(value))))
+
+        def per_type(attribute):
+            return [("", {"command": command_type}, getattr(command_statistics, attribute)) for (command_type, command_statistics) in sorted(self.by_type.items())]
+
+        metric("commands_total"     , "counter", "Commands sent, not counting retries.", per_type("count"))
+        metric("bytes_written_total", "counter", "Bytes written, including retries.", per_type("bytes_written"))
+        metric("retries_total"      , "counter", "Commands that were sent again.", per_type("retries"))
+        metric("timeouts_total"     , "counter", "Attempts that received no response.", per_type("timeouts"))
+        metric("errors_total"       , "counter", "Commands that were not acknowledged after all retries.", per_type("errors"))
+
+        samples = []
+
+        for (command_type, command_statistics) in sorted(self.by_type.items()):
+            histogram = command_statistics.latency
+            for (bound, count) in histogram.cumulativeCounts():
+                samples.append(("_bucket", {"command": command_type, "le": "+Inf" if bound == float("inf") else repr(bound)}, count))
+            samples.append(("_sum"  , {"command": command_type}, histogram.sum))
+            samples.append(("_count", {"command": command_type}, histogram.count))
+
+        metric("ack_latency_seconds", "histogram", "Time from writing a command until its response was received.", samples)
+
+        metric("late_acks_total"  , "counter", "Responses found while resynchronizing.", [("", {}, self.late_acks)])
+        metric("resync_seconds_total", "counter", "Time spent resynchronizing.", [("", {}, self.resync_time)])
+
+        return "\n".join(lines) + "\n"
+
+    def save(self, filename, labels = {}):
+        """Write the statistics to a file: Prometheus text format if the filename ends in ".prom", else JSON.
+
+           The file is replaced atomically, so it can be read by e.g. the node exporter textfile collector.
+        """
+
+        temp_filename = filename + ".tmp"
+
+        with open(temp_filename, "w") as f:
+            if filename.endswith(".prom"):
+                f.write(self.prometheusText(labels))
+            else:
+                json.dump(dict(self.snapshot(), labels = labels), f, indent = 4)
+
+        os.replace(temp_filename, filename)
+
+class LeadingEffect(enum.Enum):
+    """Paragraph 4.2.2: leading effect of a page (<FX>)."""
+    IMMEDIATE       = "A"
+    XOPEN           = "B"
+    CURTAIN_UP      = "C"
+    CURTAIN_DOWN    = "D"
+    SCROLL_LEFT     = "E"
+    SCROLL_RIGHT    = "F"
+    VOPEN           = "G"
+    HOPEN           = "H"
+    SCROLL_UP       = "I"
+    SCROLL_DOWN     = "J"
+    HOLD            = "K"
+    SNOW            = "L"
+    TWINKLE         = "M"
+    BLOCK_MOVE      = "N"
+    RANDOM          = "P"
+    PEN_HELLO_WORLD = "Q"
+    PEN_WELCOME     = "R"
+    PEN_AMPLUS      = "S"
+
+class LaggingEffect(enum.Enum):
+    """Paragraph 4.2.2: lagging effect of a page (<FY>)."""
+    IMMEDIATE    = "A"
+    XOPEN        = "B"
+    CURTAIN_UP   = "C"
+    CURTAIN_DOWN = "D"
+    SCROLL_LEFT  = "E"
+    SCROLL_RIGHT = "F"
+    VOPEN        = "G"
+    HOPEN        = "H"
+    SCROLL_UP    = "I"
+    SCROLL_DOWN  = "J"
+    HOLD         = "K"
+
+class DisplayMethod(enum.Enum):
+    """Paragraph 4.2.2: display method while waiting (<MX>); this also selects the speed of the effects."""
+    NORMAL        = "A"
+    BLINKING      = "B"
+    SONG_1        = "C"
+    SONG_2        = "D"
+    SONG_3        = "E"
+    SPEED_SLOWEST = "Q"
+    SPEED_SLOW    = "R"
+    SPEED_MEDIUM  = "S"
+    SPEED_FAST    = "T"
+
+class Color(enum.Enum):
+    """Paragraph 4.2.2.7.3: color of the following characters (<CX>)."""
+    DIM_RED         = "A"
+    RED             = "B"
+    BRIGHT_RED      = "C"
+    DIM_GREEN       = "D"
+    GREEN           = "E"
+    BRIGHT_GREEN    = "F"
+    DIM_ORANGE      = "G"
+    ORANGE          = "H"
+    BRIGHT_ORANGE   = "I"
+    YELLOW          = "J"
+    LIME            = "K"
+    INVERSE_RED     = "L"
+    INVERSE_GREEN   = "M"
+    INVERSE_ORANGE  = "N"
+    ORANGE_ON_GREEN = "O"
+    RED_ON_GREEN    = "P"
+    GREEN_ON_RED    = "Q"
+    RASTA           = "R"
+    SPARKLY         = "S"
+
+class Font(enum.Enum):
+    """Paragraph 4.2.2.7.1: font of the following characters (<AX>)."""
+    NORMAL            = "A" # 5x7
+    BOLD              = "B" # 6x7
+    NARROW            = "C" # 4x7
+    LARGE_TOP_HALF    = "D" # 7x13
+    LARGE_BOTTOM_HALF = "E" # 7x13
+    TOP_PART          = "F" # 6x8
+
+# Maximum size of a page content data packet (<Ln><Pn>... up to and including the message), in bytes.
+MAX_PAGE_CONTENT_LENGTH = 239
+
+def _checkEnum(enum_type, value):
+    if isinstance(value, enum_type):
+        return value.value
+    raise ValueError("{!r} is not a valid {}.".format(value, enum_type.__name__))
+
+class PageContent:
+    """Builder of a page content command (paragraph 4.2.2).
+
+       The page header is given to the constructor; the message is built by adding runs of text
+       and directives, e.g.:
+
+           PageContent(1, "A", LeadingEffect.SCROLL_LEFT).font(Font.NARROW).color(Color.GREEN).text("Hello").time()
+
+       All values are validated as they are added; a ValueError is raised if the content would exceed
+       MAX_PAGE_CONTENT_LENGTH. The compiled data packet is cached until the content is changed.
+    """
+
+    def __init__(self, line = 1, page = "A", leading = LeadingEffect.IMMEDIATE, method = DisplayMethod.NORMAL,
+                 wait = 1, lagging = LaggingEffect.IMMEDIATE):
+        """Make an empty page. The 'wait' time is 0.5 seconds, or a whole number of seconds from 1 to 25."""
+
+        if wait == 0.5:
+            wait_code = "A"
+        elif isinstance(wait, int) and (1 <= wait <= 25):
+            wait_code = chr(ord("A") + wait)
+        else:
+            raise ValueError("{} is not a valid wait time.".format(wait))
+
+        self.line = LedDisplay._checkLine(line)
+        self.page = LedDisplay._checkPage(page)
+
+        self._header = "<L{}><P{}><F{}><M{}><W{}><F{}>".format(
+            self.line, self.page, _checkEnum(LeadingEffect, leading), _checkEnum(DisplayMethod, method),
+            wait_code, _checkEnum(LaggingEffect, lagging)).encode("ASCII")
+
+        self._runs = []
+        self._length = len(self._header)
+        self._compiled = None
+
+    def __len__(self):
+        """Return the size of the compiled data packet, in bytes."""
+        return self._length
+
+    def _append(self, run):
+
+        if self._length + len(run) > MAX_PAGE_CONTENT_LENGTH:
+            raise ValueError("Page content exceeds {} bytes.".format(MAX_PAGE_CONTENT_LENGTH))
+
+        self._runs.append(run)
+        self._length += len(run)
+        self._compiled = None
+
+        return self
+
+    def text(self, text, errors = "strict"):
+        """Add text. European characters are sent as <Uxx> directives; see encodeMessage()."""
+        return self._append(encodeMessage(text, errors))
+
+    def color(self, color):
+        return self._append("<C{}>".format(_checkEnum(Color, color)).encode("ASCII"))
+
+    def font(self, font):
+        return self._append("<A{}>".format(_checkEnum(Font, font)).encode("ASCII"))
+
+    def bell(self, duration = 0.5):
+        """Sound the bell for 0.5 to 13.0 seconds, in steps of 0.5 seconds."""
+
+        steps = duration * 2
+
+        if steps != int(steps) or not (1 <= steps <= 26):
+            raise ValueError("{} is not a valid bell duration.".format(duration))
+
+        return self._append("<B{}>".format(chr(ord("A") + int(steps) - 1)).encode("ASCII"))
+
+    def date(self):
+        return self._append(b"<KD>")
+
+    def time(self):
+        return self._append(b"<KT>")
+
+    def graphic(self, graphicsPage, graphicsBlock):
+        """Show a graphics block; see LedDisplay.setGraphicsBlock()."""
+        return self._append("<G{}{}>".format(LedDisplay._checkGraphicsPage(graphicsPage), LedDisplay._checkGraphicsBlock(graphicsBlock)).encode("ASCII"))
+
+    def compile(self):
+        """Return the data packet, as bytes."""
+
+        if self._compiled is None:
+            self._compiled = self._header + b"".join(self._runs)
+
+        return self._compiled
+
 class LedDisplay:
 
     DEFAULT_RETRY = 3
 
+    BAUDRATE = 9600
+
+    # Lower bound of the adaptive response timeout, excluding the wire time.
+    MIN_RESPONSE_MARGIN = 0.05
+
+    # Commands sent to the broadcast ID are executed by all devices on the bus, but not acknowledged.
+    BROADCAST_ID = 0
+
+    # Time we give the devices to execute a broadcast command, since we cannot wait for an ACK.
+    BROADCAST_GAP = 0.1
+
     @staticmethod
     def _checkDeviceId(deviceId):
         if isinstance(deviceId, int) and (1 <= deviceId <= 8):
@@ -35,7 +638,7 @@ class LedDisplay:
 
     @staticmethod
     def _checkPage(page):
-        if isinstance(page, str) and (len(page) == 1) and ("A" <= page <= "E"):
+        if isinstance(page, str) and (len(page) == 1) and ("A" <= page <= "Z"):
             return page
         raise ValueError("{} is not a valid page.".format(page))
 
@@ -65,29 +668,80 @@ class LedDisplay:
             return graphicsPage
         raise ValueError("{} is not a valid graphicsPage.".format(graphicsPage))
 
+    @staticmethod
+    def _checkFontSelect(fontSelect):
+        if isinstance(fontSelect, str) and (len(fontSelect) == 1) and ("A" <= fontSelect <= "C"):
+            return fontSelect
+        raise ValueError("{} is not a valid font.".format(fontSelect))
+
+    @staticmethod
+    def _checkFontEntry(fontEntry):
+        if isinstance(fontEntry, int) and (0 <= fontEntry <= 0x7F):
+            return fontEntry
+        raise ValueError("{} is not a valid font entry.".format(fontEntry))
+
     @staticmethod
     def _checkGraphicsBlock(graphicsBlock):
         if isinstance(graphicsBlock, int) and (1 <= graphicsBlock <= 8):
             return graphicsBlock
         raise ValueError("{} is not a valid graphics block.".format(graphicsBlock))
 
-    @staticmethod
-    def _checkGraphics(graphics):
-        if isinstance(graphics, str) and re.match("^[RGBO]{224}$", graphics):
-            return graphics
-        raise ValueError("{} is not valid graphics data.".format(graphics))
+    def __init__(self, device, device_id = 1, timeout = 1.0, frame_cache_size = 0, suppress_duplicates = False,
+                 resync_gap = 0.05, adaptive_timeout = False, state_mirror = None, port = None, baudrate = BAUDRATE):
+        """Open the display.
 
-    def __init__(self, device, device_id = 1, timeout = 1.0):
+           The 'device' is a serial device, or a URL such as "socket://host:port"; see LedTransport.openTransport().
+
+           If 'device_id' is BROADCAST_ID, commands are sent to all devices on the bus; they are not
+           acknowledged, so failures go unnoticed.
+
+           If an open transport is given as 'port', it is used instead of opening 'device'. This allows
+           several LedDisplay instances to share one bus; the port is not closed by close().
+
+           After an unexpected response, the link is resynchronized by reading until the line has been
+           quiet for 'resync_gap' seconds. If 'resync_gap' is None, we wait for the full timeout instead.
+
+           If 'adaptive_timeout' is True, the time we wait for a response is derived from the ACK latency
+           observed so far, rather than always being 'timeout'.
+
+           If 'frame_cache_size' is positive, up to that many framed commands are kept in an LRU cache,
+           so repeated commands skip encoding, checksum calculation and framing.
+
+           If a DeviceStateMirror is given as 'state_mirror', commands that would not change the state of
+           the device (page contents, schedules, graphics blocks, ...) are not sent. If 'suppress_duplicates'
+           is True and no mirror is given, a mirror that is not saved to a file is used.
+        """
 
         self._logger = logging.getLogger("LedDisplay {!r}".format(device))
 
         self._device    = device
-        self._device_id = self._checkDeviceId(device_id)
+        self._device_id = device_id if device_id == self.BROADCAST_ID else self._checkDeviceId(device_id)
         self._timeout   = timeout
+        self._baudrate  = baudrate
+
+        self._frame_cache_size = frame_cache_size
+        self._frame_cache = collections.OrderedDict() if frame_cache_size > 0 else None
+        self.frame_cache_hits   = 0
+        self.frame_cache_misses = 0
+
+        if state_mirror is None and suppress_duplicates:
+            state_mirror = DeviceStateMirror()
 
-        self._logger.debug("Opening serial port ...")
+        self._state_mirror = state_mirror
+        self.suppressed_count = 0
 
-        self._port = serial.Serial(self._device, 9600, serial.EIGHTBITS, serial.PARITY_NONE, serial.STOPBITS_ONE, self._timeout, False, False)
+        self._resync_gap = resync_gap
+        self._adaptive_timeout = adaptive_timeout
+
+        self.stats = LinkStatistics()
+
+        self._owns_port = port is None
+
+        if self._owns_port:
+            self._logger.debug("Opening transport ...")
+            port = openTransport(self._device, self._baudrate, self._timeout)
+
+        self._port = port
 
     def __del__(self):
 
@@ -106,79 +760,235 @@ class LedDisplay:
 
         assert self._port is not None
 
-        self._logger.debug("Closing serial port ...")
+        if self._owns_port:
+            self._logger.debug("Closing serial port ...")
+            self._port.close()
 
-        self._port.close()
         self._port = None
 
+        if self._state_mirror is not None:
+            self._state_mirror.save()
+
+    def _frame(self, data_packet):
+        """Encode and frame a data packet, using the frame cache if enabled.
+
+           Returns a tuple (encoded data packet, framed command).
+        """
+
+        if self._frame_cache is not None:
+            key = (self._device_id, data_packet)
+            entry = self._frame_cache.get(key)
+            if entry is not None:
+                self._frame_cache.move_to_end(key)
+                self.frame_cache_hits += 1
+                return entry
+            self.frame_cache_misses += 1
+
+        if isinstance(data_packet, str):
+            encoded = encodeMessage(data_packet)
+        else:
+            encoded = data_packet
+
+        assert isinstance(encoded, bytes)
+
+        entry = (encoded, frameCommand(self._device_id, encoded))
+
+        if self._frame_cache is not None:
+            self._frame_cache[key] = entry
+            if len(self._frame_cache) > self._frame_cache_size:
+                self._frame_cache.popitem(last = False)
+
+        return entry
+
+    def _prepare(self, data_packet):
+        """Prepare a data packet for sending.
+
+           Returns a tuple (encoded data packet, framed command), or None if the command can be skipped.
+        """
+
+        (data_packet, command) = self._frame(data_packet)
+
+        if self._state_mirror is not None and self._state_mirror.isRedundant(data_packet):
+            self._logger.debug("Suppressing command that does not change the device state: %r", command)
+            self.suppressed_count += 1
+            return None
+
+        return (data_packet, command)
+
+    def _acknowledged(self, data_packet):
+        """Process a data packet that was acknowledged by the device."""
+
+        if self._state_mirror is not None:
+            self._state_mirror.acknowledged(data_packet)
+            # Save right away, so the file is up to date even if we do not get to close().
+            self._state_mirror.save()
+
+    def _failed(self, data_packet):
+        """Process a data packet that was not acknowledged by the device."""
+
+        if self._state_mirror is not None:
+            self._state_mirror.forget(data_packet)
+            self._state_mirror.save()
+
     def send(self, data_packet, max_retry = DEFAULT_RETRY):
         """Assemble standard packet and send command."""
 
-        if isinstance(data_packet, str):
-            for (a, b) in Replacements.items():
-                data_packet = data_packet.replace(a, b)
-            data_packet = data_packet.encode("ASCII")
+        prepared = self._prepare(data_packet)
 
-        assert isinstance(data_packet, bytes)
+        if prepared is None:
+            return
 
-        checksum = functools.reduce(operator.__xor__, data_packet, 0)
+        (data_packet, command) = prepared
 
-        command_prefix = "<ID{:02X}>".format(self._device_id).encode()
-        command_suffix = "{:02X}<E>".format(checksum).encode()
+        if self._device_id == self.BROADCAST_ID:
+            self._broadcast(command)
+            return
 
-        command = command_prefix + data_packet + command_suffix
+        try:
+            self._exchange(command, b"ACK", max_retry)
+        except (CommunicationError, serial.SerialException, OSError):
+            # The device may or may not have executed the command.
+            self._failed(data_packet)
+            raise
 
-        expected_response = "ACK".encode("ASCII")
+        self._acknowledged(data_packet)
 
-        # Try up to "max_retry" times...
+    def _broadcast(self, command):
+        """Send a command to all devices on the bus. No response is expected."""
 
-        for i in range(max_retry):
+        self.stats.commands += 1
 
-            self._logger.info("Sending to device: {!r}".format(command))
-            self._port.write(command)
+        command_statistics = self.stats.commandStatistics(command)
+        command_statistics.count += 1
 
-            response = self._port.read(3)
+        self._logger.info("Broadcasting: %r", command)
 
-            if response == expected_response:
-                self._logger.debug("Received expected response: {!r}.".format(response))
-                break # Success!
+        self._port.reset_input_buffer()
+        self._port.write(command)
 
-            response = response + self._port.read(1000) # Read garbage, if any (will timeout).
+        command_statistics.bytes_written += len(command)
+        self._port.flush() # Wait until the command has been transmitted.
 
-            self._logger.warning("Received unexpected response: {!r}".format(response))
+        time.sleep(self.BROADCAST_GAP)
+
+    def wireTime(self, size):
+        """Return the time needed to transfer 'size' bytes over the serial link (8N1: 10 bits per byte)."""
+        return size * 10.0 / self._baudrate
+
+    def _responseTimeout(self, command, expected_response):
+        """Return how long to wait for the response to a command."""
+
+        if not self._adaptive_timeout:
+            return self._timeout
+
+        # The ACK latency depends on the type of command; until it is known, wait the full timeout.
+        command_statistics = self.stats.commandStatistics(command)
 
+        if command_statistics.ack_latency is None:
+            return self._timeout
+
+        margin = max(command_statistics.ack_latency + 4.0 * command_statistics.ack_latency_deviation, self.MIN_RESPONSE_MARGIN)
+
+        return min(self.wireTime(len(command) + len(expected_response)) + margin, self._timeout)
+
+    def _responseReceived(self, command, response, elapsed):
+        """Update the ACK latency statistics with the time between writing a command and receiving its response."""
+        latency = max(0.0, elapsed - self.wireTime(len(command) + len(response)))
+        self.stats.observeAckLatency(latency)
+        self.stats.commandStatistics(command).observeAckLatency(latency)
+
+    def _read(self, size, timeout):
+        """Read up to 'size' bytes; return fewer bytes if the timeout expires."""
+
+        if self._port.timeout != timeout:
+            self._port.timeout = timeout
+
+        return self._port.read(size)
+
+    def _resync(self):
+        """Read and return garbage from the serial port, until the line goes quiet."""
+
+        start_time = time.monotonic()
+
+        if self._resync_gap is None:
+            garbage = self._read(1000, self._timeout) # Read garbage, if any (will timeout).
         else:
-            # If we get here, we didn't get an ACK after retries.
-            raise CommunicationError("Command {!r} was not acknowledged by device.".format(command))
+            garbage = b""
+            while time.monotonic() - start_time < self._timeout:
+                data = self._read(1000, self._resync_gap)
+                if len(data) == 0:
+                    break # The line is quiet.
+                garbage += data
 
-    def setDeviceId(self, new_device_id, max_retry = DEFAULT_RETRY):
-        """Paragraph 4.1: ID setting.
-           Note that we cannot use the standard send() routine here. The "set ID" command
-           is special because it lacks an ID number and a checksum."""
+        self.stats.resyncs += 1
+        self.stats.resync_time += time.monotonic() - start_time
 
-        command = "<ID><{:02X}><E>".format(new_device_id).encode("ASCII")
+        return garbage
 
-        expected_response = "{:02X}".format(new_device_id).encode("ASCII")
+    def _exchange(self, command, expected_response, max_retry):
+        """Send a command and wait for the expected response; retry up to 'max_retry' times."""
+
+        self.stats.commands += 1
+
+        command_statistics = self.stats.commandStatistics(command)
+        command_statistics.count += 1
 
         # Try up to "max_retry" times...
 
         for i in range(max_retry):
 
-            self._logger.info("Sending to device: {!r}".format(command))
+            if i > 0:
+                self.stats.retries += 1
+                command_statistics.retries += 1
+
+            # Log messages are formatted lazily; this is on the hot path.
+            self._logger.info("Sending to device: %r", command)
+
+            # Discard stale input, e.g. a response that arrived after we gave up waiting for it.
+            self._port.reset_input_buffer()
+
+            write_time = time.monotonic()
             self._port.write(command)
 
-            response = self._port.read(2)
+            command_statistics.bytes_written += len(command)
+
+            response = self._read(len(expected_response), self._responseTimeout(command, expected_response))
 
             if response == expected_response:
-                self._logger.debug("Received expected response: {!r}.".format(response))
-                break # Success!
+                elapsed = time.monotonic() - write_time
+                self._responseReceived(command, response, elapsed)
+                command_statistics.latency.observe(elapsed)
+                self._logger.debug("Received expected response: %r.", response)
+                return # Success!
 
-            response = response + self._port.read(1000) # Read garbage, if any (will timeout).
-            self._logger.warning("Received unexpected response: {!r}.".format(response))
+            if len(response) == 0:
+                command_statistics.timeouts += 1
 
-        else:
-            # If we get here, we didn't get an acknowledgement.
-            raise CommunicationError("Command {!r} was not acknowledged by device.".format(command))
+            response = response + self._resync()
+
+            if response == expected_response:
+                # The response was late; the command did arrive. A response preceded by garbage is not
+                # trusted: the garbage may be an unrelated response, or a corrupted one.
+                self.stats.late_acks += 1
+                self._logger.warning("Received late response: {!r}".format(response))
+                return
+
+            self._logger.warning("Received unexpected response: {!r}".format(response))
+
+        # If we get here, we didn't get an acknowledgement after retries.
+        command_statistics.errors += 1
+        raise CommunicationError("Command {!r} was not acknowledged by device.".format(command))
+
+    def setDeviceId(self, new_device_id, max_retry = DEFAULT_RETRY):
+        """Paragraph 4.1: ID setting.
+           Note that we cannot use the standard send() routine here. The "set ID" command
+           is special because it lacks an ID number and a checksum."""
+
+        command = "<ID><{:02X}><E>".format(new_device_id).encode("ASCII")
+
+        expected_response = "{:02X}".format(new_device_id).encode("ASCII")
+
+        return self._exchange(command, expected_response, max_retry)
 
     def setRealtimeClock(self, timestamp = None):
         """ Paragraph 4.2.1: Real Time Clock Setting"""
@@ -197,7 +1007,7 @@ class LedDisplay:
             timestamp.second
         )
 
-        self.send(command)
+        return self.send(command)
 
     def setPageContent(self, content):
         """
@@ -209,9 +1019,9 @@ class LedDisplay:
         MX display method while waiting
         WX wait
         FY lagging effect
-        """
 
-        assert False # TODO: implement and test
+        The content is given as a PageContent.
+        """
 
         # Leading command:
         #   A immediate             Message will be immediately displayed
@@ -290,6 +1100,7 @@ class LedDisplay:
 
         #     <CT>, <CU>, <CV>, <CW>, <CX>, <CY>, <CZ>: red (out-of-spec)
 
+        return self.send(content.compile())
 
     def setSchedule(self, schedule, pages, startTime = None, stopTime = None):
         """ Paragraph 4.2.3: Sending Schedule"""
@@ -318,7 +1129,7 @@ class LedDisplay:
             stopTime.minute,
             self._checkSchedulePages(pages)
         )
-        self.send(command)
+        return self.send(command)
 
     def setGraphicsBlock(self, graphicsPage, graphicsBlock, graphics):
         """ Paragraph 4.2.4: Send Graphic Block"""
@@ -350,73 +1161,75 @@ class LedDisplay:
         # 14  15  30  31  46  47  62  63 --> pixels of this row (row 8) are not used.
         #
         # We expect the graphics specified in a string of length 7x32 (== 224), consisting
-        # of the letters "B", "G", "R", "O", for Black, Green, Red, and Orange, respectively.
+        # of the letters "B", "G", "R", "O", for Black, Green, Red, and Orange, respectively,
+        # or as a (7, 32) array of color codes (see the LedGraphics module).
 
-        graphics = graphics.replace(".", "B")
+        # The LedGraphics module depends on numpy; we only need it for graphics commands.
+        import LedGraphics
 
-        self._checkGraphics(graphics)
+        data = LedGraphics.encodeGraphicsBlocks(LedGraphics.graphicsToArray(graphics, LedGraphics.BLOCK_WIDTH))[0]
 
-        gr = []
-        for i in range(64):
+        return self.setGraphicsBlockData(graphicsPage, graphicsBlock, data.tobytes())
 
-            # Determine (px, py) as coordinates pointing into the 'graphics' array.
+    def setGraphicsBlockData(self, graphicsPage, graphicsBlock, data):
+        """ Paragraph 4.2.4: Send Graphic Block, with the 64 bytes of graphics data already encoded."""
 
-            px = (i % 2) + (i // 16) * 2
-            # 0 1 0 1 0 1 0 1 0 1 0 1 0 1 0 1
-            # 2 3 2 3 2 3 2 3 2 3 2 3 2 3 2 3
-            # 4 5 4 5 4 5 4 5 4 5 4 5 4 5 4 5
-            # 6 7 6 7 6 7 6 7 6 7 6 7 6 7 6 7
+        if not (isinstance(data, bytes) and len(data) == 64):
+            raise ValueError("{!r} is not valid graphics block data.".format(data))
 
-            py = (i // 2) % 8
-            # 0 0 1 1 2 2 3 3 4 4 5 5 6 6 7 7
-            # 0 0 1 1 2 2 3 3 4 4 5 5 6 6 7 7
-            # 0 0 1 1 2 2 3 3 4 4 5 5 6 6 7 7
-            # 0 0 1 1 2 2 3 3 4 4 5 5 6 6 7 7
+        command_prefix = "<G{}{}>".format(self._checkGraphicsPage(graphicsPage), self._checkGraphicsBlock(graphicsBlock)).encode("ASCII")
+        command = command_prefix + data
 
-            if py == 7:
-                pixels = "BBBB"
-            else:
-                pixels = graphics[py * 32 + 4 * px:py * 32 + 4 * px + 4]
+        return self.send(command)
+
+    @staticmethod
+    def _encodeGraphicsPage(graphicsPage, image):
+        """Encode a graphics page into a list of (graphicsBlock, data) tuples."""
 
-            v = 0
-            for p in pixels:
-                v *= 4
-                if p in "GO": v += 1
-                if p in "RO": v += 2
+        import LedGraphics
 
-            gr.append(v)
+        LedDisplay._checkGraphicsPage(graphicsPage)
 
-        print("v -->", gr)
+        blocks = LedGraphics.encodeGraphicsBlocks(LedGraphics.graphicsToArray(image, LedGraphics.PAGE_WIDTH))
 
-        command_prefix = "<G{}{}>".format(self._checkGraphicsPage(graphicsPage), self._checkGraphicsBlock(graphicsBlock)).encode("ASCII")
-        command = command_prefix + bytes(gr)
+        return [(graphicsBlock, data.tobytes()) for (graphicsBlock, data) in enumerate(blocks, 1)]
 
-        self.send(command)
+    def setGraphicsPage(self, graphicsPage, image):
+        """Send all 8 graphics blocks of a graphics page.
+
+           The image is a (7, 256) array of color codes, or a string of 7x256 (== 1792) "RGBO." letters.
+        """
+
+        for (graphicsBlock, data) in self._encodeGraphicsPage(graphicsPage, image):
+            self.setGraphicsBlockData(graphicsPage, graphicsBlock, data)
 
     def deletePage(self, line, page):
         """Paragraph 4.2.5.1: Delete page"""
         command = "<DL%sP%s>" % (self._checkLine(line), self._checkPage(page))
-        self.send(command)
+        return self.send(command)
 
     def deleteSchedule(self, schedule):
         """Paragraph 4.2.5.2: Delete schedule"""
         command = "<DT%s>" % self._checkSchedule(schedule)
-        self.send(command)
+        return self.send(command)
 
     def deleteAll(self):
         """Paragraph 4.2.5.3: Delete all"""
+        if self._state_mirror is not None:
+            # Whether or not the command succeeds, we can no longer trust the mirror.
+            self._state_mirror.invalidate()
         command = "<D*>"
-        self.send(command)
+        return self.send(command)
 
     def setDefaultRunPage(self, page):
         """Paragraph 4.2.6: Assign a default run page"""
         command = "<RP%s>" % self._checkPage(page)
-        self.send(command)
+        return self.send(command)
 
     def setBrightnessLevel(self, brightness):
         """Paragraph 4.2.7: Assign Display Brightness level"""
         command = "<B%s>" % self._checkBrightness(brightness)
-        self.send(command)
+        return self.send(command)
 
     def changeFactoryDefaultEuropeanCharacterTable(self, fontSelect, fontEntry, fontData):
         """Paragraph 4.2.8: Change factory default European char table"""
@@ -425,12 +1238,122 @@ class LedDisplay:
         # The "A" (normal) alphabet increases the column index by 6. The glyph takes up the 5 leftmost bits, by convention.
         # The "B" (wide)   alphabet increases the column index by 7. The glyph takes up the 6 leftmost bits, by convention.
         # The "C" (tight)  alphabet increases the column index by 5. The glyph takes up the 4 leftmost bits, by convention.
+        #
+        # The font entry (0x00 .. 0x7F) is the character shown by the <Uxx> directive. The font data is 8 bytes, one for
+        # each row, top to bottom; the most significant bit is the leftmost pixel. It can be given as bytes, or (for
+        # backward compatibility) as a string of chr() values.
+
+        if isinstance(fontData, str):
+            fontData = fontData.encode("latin-1")
 
-        assert len(fontData) == 8
-        command = "<F%s%02X>%s" % (fontSelect, fontEntry, fontData)
-        self.send(command)
+        fontData = bytes(fontData)
+
+        if len(fontData) != 8:
+            raise ValueError("Font data should be 8 bytes, got {}.".format(len(fontData)))
+
+        command = "<F{}{:02X}>".format(self._checkFontSelect(fontSelect), self._checkFontEntry(fontEntry)).encode("ASCII") + fontData
+        return self.send(command)
 
     def recallFactoryDefaultEuropeanCharacterTable(self):
         """Paragraph 4.2.9: Recall factory default European char table"""
         command = "<DU>"
-        self.send(command)
+        return self.send(command)
+
+class LedDisplayConnection:
+    """Keep a single LedDisplay open for the lifetime of the process.
+
+       The display is opened lazily on first use. If the serial port fails (e.g., because the USB
+       device was unplugged), the display is closed and transparently reopened on the next attempt.
+       A connection can be shared by several users; operations are serialized by a lock.
+    """
+
+    def __init__(self, device, reopen_interval = 5.0, **options):
+        """The 'options' are passed to the LedDisplay constructor."""
+
+        self._logger = logging.getLogger("LedDisplayConnection {!r}".format(device))
+
+        self._device          = device
+        self._options         = options
+        self._reopen_interval = reopen_interval
+
+        self._lock = threading.RLock()
+        self._led_display = None
+        self._last_open_failure_time = None
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self._closed:
+            self.close()
+
+    def close(self):
+
+        with self._lock:
+            assert not self._closed
+            self._closeDisplay()
+            self._closed = True
+
+    def _closeDisplay(self):
+
+        if self._led_display is not None:
+            try:
+                self._led_display.close()
+            except (serial.SerialException, OSError) as exception:
+                self._logger.warning("Error while closing display: {!r}".format(exception))
+            self._led_display = None
+
+    def _openDisplay(self):
+
+        if self._led_display is None:
+
+            if self._last_open_failure_time is not None and time.monotonic() - self._last_open_failure_time < self._reopen_interval:
+                raise CommunicationError("Display {!r} is unavailable.".format(self._device))
+
+            self._logger.info("Opening display ...")
+
+            try:
+                self._led_display = LedDisplay(self._device, **self._options)
+            except (serial.SerialException, OSError) as exception:
+                self._last_open_failure_time = time.monotonic()
+                raise CommunicationError("Unable to open display {!r}: {}".format(self._device, exception)) from exception
+
+            self._last_open_failure_time = None
+
+        return self._led_display
+
+    def execute(self, operation, *args, **kwargs):
+        """Execute operation(led_display, *args, **kwargs) on the shared display.
+
+           If the serial port fails, the display is reopened and the operation is tried once more.
+        """
+
+        with self._lock:
+
+            assert not self._closed
+
+            for attempt in range(2):
+
+                led_display = self._openDisplay()
+
+                try:
+                    return operation(led_display, *args, **kwargs)
+                except (serial.SerialException, OSError) as exception:
+                    self._logger.warning("Serial port failure: {!r}; closing display.".format(exception))
+                    self._closeDisplay()
+                    if attempt > 0:
+                        raise CommunicationError("Display {!r} failed: {}".format(self._device, exception)) from exception
+
+    def __getattr__(self, name):
+        """Provide the LedDisplay command methods (send, setSchedule, ...) on the connection."""
+
+        if name.startswith("_") or not callable(getattr(LedDisplay, name, None)):
+            raise AttributeError(name)
+
+        method = getattr(LedDisplay, name)
+
+        def execute_method(*args, **kwargs):
+            return self.execute(method, *args, **kwargs)
+
+        return execute_method
@@ -0,0 +1,378 @@
+#! /usr/bin/env python3
+
+# Emulator for the AM03127 LED display module.
+#
+# The emulator opens a pseudo-terminal and behaves like a display attached to the slave side of it.
+# A LedDisplay instance can be pointed at the slave device name, so the complete serial path
+# (framing, checksums, acknowledgements, retries) can be exercised without hardware.
+
+import os, tty, select, threading, time, random, re, logging
+
+class LedDisplayEmulator:
+    """Emulate an AM03127 LED display behind a pseudo-terminal.
+
+       The emulator verifies framing and checksums, answers "ACK" after a configurable delay,
+       simulates the wire time of the serial link, and can drop or garble its responses.
+       The effect of acknowledged commands is kept in a simple model of the device state.
+    """
+
+    BROADCAST_ID = 0
+
+    # Commands that carry binary data have a fixed length; all other commands are ASCII text.
+    _FixedLengthCommands = {
+            b"<G" : 5 + 64, # <Gpn> followed by 64 bytes of graphics data
+            b"<F" : 6 +  8  # <Fsnn> followed by 8 bytes of font data
+        }
+
+    _SetIdRegexp   = re.compile(rb"<ID><([0-9A-F]{2})><E>")
+    _PrefixRegexp  = re.compile(rb"<ID([0-9A-F]{2})>")
+
+    _PageRegexp             = re.compile(rb"<L([1-8])><P([A-Z])>")
+    _ScheduleRegexp         = re.compile(rb"<T([A-E])>(\d{10})(\d{10})([A-Z]*)$")
+    _GraphicsRegexp         = re.compile(rb"<G([A-P])([1-8])>", re.DOTALL)
+    _DeletePageRegexp       = re.compile(rb"<DL([1-8])P([A-Z])>$")
+    _DeleteScheduleRegexp   = re.compile(rb"<DT([A-E])>$")
+    _DefaultRunPageRegexp   = re.compile(rb"<RP([A-Z])>$")
+    _BrightnessRegexp       = re.compile(rb"<B([A-D])>$")
+    _ClockRegexp            = re.compile(rb"<SC>(\d{14})$")
+    _FontRegexp             = re.compile(rb"<F([A-C])([0-9A-F]{2})>", re.DOTALL)
+
+    def __init__(self, device_id = 1, baudrate = 9600, ack_delay = 0.0, command_delays = None,
+                 drop_probability = 0.0, garble_probability = 0.0, frame_timeout = 0.5, seed = None):
+
+        self._logger = logging.getLogger("LedDisplayEmulator")
+
+        self.device_id          = device_id
+        self.baudrate           = baudrate
+        self.ack_delay          = ack_delay
+        self.command_delays     = {} if command_delays is None else dict(command_delays)
+        self.drop_probability   = drop_probability
+        self.garble_probability = garble_probability
+        self.frame_timeout      = frame_timeout
+
+        self._random = random.Random(seed)
+
+        # Model of the device state.
+
+        self._lock = threading.Lock()
+
+        self.pages            = {} # (line, page) -> content
+        self.schedules        = {} # schedule -> (start, stop, pages)
+        self.graphics_blocks  = {} # (graphicsPage, graphicsBlock) -> 64 bytes of graphics data
+        self.font_entries     = {} # (fontSelect, fontEntry) -> 8 bytes of font data
+        self.brightness       = None
+        self.default_run_page = None
+        self.clock            = None
+        self.unknown_commands = []
+
+        # Traffic log and counters.
+
+        self.commands           = [] # (time, data packet) of each acknowledged command
+        self.frame_count        = 0
+        self.ignored_frames     = 0
+        self.checksum_errors    = 0
+        self.garbage_bytes      = 0
+        self.dropped_responses  = 0
+        self.garbled_responses  = 0
+
+        # Open the pseudo-terminal. We keep the slave side open ourselves, so reading the
+        # master side does not fail while no client has the device open.
+
+        (self._master_fd, self._slave_fd) = os.openpty()
+        tty.setraw(self._slave_fd)
+
+        self.device = os.ttyname(self._slave_fd)
+
+        self._logger.debug("Emulating display on {!r} ...".format(self.device))
+
+        self._buffer = bytearray()
+        self._frame_start_time = None
+        self._last_data_time = None
+        self._wire_free_time = time.monotonic()
+
+        self._stop_requested = False
+        self._thread = threading.Thread(target = self._run, name = "LedDisplayEmulator", daemon = True)
+        self._thread.start()
+
+    def __del__(self):
+
+        if self._thread is not None:
+            self._logger.error("The __del__ method of class LedDisplayEmulator was called while the emulator was still active. Please use explicit close() method.")
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._thread is not None:
+            self.close()
+
+    def close(self):
+
+        assert self._thread is not None
+
+        self._logger.debug("Stopping emulator ...")
+
+        self._stop_requested = True
+        self._thread.join()
+        self._thread = None
+
+        os.close(self._master_fd)
+        os.close(self._slave_fd)
+
+    def wireTime(self, size):
+        """Return the time needed to transfer 'size' bytes (8N1: 10 bits per byte)."""
+        return size * 10.0 / self.baudrate
+
+    def _run(self):
+
+        while not self._stop_requested:
+
+            (rlist, wlist, xlist) = select.select([self._master_fd], [], [], 0.05)
+
+            current_time = time.monotonic()
+
+            if rlist:
+                data = os.read(self._master_fd, 4096)
+                if len(self._buffer) == 0:
+                    self._frame_start_time = max(current_time, self._wire_free_time)
+                self._buffer.extend(data)
+                self._last_data_time = current_time
+            elif len(self._buffer) > 0 and current_time - self._last_data_time > self.frame_timeout:
+                # The line went quiet while we hold an incomplete frame; discard it.
+                self._logger.warning("Discarding incomplete frame: {!r}".format(bytes(self._buffer)))
+                self.garbage_bytes += len(self._buffer)
+                del self._buffer[:]
+
+            self._processBuffer()
+
+    def _processBuffer(self):
+
+        PREFIX_SIZE = 6 # <IDxx>
+
+        while True:
+
+            idx = self._buffer.find(b"<ID")
+
+            if idx < 0:
+                # Keep the last two bytes; they may be the start of a "<ID" prefix.
+                garbage = max(0, len(self._buffer) - 2)
+                self.garbage_bytes += garbage
+                del self._buffer[:garbage]
+                return
+
+            if idx > 0:
+                self.garbage_bytes += idx
+                del self._buffer[:idx]
+
+            if self._buffer.startswith(b"<ID><"):
+                # Paragraph 4.1: ID setting.
+                if len(self._buffer) < 11:
+                    return # Need more data.
+                match = self._SetIdRegexp.match(self._buffer)
+                if match is None:
+                    self._discardByte()
+                    continue
+                frame_size = match.end()
+                new_device_id = int(match.group(1), 16)
+                del self._buffer[:frame_size]
+                self._handleSetId(new_device_id, frame_size)
+                continue
+
+            if len(self._buffer) < PREFIX_SIZE:
+                return # Need more data.
+
+            match = self._PrefixRegexp.match(self._buffer)
+            if match is None:
+                self._discardByte()
+                continue
+
+            data_packet_size = self._FixedLengthCommands.get(bytes(self._buffer[PREFIX_SIZE:PREFIX_SIZE + 2]))
+
+            if data_packet_size is not None:
+                if len(self._buffer) < PREFIX_SIZE + data_packet_size + 5:
+                    return # Need more data.
+                if self._buffer[PREFIX_SIZE + data_packet_size + 2:PREFIX_SIZE + data_packet_size + 5] != b"<E>":
+                    self._discardByte()
+                    continue
+            else:
+                idx = self._buffer.find(b"<E>", PREFIX_SIZE)
+                if idx < 0:
+                    return # Need more data.
+                data_packet_size = idx - 2 - PREFIX_SIZE
+                if data_packet_size < 0:
+                    self._discardByte()
+                    continue
+
+            frame_size = PREFIX_SIZE + data_packet_size + 5
+
+            device_id   = int(match.group(1), 16)
+            data_packet = bytes(self._buffer[PREFIX_SIZE:PREFIX_SIZE + data_packet_size])
+            checksum    = bytes(self._buffer[PREFIX_SIZE + data_packet_size:PREFIX_SIZE + data_packet_size + 2])
+
+            del self._buffer[:frame_size]
+
+            self._handleFrame(device_id, data_packet, checksum, frame_size)
+
+    def _discardByte(self):
+        self.garbage_bytes += 1
+        del self._buffer[:1]
+
+    def _frameReceived(self, frame_size):
+        """Wait until the frame would have been completely received at the emulated baud rate."""
+
+        frame_end_time = self._frame_start_time + self.wireTime(frame_size)
+        self._frame_start_time = frame_end_time
+
+        delay = frame_end_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _respond(self, response, delay):
+
+        if delay > 0:
+            time.sleep(delay)
+
+        if self._random.random() < self.drop_probability:
+            self._logger.debug("Dropping response {!r}.".format(response))
+            self.dropped_responses += 1
+            return
+
+        if self._random.random() < self.garble_probability:
+            garbled = bytes(self._random.randrange(256) for i in range(len(response) + self._random.randrange(4)))
+            if garbled != response:
+                self._logger.debug("Garbling response {!r} to {!r}.".format(response, garbled))
+                self.garbled_responses += 1
+                response = garbled
+
+        os.write(self._master_fd, response)
+
+        # The response occupies the line for its own wire time.
+        self._wire_free_time = time.monotonic() + self.wireTime(len(response))
+        time.sleep(self.wireTime(len(response)))
+
+    def _handleSetId(self, new_device_id, frame_size):
+
+        self._frameReceived(frame_size)
+        self.frame_count += 1
+
+        self._logger.debug("Changing device ID from {} to {}.".format(self.device_id, new_device_id))
+        self.device_id = new_device_id
+
+        self._respond("{:02X}".format(new_device_id).encode("ASCII"), self.ack_delay)
+
+    def _handleFrame(self, device_id, data_packet, checksum, frame_size):
+
+        self._frameReceived(frame_size)
+        self.frame_count += 1
+
+        if device_id != self.device_id and device_id != self.BROADCAST_ID:
+            self.ignored_frames += 1
+            return
+
+        expected_checksum = 0
+        for b in data_packet:
+            expected_checksum ^= b
+
+        if checksum != "{:02X}".format(expected_checksum).encode("ASCII"):
+            self._logger.warning("Bad checksum {!r} for data packet {!r}.".format(checksum, data_packet))
+            self.checksum_errors += 1
+            return
+
+        with self._lock:
+            self.commands.append((time.monotonic(), data_packet))
+            self._apply(data_packet)
+
+        if device_id == self.BROADCAST_ID:
+            return # Broadcast commands are not acknowledged.
+
+        delay = self.command_delays.get(data_packet[1:2].decode("ASCII", errors = "replace"), self.ack_delay)
+
+        self._respond(b"ACK", delay)
+
+    def _apply(self, data_packet):
+        """Update the device model according to an accepted command."""
+
+        match = self._PageRegexp.match(data_packet)
+        if match:
+            self.pages[(int(match.group(1)), match.group(2).decode())] = data_packet[match.end():]
+            return
+
+        match = self._ScheduleRegexp.match(data_packet)
+        if match:
+            self.schedules[match.group(1).decode()] = (match.group(2).decode(), match.group(3).decode(), match.group(4).decode())
+            return
+
+        match = self._GraphicsRegexp.match(data_packet)
+        if match:
+            self.graphics_blocks[(match.group(1).decode(), int(match.group(2)))] = data_packet[match.end():]
+            return
+
+        match = self._FontRegexp.match(data_packet)
+        if match:
+            self.font_entries[(match.group(1).decode(), int(match.group(2), 16))] = data_packet[match.end():]
+            return
+
+        match = self._DeletePageRegexp.match(data_packet)
+        if match:
+            self.pages.pop((int(match.group(1)), match.group(2).decode()), None)
+            return
+
+        match = self._DeleteScheduleRegexp.match(data_packet)
+        if match:
+            self.schedules.pop(match.group(1).decode(), None)
+            return
+
+        if data_packet == b"<D*>":
+            self.pages.clear()
+            self.schedules.clear()
+            self.graphics_blocks.clear()
+            return
+
+        if data_packet == b"<DU>":
+            self.font_entries.clear()
+            return
+
+        match = self._DefaultRunPageRegexp.match(data_packet)
+        if match:
+            self.default_run_page = match.group(1).decode()
+            return
+
+        match = self._BrightnessRegexp.match(data_packet)
+        if match:
+            self.brightness = match.group(1).decode()
+            return
+
+        match = self._ClockRegexp.match(data_packet)
+        if match:
+            self.clock = match.group(1).decode()
+            return
+
+        self.unknown_commands.append(data_packet)
+
+def main():
+
+    import sys
+    from setup_logging import setup_logging
+
+    if "--debug" in sys.argv[1:]:
+        log_level = logging.DEBUG
+    else:
+        log_level = logging.INFO
+
+    with setup_logging(level = log_level):
+
+        logger = logging.getLogger("main")
+
+        with LedDisplayEmulator() as emulator:
+
+            logger.info("Emulated display available as {!r}.".format(emulator.device))
+
+            try:
+                while True:
+                    time.sleep(1.0)
+            except KeyboardInterrupt:
+                logger.info("Quitting by user request.")
+
+if __name__ == "__main__":
+    main()
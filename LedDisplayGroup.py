@@ -0,0 +1,144 @@
+# Send commands to a group of AM03127 LED display modules, on one or more serial ports.
+
+import logging, concurrent.futures, serial
+from LedDisplay import LedDisplay, CommunicationError
+from LedTransport import openTransport
+
+class LedDisplayGroup:
+    """Send the same commands to several displays.
+
+       Each serial port (bus) has its own worker thread, so the ports are served in parallel, while the
+       commands on a single bus are sent one after another, to each display in turn. Updating a bus
+       with N displays therefore takes about N times as long as updating a single display.
+
+       If 'broadcast' is True, a command for a bus with more than one display is sent once, to the
+       broadcast ID. Only then does updating the group take about as long as updating one display
+       per bus. The devices do not acknowledge broadcast commands, so failures go unnoticed.
+    """
+
+    def __init__(self, displays, broadcast = False, **options):
+        """Open the displays.
+
+           The 'displays' map serial devices (or transport URLs) to lists of device IDs, e.g.
+           {"/dev/ttyUSB0": [1, 2, 3], "socket://pi-hallway:4001": [1]}.
+
+           The 'options' are passed to the LedDisplay constructor. A DeviceStateMirror describes a single
+           device, so it cannot be given as an option.
+        """
+
+        assert "state_mirror" not in options
+
+        self._logger = logging.getLogger("LedDisplayGroup")
+
+        self._ports     = {} # device -> serial port
+        self._displays  = {} # device -> list of (device ID, LedDisplay)
+        self._broadcast = {} # device -> LedDisplay for the broadcast ID, or None
+        self._executors = {} # device -> single-threaded executor
+
+        try:
+            for (device, device_ids) in displays.items():
+
+                port = openTransport(device, options.get("baudrate", LedDisplay.BAUDRATE), options.get("timeout", 1.0))
+
+                self._ports[device] = port
+
+                self._displays[device] = [(device_id, LedDisplay(device, device_id, port = port, **options)) for device_id in device_ids]
+
+                if broadcast and len(device_ids) > 1:
+                    self._broadcast[device] = LedDisplay(device, LedDisplay.BROADCAST_ID, port = port, **options)
+                else:
+                    self._broadcast[device] = None
+
+                self._executors[device] = concurrent.futures.ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "LedDisplayGroup {!r}".format(device))
+        except:
+            self.close()
+            raise
+
+    def __del__(self):
+
+        if self._ports:
+            self._logger.error("The __del__ method of class LedDisplayGroup was called while the displays were still open. Please use explicit close() method.")
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._ports:
+            self.close()
+
+    def close(self):
+        """Wait for pending commands, then close all displays and serial ports."""
+
+        for executor in self._executors.values():
+            executor.shutdown()
+
+        for device in list(self._ports):
+
+            for (device_id, led_display) in self._displays.get(device, []):
+                led_display.close()
+
+            if self._broadcast.get(device) is not None:
+                self._broadcast[device].close()
+
+            self._ports.pop(device).close()
+
+        self._executors = {}
+
+    def _executeBus(self, device, name, args, kwargs):
+        """Execute a command on all displays of a bus. Returns a dict (device, device ID) -> exception or None."""
+
+        results = {}
+
+        broadcast_display = self._broadcast[device]
+
+        if broadcast_display is not None:
+            targets = [(LedDisplay.BROADCAST_ID, broadcast_display, [device_id for (device_id, led_display) in self._displays[device]])]
+        else:
+            targets = [(device_id, led_display, [device_id]) for (device_id, led_display) in self._displays[device]]
+
+        for (target_id, led_display, device_ids) in targets:
+
+            try:
+                getattr(led_display, name)(*args, **kwargs)
+            except (CommunicationError, serial.SerialException, OSError) as exception:
+                self._logger.error("Command {}{!r} failed on {!r}, device ID {}: {!r}".format(name, args, device, target_id, exception))
+                result = exception
+            else:
+                result = None
+
+            for device_id in device_ids:
+                results[(device, device_id)] = result
+
+        return results
+
+    def execute(self, name, *args, **kwargs):
+        """Execute the LedDisplay method 'name' on all displays, in parallel for all serial ports.
+
+           Returns a dict that maps (device, device ID) to None if the command succeeded, or to the
+           exception if it failed. A failing display does not prevent the command from being sent to
+           the other displays.
+        """
+
+        assert self._ports
+
+        futures = [self._executors[device].submit(self._executeBus, device, name, args, kwargs) for device in self._ports]
+
+        results = {}
+
+        for future in futures:
+            results.update(future.result())
+
+        return results
+
+    def __getattr__(self, name):
+        """Provide the LedDisplay command methods (send, setSchedule, ...) on the group."""
+
+        # Giving all displays the same device ID makes no sense.
+        if name.startswith("_") or name in ("close", "setDeviceId") or not callable(getattr(LedDisplay, name, None)):
+            raise AttributeError(name)
+
+        def execute_method(*args, **kwargs):
+            return self.execute(name, *args, **kwargs)
+
+        return execute_method
@@ -0,0 +1,279 @@
+# Priority scheduler for the serial link of the AM03127 LED display module.
+
+import threading, heapq, itertools, time, logging, concurrent.futures
+from LedDisplay import LedDisplay, encodeMessage
+from LedTransport import FakeTransport
+
+# Priority classes, most urgent first.
+
+ALERT  = 0
+CLOCK  = 1
+NORMAL = 2
+BULK   = 3
+
+PriorityNames = {ALERT: "alert", CLOCK: "clock", NORMAL: "normal", BULK: "bulk"}
+
+# Default priority of the LedDisplay command methods; other methods are NORMAL.
+DefaultPriorities = {
+        "setRealtimeClock"                           : CLOCK,
+        "setGraphicsBlock"                           : BULK,
+        "setGraphicsBlockData"                       : BULK,
+        "setGraphicsPage"                            : BULK,
+        "changeFactoryDefaultEuropeanCharacterTable" : BULK
+    }
+
+# Framing overhead of a command (<IDxx>, checksum, <E>) and the size of the ACK, in bytes.
+FRAMING_SIZE  = 6 + 2 + 3
+RESPONSE_SIZE = 3
+
+class _CommandRecorder(LedDisplay):
+    """Runs a LedDisplay command method without a device, to collect the data packets it sends."""
+
+    def __init__(self):
+
+        # Initialize all state that the command methods may use, on a transport that is never used.
+        LedDisplay.__init__(self, "recorder", port = FakeTransport())
+
+        # There is nothing to close.
+        self._port = None
+
+        self.data_packets = []
+
+    def send(self, data_packet, max_retry = LedDisplay.DEFAULT_RETRY):
+        self.data_packets.append(data_packet)
+
+class QueueingDelay:
+    """Time that commands of one priority class spent waiting in the queue."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max   = 0.0
+
+    def observe(self, delay):
+        self.count += 1
+        self.total += delay
+        self.max = max(self.max, delay)
+
+    def mean(self):
+        return self.total / self.count if self.count > 0 else 0.0
+
+class LedDisplayScheduler:
+    """Send display commands from a worker thread, by priority, within a link time budget.
+
+       Each command is charged its estimated link time: the wire time of the framed command and its
+       ACK at 'baudrate', plus the ACK latency measured so far. A token bucket, refilled at
+       'max_utilization' seconds per second and holding at most 'burst' seconds, keeps the link
+       utilization under the limit. After a command has been sent, the bucket is charged the time the
+       command actually took.
+
+       Commands of a more urgent priority class are sent first. Command methods that send several
+       data packets (e.g. setGraphicsPage) are queued as separate commands, so an alert or clock
+       update can overtake a bulk graphics upload that is in progress.
+
+       Delete commands (<D...>) are barriers: they are sent after all commands queued before them, and
+       before all commands queued after them, whatever their priorities. Otherwise an urgent delete
+       could overtake the upload of the content it deletes, and that content would reappear.
+    """
+
+    def __init__(self, led_display, max_utilization = 0.8, burst = 1.0, baudrate = LedDisplay.BAUDRATE):
+        """The 'led_display' is a LedDisplay or a LedDisplayConnection."""
+
+        assert 0.0 < max_utilization <= 1.0
+
+        self._logger = logging.getLogger("LedDisplayScheduler")
+
+        self._led_display = led_display
+
+        self._max_utilization = max_utilization
+        self._baudrate = baudrate
+        self._burst = burst
+
+        self._tokens = burst
+        self._token_time = time.monotonic()
+
+        self._ack_latency = 0.0 # Smoothed ACK latency (excluding wire time), in seconds.
+
+        self._condition = threading.Condition()
+        self._queue = [] # Heap of (epoch, order, sequence number, priority, submit time, data packet, future)
+        self._sequence = itertools.count()
+        self._epoch = 0 # Incremented after each barrier.
+        self._stop_requested = False
+
+        self.queueing_delays = {priority: QueueingDelay() for priority in PriorityNames}
+
+        self._thread = threading.Thread(target = self._run, name = "LedDisplayScheduler", daemon = True)
+        self._thread.start()
+
+    def __del__(self):
+
+        if self._thread is not None:
+            self._logger.error("The __del__ method of class LedDisplayScheduler was called while the scheduler was still active. Please use explicit close() method.")
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._thread is not None:
+            self.close()
+
+    def close(self):
+        """Send all pending commands, then stop the worker thread."""
+
+        assert self._thread is not None
+
+        with self._condition:
+            self._stop_requested = True
+            self._condition.notify_all()
+
+        self._thread.join()
+        self._thread = None
+
+        for (priority, delay) in sorted(self.queueing_delays.items()):
+            if delay.count > 0:
+                self._logger.info("Queueing delay of {} commands: {} commands, mean {:.3f} s, max {:.3f} s.".format(
+                    PriorityNames[priority], delay.count, delay.mean(), delay.max))
+
+    def linkTime(self, data_packet):
+        """Estimate the link time of a command, in seconds."""
+
+        if isinstance(data_packet, str):
+            size = len(encodeMessage(data_packet, errors = "replace"))
+        else:
+            size = len(data_packet)
+
+        return (size + FRAMING_SIZE + RESPONSE_SIZE) * 10.0 / self._baudrate + self._ack_latency
+
+    def send(self, data_packet, priority = NORMAL):
+        """Queue a command. Returns a concurrent.futures.Future that completes when the device has acknowledged it."""
+
+        future = concurrent.futures.Future()
+
+        with self._condition:
+
+            assert not self._stop_requested
+
+            if data_packet[:2] in ("<D", b"<D"):
+                # A barrier goes after all commands of the current epoch; later commands start a new epoch.
+                heapq.heappush(self._queue, (self._epoch, BULK + 1, next(self._sequence), priority, time.monotonic(), data_packet, future))
+                self._epoch += 1
+            else:
+                heapq.heappush(self._queue, (self._epoch, priority, next(self._sequence), priority, time.monotonic(), data_packet, future))
+
+            self._condition.notify_all()
+
+        return future
+
+    def submit(self, priority, name, *args, **kwargs):
+        """Queue the LedDisplay command method 'name'.
+
+           Returns a concurrent.futures.Future that completes when all of its commands have been sent;
+           if any of them fails, the future holds the first exception.
+        """
+
+        recorder = _CommandRecorder()
+
+        getattr(recorder, name)(*args, **kwargs)
+
+        futures = [self.send(data_packet, priority) for data_packet in recorder.data_packets]
+
+        if len(futures) == 1:
+            return futures[0]
+
+        combined = concurrent.futures.Future()
+
+        def done(future):
+            if all(future.done() for future in futures) and not combined.done():
+                exceptions = [future.exception() for future in futures if future.exception() is not None]
+                if exceptions:
+                    combined.set_exception(exceptions[0])
+                else:
+                    combined.set_result(None)
+
+        for future in futures:
+            future.add_done_callback(done)
+
+        if len(futures) == 0:
+            combined.set_result(None)
+
+        return combined
+
+    def __getattr__(self, name):
+        """Provide the other LedDisplay command methods (setBrightnessLevel, setSchedule, ...) at their default priority."""
+
+        # setDeviceId does not use send(), and cannot be scheduled.
+        if name.startswith("_") or name in ("close", "setDeviceId") or not callable(getattr(LedDisplay, name, None)):
+            raise AttributeError(name)
+
+        def submit_method(*args, **kwargs):
+            return self.submit(DefaultPriorities.get(name, NORMAL), name, *args, **kwargs)
+
+        return submit_method
+
+    def _refill(self, current_time):
+
+        self._tokens = min(self._burst, self._tokens + (current_time - self._token_time) * self._max_utilization)
+        self._token_time = current_time
+
+    def _run(self):
+
+        while True:
+
+            with self._condition:
+
+                while True:
+
+                    if not self._queue:
+                        if self._stop_requested:
+                            return # Nothing left to do.
+                        self._condition.wait()
+                        continue
+
+                    # Look at the most urgent command; a more urgent one may arrive while we wait for tokens.
+
+                    (epoch, order, sequence, priority, submit_time, data_packet, future) = self._queue[0]
+
+                    current_time = time.monotonic()
+
+                    self._refill(current_time)
+
+                    cost = min(self.linkTime(data_packet), self._burst)
+
+                    if self._tokens >= cost:
+                        break
+
+                    self._condition.wait((cost - self._tokens) / self._max_utilization)
+
+                heapq.heappop(self._queue)
+
+                self.queueing_delays[priority].observe(current_time - submit_time)
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            estimate = self.linkTime(data_packet)
+
+            start_time = time.monotonic()
+
+            try:
+                self._led_display.send(data_packet)
+            except Exception as exception:
+                self._logger.error("Command {!r} failed: {!r}".format(data_packet, exception))
+                future.set_exception(exception)
+            else:
+                future.set_result(None)
+
+            elapsed = time.monotonic() - start_time
+
+            with self._condition:
+
+                # Charge the time the command actually took.
+                self._refill(time.monotonic())
+                self._tokens -= elapsed
+
+                # Update the ACK latency estimate, but not from failed commands, which include retries and timeouts.
+                # Commands that were suppressed by the LedDisplay (see DeviceStateMirror) take no link time at all.
+                wire_time = estimate - self._ack_latency
+                if future.exception() is None and elapsed >= wire_time:
+                    self._ack_latency = 0.875 * self._ack_latency + 0.125 * (elapsed - wire_time)
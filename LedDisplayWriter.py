@@ -0,0 +1,158 @@
+# Background writer for the AM03127 LED display module.
+
+import threading, collections, logging
+from LedDisplay import pageSlot
+
+class LedDisplayWriter:
+    """Send display commands from a worker thread, so callers never wait for serial I/O.
+
+       Page content commands (<Ln><Pn>...) are coalesced: if a command for the same line and page
+       is still pending, it is replaced by the newer one (latest wins). All other commands, such
+       as brightness, schedule, delete and clock commands, are sent in the order they were submitted.
+       They are barriers: a page content command is never coalesced with one submitted before them,
+       since the other command may depend on (or, like a delete, undo) the earlier page content.
+
+       The writer drives any object that provides the LedDisplay command methods, e.g. a
+       LedDisplay or a LedDisplayConnection.
+    """
+
+    def __init__(self, led_display):
+
+        self._logger = logging.getLogger("LedDisplayWriter")
+
+        self._led_display = led_display
+
+        self._condition = threading.Condition()
+        self._queue = collections.deque() # Entries are lists: [slot, method name, args, kwargs]
+        self._pending = {} # (line, page) -> queue entry
+        self._busy = False
+        self._stop_requested = False
+
+        self.submitted_count = 0
+        self.coalesced_count = 0
+        self.sent_count      = 0
+        self.failed_count    = 0
+
+        self._thread = threading.Thread(target = self._run, name = "LedDisplayWriter", daemon = True)
+        self._thread.start()
+
+    def __del__(self):
+
+        if self._thread is not None:
+            self._logger.error("The __del__ method of class LedDisplayWriter was called while the writer was still active. Please use explicit close() method.")
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._thread is not None:
+            self.close()
+
+    def close(self):
+        """Send all pending commands, then stop the worker thread."""
+
+        assert self._thread is not None
+
+        with self._condition:
+            self._stop_requested = True
+            self._condition.notify_all()
+
+        self._thread.join()
+        self._thread = None
+
+        self._logger.info("Submitted {}, coalesced {}, sent {}, failed {}.".format(
+            self.submitted_count, self.coalesced_count, self.sent_count, self.failed_count))
+
+    def _submit(self, slot, name, args, kwargs):
+
+        with self._condition:
+
+            assert not self._stop_requested
+
+            self.submitted_count += 1
+
+            entry = self._pending.get(slot) if slot is not None else None
+
+            if entry is not None:
+                # Replace the pending command for this line and page.
+                entry[1:] = [name, args, kwargs]
+                self.coalesced_count += 1
+                return
+
+            entry = [slot, name, args, kwargs]
+
+            self._queue.append(entry)
+
+            if slot is not None:
+                self._pending[slot] = entry
+            else:
+                # Later page content commands must not overtake this command.
+                self._pending.clear()
+
+            self._condition.notify_all()
+
+    def send(self, data_packet, *args, **kwargs):
+        """Submit a command; page content commands replace a pending command for the same line and page."""
+        self._submit(pageSlot(data_packet), "send", (data_packet, ) + args, kwargs)
+
+    def setPageContent(self, content, *args, **kwargs):
+        """Submit a PageContent; it replaces a pending command for the same line and page."""
+        self.send(content.compile(), *args, **kwargs)
+
+    def __getattr__(self, name):
+        """Provide the other LedDisplay command methods (setBrightnessLevel, setSchedule, ...), in submission order."""
+
+        if name.startswith("_") or not callable(getattr(self._led_display, name, None)):
+            raise AttributeError(name)
+
+        def submit_method(*args, **kwargs):
+            self._submit(None, name, args, kwargs)
+
+        return submit_method
+
+    def flush(self):
+        """Wait until all commands submitted so far have been processed."""
+
+        with self._condition:
+            while self._queue or self._busy:
+                self._condition.wait()
+
+    def _run(self):
+
+        while True:
+
+            with self._condition:
+
+                while not self._queue and not self._stop_requested:
+                    self._condition.wait()
+
+                if not self._queue:
+                    return # Stop requested, and nothing left to do.
+
+                entry = self._queue.popleft()
+
+                (slot, name, args, kwargs) = entry
+
+                if slot is not None and self._pending.get(slot) is entry:
+                    del self._pending[slot]
+
+                self._busy = True
+
+            try:
+                getattr(self._led_display, name)(*args, **kwargs)
+            except Exception as exception:
+                self._logger.error("Command {}{!r} failed: {!r}".format(name, args, exception))
+                failed = True
+            else:
+                failed = False
+
+            with self._condition:
+
+                if failed:
+                    self.failed_count += 1
+                else:
+                    self.sent_count += 1
+
+                self._busy = False
+                self._condition.notify_all()
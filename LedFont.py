@@ -0,0 +1,318 @@
+# Host-side model of the fonts of the AM03127 LED display module.
+#
+# The display is 7 rows x 80 columns. Text is drawn in one of three fixed-pitch fonts:
+#
+#   <AA> normal: 5 columns wide, the column pointer advances by 6.
+#   <AB> bold:   6 columns wide, the column pointer advances by 7.
+#   <AC> narrow: 4 columns wide, the column pointer advances by 5.
+#
+# Since the fonts are fixed-pitch, the width of a message follows from the number of characters,
+# and can be determined without the device. The glyph bitmaps below are those of the classic 5x7
+# LCD font; the bold and narrow glyphs are derived from them. They approximate what the device
+# shows, which is good enough for previews.
+
+import re, functools, unicodedata
+from LedDisplay import Replacements
+
+DISPLAY_WIDTH = 80
+ROWS = 7
+
+# Column advance of the fonts.
+Advances = {"A": 6, "B": 7, "C": 5}
+
+# Fonts, widest first.
+FONTS = "BAC"
+
+# Width of a graphics block (<GAn>).
+GRAPHICS_BLOCK_WIDTH = 32
+
+# Number of characters shown by the date (<KD>, dd/mm/yy) and time (<KT>, hh:mm) directives.
+DATE_CHARACTERS = 8
+TIME_CHARACTERS = 5
+
+# The 5x7 glyphs of the printable ASCII characters 0x20 .. 0x7E, one byte per column, left to right.
+# Bit 0 is the top row.
+
+_Glyphs5x7 = bytes([
+    0x00, 0x00, 0x00, 0x00, 0x00, # ' '
+    0x00, 0x00, 0x5F, 0x00, 0x00, # '!'
+    0x00, 0x07, 0x00, 0x07, 0x00, # '"'
+    0x14, 0x7F, 0x14, 0x7F, 0x14, # '#'
+    0x24, 0x2A, 0x7F, 0x2A, 0x12, # '$'
+    0x23, 0x13, 0x08, 0x64, 0x62, # '%'
+    0x36, 0x49, 0x55, 0x22, 0x50, # '&'
+    0x00, 0x05, 0x03, 0x00, 0x00, # "'"
+    0x00, 0x1C, 0x22, 0x41, 0x00, # '('
+    0x00, 0x41, 0x22, 0x1C, 0x00, # ')'
+    0x08, 0x2A, 0x1C, 0x2A, 0x08, # '*'
+    0x08, 0x08, 0x3E, 0x08, 0x08, # '+'
+    0x00, 0x50, 0x30, 0x00, 0x00, # ','
+    0x08, 0x08, 0x08, 0x08, 0x08, # '-'
+    0x00, 0x60, 0x60, 0x00, 0x00, # '.'
+    0x20, 0x10, 0x08, 0x04, 0x02, # '/'
+    0x3E, 0x51, 0x49, 0x45, 0x3E, # '0'
+    0x00, 0x42, 0x7F, 0x40, 0x00, # '1'
+    0x42, 0x61, 0x51, 0x49, 0x46, # '2'
+    0x21, 0x41, 0x45, 0x4B, 0x31, # '3'
+    0x18, 0x14, 0x12, 0x7F, 0x10, # '4'
+    0x27, 0x45, 0x45, 0x45, 0x39, # '5'
+    0x3C, 0x4A, 0x49, 0x49, 0x30, # '6'
+    0x01, 0x71, 0x09, 0x05, 0x03, # '7'
+    0x36, 0x49, 0x49, 0x49, 0x36, # '8'
+    0x06, 0x49, 0x49, 0x29, 0x1E, # '9'
+    0x00, 0x36, 0x36, 0x00, 0x00, # ':'
+    0x00, 0x56, 0x36, 0x00, 0x00, # ';'
+    0x08, 0x14, 0x22, 0x41, 0x00, # '<'
+    0x14, 0x14, 0x14, 0x14, 0x14, # '='
+    0x00, 0x41, 0x22, 0x14, 0x08, # '>'
+    0x02, 0x01, 0x51, 0x09, 0x06, # '?'
+    0x32, 0x49, 0x79, 0x41, 0x3E, # '@'
+    0x7E, 0x11, 0x11, 0x11, 0x7E, # 'A'
+    0x7F, 0x49, 0x49, 0x49, 0x36, # 'B'
+    0x3E, 0x41, 0x41, 0x41, 0x22, # 'C'
+    0x7F, 0x41, 0x41, 0x22, 0x1C, # 'D'
+    0x7F, 0x49, 0x49, 0x49, 0x41, # 'E'
+    0x7F, 0x09, 0x09, 0x09, 0x01, # 'F'
+    0x3E, 0x41, 0x49, 0x49, 0x7A, # 'G'
+    0x7F, 0x08, 0x08, 0x08, 0x7F, # 'H'
+    0x00, 0x41, 0x7F, 0x41, 0x00, # 'I'
+    0x20, 0x40, 0x41, 0x3F, 0x01, # 'J'
+    0x7F, 0x08, 0x14, 0x22, 0x41, # 'K'
+    0x7F, 0x40, 0x40, 0x40, 0x40, # 'L'
+    0x7F, 0x02, 0x0C, 0x02, 0x7F, # 'M'
+    0x7F, 0x04, 0x08, 0x10, 0x7F, # 'N'
+    0x3E, 0x41, 0x41, 0x41, 0x3E, # 'O'
+    0x7F, 0x09, 0x09, 0x09, 0x06, # 'P'
+    0x3E, 0x41, 0x51, 0x21, 0x5E, # 'Q'
+    0x7F, 0x09, 0x19, 0x29, 0x46, # 'R'
+    0x46, 0x49, 0x49, 0x49, 0x31, # 'S'
+    0x01, 0x01, 0x7F, 0x01, 0x01, # 'T'
+    0x3F, 0x40, 0x40, 0x40, 0x3F, # 'U'
+    0x1F, 0x20, 0x40, 0x20, 0x1F, # 'V'
+    0x3F, 0x40, 0x38, 0x40, 0x3F, # 'W'
+    0x63, 0x14, 0x08, 0x14, 0x63, # 'X'
+    0x07, 0x08, 0x70, 0x08, 0x07, # 'Y'
+    0x61, 0x51, 0x49, 0x45, 0x43, # 'Z'
+    0x00, 0x7F, 0x41, 0x41, 0x00, # '['
+    0x02, 0x04, 0x08, 0x10, 0x20, # '\'
+    0x00, 0x41, 0x41, 0x7F, 0x00, # ']'
+    0x04, 0x02, 0x01, 0x02, 0x04, # '^'
+    0x40, 0x40, 0x40, 0x40, 0x40, # '_'
+    0x00, 0x01, 0x02, 0x04, 0x00, # '`'
+    0x20, 0x54, 0x54, 0x54, 0x78, # 'a'
+    0x7F, 0x48, 0x44, 0x44, 0x38, # 'b'
+    0x38, 0x44, 0x44, 0x44, 0x20, # 'c'
+    0x38, 0x44, 0x44, 0x48, 0x7F, # 'd'
+    0x38, 0x54, 0x54, 0x54, 0x18, # 'e'
+    0x08, 0x7E, 0x09, 0x01, 0x02, # 'f'
+    0x0C, 0x52, 0x52, 0x52, 0x3E, # 'g'
+    0x7F, 0x08, 0x04, 0x04, 0x78, # 'h'
+    0x00, 0x44, 0x7D, 0x40, 0x00, # 'i'
+    0x20, 0x40, 0x44, 0x3D, 0x00, # 'j'
+    0x7F, 0x10, 0x28, 0x44, 0x00, # 'k'
+    0x00, 0x41, 0x7F, 0x40, 0x00, # 'l'
+    0x7C, 0x04, 0x18, 0x04, 0x78, # 'm'
+    0x7C, 0x08, 0x04, 0x04, 0x78, # 'n'
+    0x38, 0x44, 0x44, 0x44, 0x38, # 'o'
+    0x7C, 0x14, 0x14, 0x14, 0x08, # 'p'
+    0x08, 0x14, 0x14, 0x18, 0x7C, # 'q'
+    0x7C, 0x08, 0x04, 0x04, 0x08, # 'r'
+    0x48, 0x54, 0x54, 0x54, 0x20, # 's'
+    0x04, 0x3F, 0x44, 0x40, 0x20, # 't'
+    0x3C, 0x40, 0x40, 0x20, 0x7C, # 'u'
+    0x1C, 0x20, 0x40, 0x20, 0x1C, # 'v'
+    0x3C, 0x40, 0x30, 0x40, 0x3C, # 'w'
+    0x44, 0x28, 0x10, 0x28, 0x44, # 'x'
+    0x0C, 0x50, 0x50, 0x50, 0x3C, # 'y'
+    0x44, 0x64, 0x54, 0x4C, 0x44, # 'z'
+    0x00, 0x08, 0x36, 0x41, 0x00, # '{'
+    0x00, 0x00, 0x7F, 0x00, 0x00, # '|'
+    0x00, 0x41, 0x36, 0x08, 0x00, # '}'
+    0x08, 0x04, 0x08, 0x10, 0x08, # '~'
+])
+
+# Glyphs of the characters of the European character table that differ from Windows-1252 (see LedDisplay.Replacements).
+
+_ExtraGlyphs5x7 = {
+        "€" : bytes([0x14, 0x3E, 0x55, 0x41, 0x22]),
+        "↑" : bytes([0x04, 0x02, 0x7F, 0x02, 0x04]),
+        "↓" : bytes([0x10, 0x20, 0x7F, 0x20, 0x10]),
+        "→" : bytes([0x08, 0x08, 0x2A, 0x1C, 0x08]),
+        "←" : bytes([0x08, 0x1C, 0x2A, 0x08, 0x08])
+    }
+
+# Shown for characters without a glyph.
+_MissingGlyph = bytes([0x7F, 0x41, 0x41, 0x41, 0x7F])
+
+def _makeGlyphs():
+    """Make the glyph tables of the three fonts: font -> {character: columns}."""
+
+    normal = {}
+    for code in range(0x20, 0x7F):
+        index = (code - 0x20) * 5
+        normal[chr(code)] = _Glyphs5x7[index:index + 5]
+
+    normal.update(_ExtraGlyphs5x7)
+
+    # Bold: each pixel is also drawn one column to the right.
+    bold = {character: bytes(a | b for (a, b) in zip(columns + b"\x00", b"\x00" + columns)) for (character, columns) in normal.items()}
+
+    # Narrow: the second and third columns are merged.
+    narrow = {character: bytes([columns[0], columns[1] | columns[2], columns[3], columns[4]]) for (character, columns) in normal.items()}
+
+    return {"A": normal, "B": bold, "C": narrow}
+
+Glyphs = _makeGlyphs()
+
+# The parts of a message: directives, and single characters.
+_TokenPattern = re.compile("<(?:U[0-9A-F]{2}|G[A-P][1-8]|[A-Z][A-Z0-9])>|.", re.DOTALL)
+
+# The characters shown by the <Uxx> directives that differ from Windows-1252.
+_ReplacedCharacters = {directive: character for (character, directive) in Replacements.items()}
+
+def tokenize(message):
+    """Split a message into directives and characters."""
+    return _TokenPattern.findall(message)
+
+def _character(token):
+    """Return the character shown for a token, or None if the token is a directive that does not show a character."""
+
+    if len(token) == 1:
+        return token
+
+    if token.startswith("<U"):
+        if token in _ReplacedCharacters:
+            return _ReplacedCharacters[token]
+        code = int(token[2:4], 16)
+        if code >= 0x80:
+            # Beyond the European character table; shown as an unknown character.
+            return "\ufffd"
+        # The European character table follows the upper half of Windows-1252; see LedDisplay.
+        return bytes([0x80 + code]).decode("cp1252", errors = "replace")
+
+    return None
+
+@functools.lru_cache(maxsize = 1024)
+def textWidth(message, font = "A"):
+    """Return the number of columns taken by a message, starting in the given font.
+
+       The message may contain font (<AA>, <AB>, <AC>), color, date and time, European character
+       (<Uxx>) and graphics (<GPn>) directives. Other directives take no space.
+    """
+
+    width = 0
+
+    for token in tokenize(message):
+
+        if token.startswith("<A") and len(token) == 4:
+            # The taller fonts (<AD>, <AE>, <AF>) are not modeled; assume the normal pitch.
+            font = token[2] if token[2] in Advances else "A"
+        elif token == "<KD>":
+            width += DATE_CHARACTERS * Advances[font]
+        elif token == "<KT>":
+            width += TIME_CHARACTERS * Advances[font]
+        elif token.startswith("<G") and len(token) == 5:
+            width += GRAPHICS_BLOCK_WIDTH
+        elif _character(token) is not None:
+            width += Advances[font]
+
+    return width
+
+def fits(message, font = "A", width = DISPLAY_WIDTH):
+    """Return True if the message fits on the display without scrolling."""
+
+    # The last character does not need its trailing blank column(s).
+    return textWidth(message, font) - (Advances[font] - len(Glyphs[font]["A"])) <= width
+
+def chooseFont(message, width = DISPLAY_WIDTH, fonts = FONTS):
+    """Return the widest font (one of "A", "B", "C") in which the message fits, or None if it does not fit in any font."""
+
+    for font in sorted(fonts, key = lambda font: Advances[font], reverse = True):
+        if fits(message, font, width):
+            return font
+
+    return None
+
+def _glyph(character, font):
+
+    glyph = Glyphs[font].get(character)
+
+    if glyph is None:
+        # Show accented characters without their accent.
+        base = unicodedata.normalize("NFKD", character)[:1]
+        glyph = Glyphs[font].get(base, _MissingGlyph[:len(Glyphs[font]["A"])])
+
+    return glyph
+
+# Foreground and background color of the color directives (<CA> .. <CZ>). See LedDisplay.setPageContent().
+
+_ColorDirectives = {}
+
+for letter in "ABCTUVWXYZ":
+    _ColorDirectives[letter] = ("RED", "BLACK")
+for letter in "DEF":
+    _ColorDirectives[letter] = ("GREEN", "BLACK")
+for letter in "GHIJKRS": # The "rasta" and "sparkly" colors are shown as orange.
+    _ColorDirectives[letter] = ("ORANGE", "BLACK")
+
+_ColorDirectives.update({
+        "L" : ("BLACK" , "RED"   ),
+        "M" : ("BLACK" , "GREEN" ),
+        "N" : ("BLACK" , "ORANGE"),
+        "O" : ("ORANGE", "GREEN" ),
+        "P" : ("RED"   , "GREEN" ),
+        "Q" : ("GREEN" , "RED"   )
+    })
+
+def render(message, font = "A", color = "RED"):
+    """Render a message to a (7, textWidth(message)) array of color codes, as used by LedGraphics.
+
+       Graphics block directives are rendered as black space. Requires numpy.
+    """
+
+    import LedGraphics
+    import numpy as np
+
+    image = np.zeros((ROWS, textWidth(message, font)), dtype = np.uint8)
+
+    foreground = getattr(LedGraphics, color)
+    background = LedGraphics.BLACK
+
+    column = 0
+
+    for token in tokenize(message):
+
+        count = 1
+
+        if token.startswith("<A") and len(token) == 4:
+            font = token[2] if token[2] in Advances else "A"
+            continue
+        elif token.startswith("<C") and len(token) == 4:
+            # Unknown color codes (e.g. <C1>) are ignored.
+            if token[2] in _ColorDirectives:
+                (foreground, background) = (getattr(LedGraphics, name) for name in _ColorDirectives[token[2]])
+            continue
+        elif token == "<KD>":
+            (characters, count) = ("0", DATE_CHARACTERS)
+        elif token == "<KT>":
+            (characters, count) = ("0", TIME_CHARACTERS)
+        elif token.startswith("<G") and len(token) == 5:
+            column += GRAPHICS_BLOCK_WIDTH
+            continue
+        else:
+            characters = _character(token)
+            if characters is None:
+                continue
+
+        glyph = _glyph(characters, font)
+
+        # Unpack the glyph columns into a (7, columns) array of booleans.
+        pixels = (np.frombuffer(glyph, dtype = np.uint8)[np.newaxis, :] >> np.arange(ROWS)[:, np.newaxis]) & 1
+
+        for i in range(count):
+            cell = image[:, column:column + Advances[font]]
+            cell[:] = background
+            cell[:, :pixels.shape[1]][pixels != 0] = foreground
+            column += Advances[font]
+
+    return image
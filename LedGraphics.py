@@ -0,0 +1,136 @@
+# Graphics encoding for the AM03127 LED display module.
+#
+# Images are numpy arrays of color codes, 7 rows high. A graphics block is 32 columns wide;
+# a graphics page consists of 8 blocks, i.e. 256 columns.
+
+import numpy as np
+
+BLACK  = 0
+GREEN  = 1
+RED    = 2
+ORANGE = 3
+
+ROWS         = 7
+BLOCK_WIDTH  = 32
+PAGE_BLOCKS  = 8
+PAGE_WIDTH   = PAGE_BLOCKS * BLOCK_WIDTH
+BLOCK_SIZE   = 64 # Size of an encoded graphics block, in bytes.
+
+# Translation of the "RGBO." characters to color codes. Invalid characters map to 255.
+
+_ColorCodes = np.full(256, 255, dtype = np.uint8)
+
+for (c, code) in (("B", BLACK), (".", BLACK), ("G", GREEN), ("R", RED), ("O", ORANGE)):
+    _ColorCodes[ord(c)] = code
+
+_PixelWeights = np.array([64, 16, 4, 1], dtype = np.uint8)
+
+def graphicsToArray(graphics, width = None):
+    """Convert graphics to a (7, width) array of color codes.
+
+       The graphics can be given as a string of the letters "B", "G", "R", "O" (or "." for black),
+       row by row, or as an array of color codes.
+    """
+
+    if isinstance(graphics, str):
+        codes = np.frombuffer(graphics.encode("ASCII", errors = "replace"), dtype = np.uint8)
+        image = _ColorCodes[codes]
+        if len(image) % ROWS != 0 or np.any(image == 255):
+            raise ValueError("{!r} is not valid graphics data.".format(graphics))
+        image = image.reshape(ROWS, -1)
+    else:
+        image = np.asarray(graphics)
+        if image.ndim != 2 or image.shape[0] != ROWS or np.any((image < 0) | (image > 3)):
+            raise ValueError("{!r} is not valid graphics data.".format(graphics))
+        image = image.astype(np.uint8)
+
+    if width is not None and image.shape[1] != width:
+        raise ValueError("Graphics data should be {} columns wide, got {}.".format(width, image.shape[1]))
+
+    return image
+
+def encodeGraphicsBlocks(image):
+    """Encode a (7, 32 * n) image into n graphics blocks of 64 bytes, in a single batched operation.
+
+       Returns a (n, 64) array of bytes.
+
+       See LedDisplay.setGraphicsBlock() for a description of the byte layout.
+    """
+
+    image = graphicsToArray(image)
+
+    if image.shape[1] % BLOCK_WIDTH != 0:
+        raise ValueError("Graphics width should be a multiple of {}, got {}.".format(BLOCK_WIDTH, image.shape[1]))
+
+    blocks = image.shape[1] // BLOCK_WIDTH
+
+    # Add the unused eighth row.
+    padded = np.zeros((ROWS + 1, image.shape[1]), dtype = np.uint8)
+    padded[:ROWS] = image
+
+    # Combine each group of 4 horizontal pixels into a byte: (row, block, group, pixel).
+    values = (padded.reshape(ROWS + 1, blocks, 8, 4) * _PixelWeights).sum(axis = 3, dtype = np.uint8)
+
+    # Byte i of a block holds row (i // 2) % 8 and group (i % 2) + (i // 16) * 2.
+    values = values.reshape(ROWS + 1, blocks, 4, 2).transpose(1, 2, 0, 3)
+
+    return values.reshape(blocks, BLOCK_SIZE)
+
+GRAPHICS_PAGES = "ABCDEFGHIJKLMNOP"
+
+class Framebuffer:
+    """Host-side copy of the 16 graphics pages (A..P) of the display.
+
+       The framebuffer remembers the encoded content of each graphics block as last acknowledged by
+       the device. On flush(), only the blocks that differ from that are sent.
+    """
+
+    def __init__(self):
+
+        self.pixels = np.zeros((len(GRAPHICS_PAGES), ROWS, PAGE_WIDTH), dtype = np.uint8)
+
+        # Encoded block content as acknowledged by the device; None if unknown.
+        self._acknowledged = [[None] * PAGE_BLOCKS for page in GRAPHICS_PAGES]
+
+    def page(self, graphicsPage):
+        """Return the (7, 256) pixel array of a graphics page; it can be modified in place."""
+        return self.pixels[GRAPHICS_PAGES.index(graphicsPage)]
+
+    def setPage(self, graphicsPage, image):
+        self.page(graphicsPage)[:] = graphicsToArray(image, PAGE_WIDTH)
+
+    def setBlock(self, graphicsPage, graphicsBlock, graphics):
+        column = (graphicsBlock - 1) * BLOCK_WIDTH
+        self.page(graphicsPage)[:, column:column + BLOCK_WIDTH] = graphicsToArray(graphics, BLOCK_WIDTH)
+
+    def invalidate(self):
+        """Forget what the device shows, e.g. after LedDisplay.deleteAll(). The next flush() sends all blocks."""
+        self._acknowledged = [[None] * PAGE_BLOCKS for page in GRAPHICS_PAGES]
+
+    def dirtyBlocks(self):
+        """Return a list of (graphicsPage, graphicsBlock, data) of all blocks that need to be sent."""
+
+        # Encode all 128 blocks in one go.
+        encoded = encodeGraphicsBlocks(self.pixels.transpose(1, 0, 2).reshape(ROWS, -1))
+
+        dirty = []
+
+        for (pageIndex, graphicsPage) in enumerate(GRAPHICS_PAGES):
+            for blockIndex in range(PAGE_BLOCKS):
+                data = encoded[pageIndex * PAGE_BLOCKS + blockIndex].tobytes()
+                if data != self._acknowledged[pageIndex][blockIndex]:
+                    dirty.append((graphicsPage, blockIndex + 1, data))
+
+        return dirty
+
+    def flush(self, led_display):
+        """Send all changed blocks to the display. Returns the number of blocks sent."""
+
+        dirty = self.dirtyBlocks()
+
+        for (graphicsPage, graphicsBlock, data) in dirty:
+            led_display.setGraphicsBlockData(graphicsPage, graphicsBlock, data)
+            # Only record blocks the device has acknowledged; if send() fails, the rest stays dirty.
+            self._acknowledged[GRAPHICS_PAGES.index(graphicsPage)][graphicsBlock - 1] = data
+
+        return len(dirty)
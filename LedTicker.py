@@ -0,0 +1,105 @@
+# Long messages on the AM03127 LED display module, spread over several pages.
+
+import logging
+from LedDisplay import LedDisplay, PageContent, LeadingEffect, LaggingEffect, DisplayMethod, MAX_PAGE_CONTENT_LENGTH, encodeMessage
+from LedFont import tokenize
+
+class Ticker:
+    """Show a long message that does not fit in a single page.
+
+       The message is split into as few pages as possible. Pages are only split between characters
+       and directives, never inside a directive; the color and font that are in effect at a split
+       are repeated at the start of the next page. A schedule plays the pages in order.
+
+       When the message is updated, only the pages whose content changed are sent, and the schedule
+       is only sent if the number of pages changed.
+    """
+
+    def __init__(self, led_display, line = 1, pages = "ABCDEFGHIJKLMNOPQRSTUVWXYZ", schedule = "A",
+                 leading = LeadingEffect.SCROLL_LEFT, method = DisplayMethod.NORMAL, wait = 0.5, lagging = LaggingEffect.SCROLL_LEFT):
+        """The ticker uses the given 'line', 'pages', and 'schedule' of the display; the other arguments are passed to PageContent.
+
+           The 'led_display' is a LedDisplay or a LedDisplayConnection: the ticker assumes that a page is
+           shown by the device once the call that sends it returns.
+        """
+
+        self._logger = logging.getLogger("Ticker")
+
+        self._led_display = led_display
+
+        self._line     = LedDisplay._checkLine(line)
+        self._pages    = LedDisplay._checkSchedulePages(pages)
+        self._schedule = LedDisplay._checkSchedule(schedule)
+
+        self._page_options = (leading, method, wait, lagging)
+
+        self._sent_pages = {} # page -> data packet, as acknowledged by the device.
+        self._sent_schedule_pages = None
+
+    def invalidate(self):
+        """Forget what the device shows, e.g. after LedDisplay.deleteAll(). The next update() sends all pages."""
+        self._sent_pages = {}
+        self._sent_schedule_pages = None
+
+    def split(self, message, errors = "strict"):
+        """Split a message into a list of PageContent. Raises a ValueError if there are not enough pages."""
+
+        page_contents = []
+        page_content = None
+
+        # The directives in effect, to be repeated at the start of a new page.
+        font_directive  = None
+        color_directive = None
+
+        for token in tokenize(message):
+
+            size = len(encodeMessage(token, errors))
+
+            if page_content is None or len(page_content) + size > MAX_PAGE_CONTENT_LENGTH:
+
+                if len(page_contents) == len(self._pages):
+                    raise ValueError("Message does not fit in {} pages.".format(len(self._pages)))
+
+                page_content = PageContent(self._line, self._pages[len(page_contents)], *self._page_options)
+
+                for directive in (font_directive, color_directive):
+                    if directive is not None:
+                        page_content.text(directive)
+
+                page_contents.append(page_content)
+
+            page_content.text(token, errors)
+
+            if token.startswith("<A") and len(token) == 4:
+                font_directive = token
+            elif token.startswith("<C") and len(token) == 4:
+                color_directive = token
+
+        return page_contents
+
+    def update(self, message, errors = "strict"):
+        """Show a message. Returns the number of commands sent."""
+
+        page_contents = self.split(message, errors)
+
+        count = 0
+
+        # Send the pages before the schedule that refers to them.
+
+        for page_content in page_contents:
+            data_packet = page_content.compile()
+            if self._sent_pages.get(page_content.page) != data_packet:
+                self._led_display.setPageContent(page_content)
+                self._sent_pages[page_content.page] = data_packet
+                count += 1
+
+        schedule_pages = "".join(page_content.page for page_content in page_contents)
+
+        if schedule_pages != self._sent_schedule_pages:
+            self._led_display.setSchedule(self._schedule, schedule_pages)
+            self._sent_schedule_pages = schedule_pages
+            count += 1
+
+        self._logger.debug("Message of {} pages shown using {} commands.".format(len(page_contents), count))
+
+        return count
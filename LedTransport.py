@@ -0,0 +1,187 @@
+# Byte transports for the AM03127 LED display module.
+#
+# A transport is an object with the interface of a pyserial port that LedDisplay uses: write(), read(),
+# the 'timeout' attribute, in_waiting, reset_input_buffer(), flush(), and close().
+
+import serial, socket, os, re, functools, operator
+
+def openTransport(device, baudrate = 9600, timeout = 1.0):
+    """Open the transport to a display (or a bus of displays).
+
+       The 'device' is one of:
+
+         - a local serial device, e.g. "/dev/ttyUSB0": 8N1, no flow control;
+         - "socket://host:port": a TCP serial server (e.g. ser2net). Nagle's algorithm is disabled,
+           since the protocol sends small commands and waits for small responses;
+         - another pyserial URL, e.g. "loop://" or "rfc2217://host:port";
+         - "fake://": an in-process FakeTransport that acknowledges all valid commands immediately.
+    """
+
+    if device == "fake://":
+        return FakeTransport()
+
+    if "://" not in device:
+        return serial.Serial(device, baudrate, serial.EIGHTBITS, serial.PARITY_NONE, serial.STOPBITS_ONE, timeout, False, False)
+
+    port = serial.serial_for_url(device, baudrate = baudrate, timeout = timeout)
+
+    if device.startswith("socket://"):
+        # The socket is owned by pyserial; set the option on a duplicate of its file descriptor.
+        with socket.fromfd(port.fileno(), socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    return port
+
+class FakeTransport:
+    """An in-process display, for testing the protocol without I/O latency.
+
+       Valid commands for 'device_id' are recorded in 'data_packets' and acknowledged immediately;
+       frames with a bad checksum are ignored, like the device does. Reads never wait: if no
+       response is available, read() returns immediately with the bytes that are available.
+
+       For use with an event loop (see AsyncLedDisplay), fileno() returns a file descriptor that
+       is readable while a response is available.
+    """
+
+    BROADCAST_ID = 0
+
+    # Commands that carry binary data have a fixed length; all other commands end at the first <E>.
+    _FixedLengthCommands = {
+            b"<G" : 5 + 64,
+            b"<F" : 6 +  8
+        }
+
+    _SetIdRegexp = re.compile(rb"<ID><([0-9A-F]{2})><E>")
+
+    def __init__(self, device_id = 1):
+
+        self.device_id = device_id
+        self.timeout = None
+        self.respond = True # If False, no responses are sent; to test timeouts and retries.
+
+        self.data_packets = [] # Data packets of the valid commands, in order.
+        self.bytes_written = 0
+
+        self._input = bytearray()  # Written by the host, not processed yet.
+        self._output = bytearray() # Responses, not read yet.
+
+        # Pipe that holds one byte while responses are available; made by fileno(), when needed.
+        self._pipe = None
+        self._pipe_readable = False
+
+    def close(self):
+        if self._pipe is not None:
+            for fd in self._pipe:
+                os.close(fd)
+            self._pipe = None
+
+    def fileno(self):
+
+        if self._pipe is None:
+            self._pipe = os.pipe()
+            self._updatePipe()
+
+        return self._pipe[0]
+
+    def _updatePipe(self):
+
+        if self._pipe is None:
+            return
+
+        readable = len(self._output) > 0
+
+        if readable and not self._pipe_readable:
+            os.write(self._pipe[1], b"R")
+        elif self._pipe_readable and not readable:
+            os.read(self._pipe[0], 1)
+
+        self._pipe_readable = readable
+
+    def flush(self):
+        pass
+
+    @property
+    def in_waiting(self):
+        return len(self._output)
+
+    def reset_input_buffer(self):
+        del self._output[:]
+        self._updatePipe()
+
+    def write(self, data):
+
+        self._input.extend(data)
+        self.bytes_written += len(data)
+
+        self._process()
+
+        return len(data)
+
+    def read(self, size = 1):
+
+        data = bytes(self._output[:size])
+        del self._output[:size]
+
+        self._updatePipe()
+
+        return data
+
+    def _respond(self, response):
+        if self.respond:
+            self._output.extend(response)
+            self._updatePipe()
+
+    def _process(self):
+
+        while True:
+
+            idx = self._input.find(b"<ID")
+
+            if idx < 0:
+                del self._input[:max(0, len(self._input) - 2)]
+                return
+
+            del self._input[:idx]
+
+            match = self._SetIdRegexp.match(self._input)
+
+            if match is not None:
+                new_device_id = match.group(1)
+                del self._input[:match.end()]
+                self.device_id = int(new_device_id, 16)
+                self._respond(new_device_id)
+                continue
+
+            if len(self._input) < 8:
+                return # Incomplete.
+
+            size = self._FixedLengthCommands.get(bytes(self._input[6:8]))
+
+            if size is not None:
+                end = 6 + size + 5
+                if len(self._input) < end:
+                    return # Incomplete.
+            else:
+                end = self._input.find(b"<E>", 6)
+                if end < 0:
+                    return # Incomplete.
+                end += 3
+
+            frame = bytes(self._input[:end])
+            del self._input[:end]
+
+            data_packet = frame[6:-5]
+
+            try:
+                device_id = int(frame[3:5], 16)
+                valid = int(frame[-5:-3], 16) == functools.reduce(operator.xor, data_packet, 0)
+            except ValueError:
+                valid = False
+
+            if not valid or device_id not in (self.device_id, self.BROADCAST_ID):
+                continue
+
+            self.data_packets.append(data_packet)
+
+            if device_id != self.BROADCAST_ID:
+                self._respond(b"ACK")
@@ -0,0 +1,203 @@
+#! /usr/bin/env python3
+
+# Monitor many internet radio stations in a single process, using one asyncio event loop.
+#
+# The stations are listed in a JSON configuration file:
+#
+#   {
+#       "database": "metadata.sqlite3",
+#       "stations": [
+#           {
+#               "name"               : "pinguin",
+#               "host"               : "pc192.pinguinradio.com",
+#               "port"               : 80,
+#               "path"               : "/",
+#               "record"             : "pinguin_%Y%m%d_%H%M%S.mp3",
+#               "retry_interval"     : 5.0,
+#               "max_retry_interval" : 300.0
+#           }
+#       ]
+#   }
+#
+# The metadata of all stations is stored in one database, tagged with the station name. The audio
+# of a station is recorded only if "record" is given; a new file (a strftime() pattern) is started
+# for each connection. After a connection fails, a station reconnects after 'retry_interval' seconds,
+# doubling the interval after each failure up to 'max_retry_interval' seconds.
+#
+# The database writes of all stations are done by a single thread, so they do not hold up the event loop.
+
+import sys, time, json, asyncio, logging, socket, concurrent.futures
+from setup_logging import setup_logging
+from PlayInternetRadio import AsyncInternetRadioPlayer, MetadataDatabaseWriter, StreamStalledError
+
+DEFAULT_DATABASE = "metadata.sqlite3"
+
+DEFAULT_RETRY_INTERVAL     =   5.0 # seconds
+DEFAULT_MAX_RETRY_INTERVAL = 300.0 # seconds
+
+def load_stations(filename):
+    """Load the configuration file. Returns (database filename, list of station dictionaries)."""
+
+    with open(filename, "r", encoding = "utf-8") as f:
+        config = json.load(f)
+
+    stations = []
+
+    for station in config["stations"]:
+
+        for key in ("name", "host"):
+            if key not in station:
+                raise ValueError("Station without {!r} in {!r}.".format(key, filename))
+
+        station = dict(station)
+
+        station.setdefault("port", 80)
+        station.setdefault("path", "/")
+        station.setdefault("record", None)
+        station.setdefault("retry_interval", DEFAULT_RETRY_INTERVAL)
+        station.setdefault("max_retry_interval", DEFAULT_MAX_RETRY_INTERVAL)
+
+        stations.append(station)
+
+    names = [station["name"] for station in stations]
+    if len(set(names)) != len(names):
+        raise ValueError("Duplicate station names in {!r}.".format(filename))
+
+    return (config.get("database", DEFAULT_DATABASE), stations)
+
+class AudioFileRecorder:
+    """ Writes the audio data of a stream to a file.
+    """
+    def __init__(self, filename):
+        self._logger = logging.getLogger("AudioFileRecorder")
+        self._logger.info("Recording to {!r} ...".format(filename))
+        self._file = open(filename, "wb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._file is not None:
+            self.close()
+
+    def close(self):
+        assert self._file is not None
+        self._file.close()
+        self._file = None
+
+    def process(self, data):
+        self._file.write(data)
+
+async def run_station(station, database_filename, database_executor):
+    """Play a station until cancelled, reconnecting according to the station's policy.
+
+       The metadata is written to the database by 'database_executor', which must have a single thread.
+    """
+
+    logger = logging.getLogger(station["name"])
+
+    retry_interval = station["retry_interval"]
+
+    metadata_database_writer = MetadataDatabaseWriter(database_filename, station["name"])
+
+    def log_database_error(future):
+        exception = future.exception()
+        if exception is not None:
+            logger.error("Unable to write metadata to the database: {!r}".format(exception))
+
+    def process_metadata(current_time, metadata):
+        # Do not wait for the write; the executor does the writes of all stations in order.
+        future = database_executor.submit(metadata_database_writer.process, current_time, metadata)
+        future.add_done_callback(log_database_error)
+
+    try:
+
+        while True:
+
+            start_time = time.monotonic()
+
+            recorder = None
+
+            try:
+
+                radio_player = AsyncInternetRadioPlayer(station["host"], station["port"], station["path"])
+
+                radio_player.metadata_signal.connect(process_metadata)
+
+                if station["record"] is not None:
+                    recorder = AudioFileRecorder(time.strftime(station["record"]))
+                    radio_player.audiodata_signal.connect(recorder.process)
+
+                await radio_player.play()
+
+            except socket.gaierror as exception:
+                logger.error("getaddrinfo() error: {}".format(exception))
+            except StreamStalledError as exception:
+                logger.error("Stream has stalled: {}".format(exception))
+            except OSError as exception:
+                logger.error("Connection error: {!r}".format(exception))
+            except Exception as exception:
+                logger.exception("Unknown exception: {!r}".format(exception))
+            finally:
+                if recorder is not None:
+                    recorder.close()
+
+            # A connection that lasted a while resets the retry interval.
+            if time.monotonic() - start_time >= station["max_retry_interval"]:
+                retry_interval = station["retry_interval"]
+
+            logger.info("Sleeping for {:.1f} seconds before retry ...".format(retry_interval))
+            await asyncio.sleep(retry_interval)
+
+            retry_interval = min(2.0 * retry_interval, station["max_retry_interval"])
+
+    finally:
+        # Close the writer after its pending writes.
+        database_executor.submit(metadata_database_writer.close)
+
+async def run_stations(stations, database_filename):
+
+    # One thread does all database writes; sqlite serializes the writers of a database anyway.
+    database_executor = concurrent.futures.ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "database")
+
+    tasks = [asyncio.ensure_future(run_station(station, database_filename, database_executor)) for station in stations]
+
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions = True)
+        database_executor.shutdown(wait = True)
+
+def main():
+
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+
+    if len(args) != 1:
+        print("Usage: MonitorInternetRadioStations.py <stations.json> [--debug]")
+        sys.exit(1)
+
+    if "--debug" in sys.argv[1:]:
+        log_level = logging.DEBUG
+    else:
+        log_level = logging.INFO
+
+    log_filename = "MonitorInternetRadioStations_%Y%m%d_%H%M%S.log"
+    log_format = "%(asctime)s | %(levelname)-10s | %(name)-25s | %(message)s"
+
+    with setup_logging(logfile_name = log_filename, fmt = log_format, level = log_level):
+
+        logger = logging.getLogger("main")
+
+        (database_filename, stations) = load_stations(args[0])
+
+        logger.info("Monitoring {} stations; metadata is stored in {!r}.".format(len(stations), database_filename))
+
+        try:
+            asyncio.run(run_stations(stations, database_filename))
+        except KeyboardInterrupt:
+            logger.info("Quitting by user request.")
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,190 @@
 #! /usr/bin/env python3
 
-import os, select, sys, time, socket, re, subprocess, logging, math, sqlite3
+import os, select, sys, time, socket, re, subprocess, logging, math, sqlite3, asyncio, inspect, threading, collections
 from setup_logging import setup_logging
+from IcyDemuxer import IcyDemuxer
 
 try:
-    from LedDisplay import LedDisplay
+    from LedDisplay import LedDisplayConnection, DeviceStateMirror, CommunicationError, PageContent, LeadingEffect, LaggingEffect, DisplayMethod, Color, Font
+    from LedDisplayWriter import LedDisplayWriter
+    from LedFont import chooseFont
 except:
     pass # Error while importing
 
+class QueuedReceiver:
+    """ Calls a receiver from its own worker thread, through a bounded queue.
+
+        Calling a QueuedReceiver queues the call and returns immediately, unless the queue is full and the
+        overflow policy is BLOCK. With DROP_OLDEST, the oldest queued call is discarded; with COALESCE, a new
+        call replaces all queued calls, for receivers that only need the latest value.
+
+        Exceptions raised by the receiver are logged, and do not affect the caller or other receivers.
+    """
+
+    BLOCK       = "block"
+    DROP_OLDEST = "drop-oldest"
+    COALESCE    = "coalesce"
+
+    def __init__(self, receiver, max_queue_size = 100, overflow = BLOCK):
+
+        assert overflow in (self.BLOCK, self.DROP_OLDEST, self.COALESCE)
+
+        self.name = getattr(receiver, "__qualname__", repr(receiver))
+
+        self._logger = logging.getLogger("QueuedReceiver")
+
+        self._receiver = receiver
+        self._max_queue_size = max_queue_size
+        self._overflow = overflow
+
+        self._condition = threading.Condition()
+        self._queue = collections.deque() # (time queued, args, kwargs)
+        self._stop_requested = False
+
+        self.calls         = 0
+        self.dropped       = 0
+        self.errors        = 0
+        self.max_depth     = 0
+        self.total_latency = 0.0 # From queueing a call until the receiver returns, in seconds.
+        self.max_latency   = 0.0
+
+        self._thread = threading.Thread(target = self._run, name = "QueuedReceiver {}".format(self.name), daemon = True)
+        self._thread.start()
+
+    def __call__(self, *args, **kwargs):
+
+        with self._condition:
+
+            assert not self._stop_requested
+
+            if self._overflow == self.COALESCE:
+                self.dropped += len(self._queue)
+                self._queue.clear()
+            elif len(self._queue) >= self._max_queue_size:
+                if self._overflow == self.DROP_OLDEST:
+                    self._queue.popleft()
+                    self.dropped += 1
+                else:
+                    while len(self._queue) >= self._max_queue_size:
+                        self._condition.wait()
+
+            self._queue.append((time.monotonic(), args, kwargs))
+
+            self.max_depth = max(self.max_depth, len(self._queue))
+
+            self._condition.notify_all()
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    def close(self):
+        """Call the receiver for all queued calls, then stop the worker thread."""
+
+        assert self._thread is not None
+
+        with self._condition:
+            self._stop_requested = True
+            self._condition.notify_all()
+
+        self._thread.join()
+        self._thread = None
+
+        mean_latency = self.total_latency / self.calls if self.calls > 0 else 0.0
+
+        self._logger.info("Receiver {}: {} calls, {} dropped, {} errors, max queue depth {}, latency mean {:.3f} s, max {:.3f} s.".format(
+            self.name, self.calls, self.dropped, self.errors, self.max_depth, mean_latency, self.max_latency))
+
+    def _run(self):
+
+        while True:
+
+            with self._condition:
+
+                while not self._queue:
+                    if self._stop_requested:
+                        return
+                    self._condition.wait()
+
+                (queue_time, args, kwargs) = self._queue.popleft()
+
+                self._condition.notify_all() # Room for a blocked caller.
+
+            try:
+                self._receiver(*args, **kwargs)
+            except Exception as exception:
+                self.errors += 1
+                self._logger.exception("Receiver {} failed: {!r}".format(self.name, exception))
+
+            latency = time.monotonic() - queue_time
+
+            self.calls += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
 class Signal:
     """ A lightweight implementation of the Signal/Slot mechanism.
     """
     def __init__(self):
         self._receivers = []
         self._logger = logging.getLogger("signal")
-    def connect(self, receiver):
+    def connect(self, receiver, queued = False, max_queue_size = 100, overflow = QueuedReceiver.BLOCK):
+        # A queued receiver is called from its own thread; see QueuedReceiver.
+        # Receivers of the audio data should not be queued, to keep the audio path short.
+        if queued:
+            receiver = QueuedReceiver(receiver, max_queue_size, overflow)
         self._receivers.append(receiver)
+    def close(self):
+        # Deliver the queued calls, and stop the worker threads of the queued receivers.
+        for receiver in self._receivers:
+            if isinstance(receiver, QueuedReceiver):
+                receiver.close()
+        self._receivers = []
     def emit(self, *args, **kwargs):
-        # Note: if any of the receivers raises a signal,
+        # Note: if any of the (non-queued) receivers raises a signal,
         # the other receivers will not be notified.
         for receiver in self._receivers:
             receiver(*args, **kwargs)
 
+class AsyncSignal(Signal):
+    """ A Signal for use in an asyncio event loop.
+
+        Receivers are coroutine functions, which are awaited one after the other, or regular functions.
+        Queued receivers with the BLOCK overflow policy block the event loop while their queue is full.
+    """
+    async def emit(self, *args, **kwargs):
+        for receiver in self._receivers:
+            result = receiver(*args, **kwargs)
+            if inspect.isawaitable(result):
+                await result
+
 class AudioStreamPlayer:
     """ A basic audioplayer class that pushes data to a subprocess audio player.
+
+        The data is passed to the subprocess by a writer thread, through a jitter buffer, so that play()
+        never waits for the subprocess, and the subprocess is not starved by short network hiccups.
+
+        Playback starts when the buffer holds 'prebuffer_time' seconds of audio (the low watermark).
+        The writer then passes the data on as fast as the subprocess accepts it. If the buffer is empty
+        and the subprocess has played all data that it was given, that is an underrun: the writer waits
+        until the buffer is filled up to the low watermark again, which is raised. After
+        WATERMARK_DECAY_TIME seconds without underruns, the low watermark is lowered again, step by step,
+        until it is back at 'prebuffer_time'.
+
+        Seconds of audio are converted to bytes using the rate at which the stream arrives, measured over
+        the stream so far ('bitrate', in bits per second, is used until a measurement is available); call
+        startStream() before each (re)connection.
     """
-    def __init__(self, executable, executable_options):
+
+    REPORT_INTERVAL_SECONDS = 60.0
+
+    # Seconds of stream needed to measure its rate.
+    RATE_MEASUREMENT_TIME = 30.0
+
+    # Seconds without underruns after which a raised low watermark is halved.
+    WATERMARK_DECAY_TIME = 300.0
+
+    def __init__(self, executable, executable_options, prebuffer_time = 0.0, max_prebuffer_time = 10.0, bitrate = 128000):
 
         self._logger = logging.getLogger(executable)
 
@@ -37,9 +196,31 @@ class AudioStreamPlayer:
 
         self._process = subprocess.Popen(args = args, stdin = subprocess.PIPE, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
 
+        self._nominal_byte_rate = bitrate / 8.0
+        self._max_prebuffer_time = max_prebuffer_time
+
+        self._condition = threading.Condition()
+        self._buffer = collections.deque() # Chunks of audio data.
+        self._buffer_size = 0              # Bytes in the buffer.
+        self._playing = False              # False while prebuffering.
+        self._stop_requested = False
+        self._write_error = None
+
+        self._first_data_time = None
+        self._received_bytecount = 0
+
+        self._initial_prebuffer_time = prebuffer_time
+        self._watermark_time = time.monotonic() # When the low watermark was last changed.
+
+        self.prebuffer_time = prebuffer_time # The low watermark, in seconds of audio.
+        self.underruns = 0
+
         self._last_report_time = float("-inf")
         self._bytecount = 0
-        self._start_time = time.time()
+        self._start_time = time.monotonic()
+
+        self._writer_thread = threading.Thread(target = self._writer, name = "AudioStreamPlayer writer", daemon = True)
+        self._writer_thread.start()
 
     def __del__(self):
 
@@ -60,22 +241,135 @@ class AudioStreamPlayer:
 
         assert self._process is not None
 
+        with self._condition:
+            self._stop_requested = True
+            self._condition.notify_all()
+
         self._logger.debug("Stopping {!r} sub-process.".format(self._executable))
-        self._process.terminate() # ask nicely
+        self._process.terminate() # ask nicely; this also ends a write that is in progress.
+        self._writer_thread.join()
         self._process.wait()
         self._process = None
 
+        self._logger.info("Jitter buffer: {} underruns, low watermark {:.1f} s.".format(self.underruns, self.prebuffer_time))
+
+    def startStream(self):
+        """Start measuring the rate of a new stream, e.g. after a reconnection.
+
+           The audio of the previous stream that is still in the buffer is played.
+        """
+
+        with self._condition:
+            self._first_data_time = None
+            self._received_bytecount = 0
+
+    def _byteRate(self, current_time):
+        """The rate at which the stream arrives, in bytes per second."""
+
+        if self._first_data_time is not None and current_time - self._first_data_time >= self.RATE_MEASUREMENT_TIME:
+            return self._received_bytecount / (current_time - self._first_data_time)
+
+        return self._nominal_byte_rate
+
+    def bufferTime(self):
+        """The audio in the buffer, in seconds."""
+
+        with self._condition:
+            return self._buffer_size / self._byteRate(time.monotonic())
+
     def play(self, data):
 
-        current_time = time.time()
+        with self._condition:
+
+            if self._write_error is not None:
+                raise self._write_error
+
+            current_time = time.monotonic()
+
+            if self._first_data_time is None:
+                self._first_data_time = current_time
+            else:
+                # Do not count the first chunk, which arrived at the start of the measurement.
+                self._received_bytecount += len(data)
+
+            # The data may be a memoryview that is only valid during this call.
+            self._buffer.append(bytes(data))
+            self._buffer_size += len(data)
+
+            self._condition.notify_all()
+
+    def _writer(self):
 
-        self._process.stdin.write(data)
+        # The moment at which the subprocess will have played all data that it was given (an estimate).
+        played_until = time.monotonic()
 
-        self._bytecount += len(data)
+        while True:
 
-        REPORT_INTERVAL_SECONDS = 60.0
+            with self._condition:
 
-        if current_time - self._last_report_time >= REPORT_INTERVAL_SECONDS:
+                while True:
+
+                    if self._stop_requested:
+                        return
+
+                    current_time = time.monotonic()
+
+                    byte_rate = self._byteRate(current_time)
+
+                    if not self._playing:
+                        if self._buffer_size > 0 and self._buffer_size >= self.prebuffer_time * byte_rate:
+                            self._logger.debug("Prebuffered {:.1f} s of audio; playing.".format(self._buffer_size / byte_rate))
+                            self._playing = True
+                        else:
+                            self._condition.wait()
+                            continue
+
+                    if self.prebuffer_time > self._initial_prebuffer_time and current_time - self._watermark_time >= self.WATERMARK_DECAY_TIME:
+                        # No underruns for a while; lower the low watermark, towards its initial value.
+                        self.prebuffer_time = max(0.5 * self.prebuffer_time, self._initial_prebuffer_time)
+                        self._watermark_time = current_time
+                        self._logger.info("No audio buffer underruns for {:.0f} s; prebuffering {:.1f} s.".format(self.WATERMARK_DECAY_TIME, self.prebuffer_time))
+
+                    if self._buffer_size > 0:
+                        break
+
+                    if current_time < played_until:
+                        self._condition.wait(played_until - current_time)
+                        continue
+
+                    # The buffer is empty, and the subprocess has played all data that it was given.
+                    self.underruns += 1
+                    if self.prebuffer_time > 0.0:
+                        self.prebuffer_time = min(max(2.0 * self.prebuffer_time, 1.0), self._max_prebuffer_time)
+                        self._watermark_time = current_time
+                    self._logger.warning("Audio buffer underrun; prebuffering {:.1f} s.".format(self.prebuffer_time))
+                    self._playing = False
+
+                data = self._buffer.popleft()
+                self._buffer_size -= len(data)
+
+            # The write blocks while the pipe to the subprocess is full, so the subprocess sets the pace.
+            try:
+                self._process.stdin.write(data)
+                self._process.stdin.flush()
+            except OSError as exception:
+                with self._condition:
+                    if not self._stop_requested:
+                        self._logger.error("Unable to write to {!r} sub-process: {!r}".format(self._executable, exception))
+                        self._write_error = exception
+                return
+
+            current_time = time.monotonic()
+
+            played_until = max(played_until, current_time) + len(data) / byte_rate
+
+            self._bytecount += len(data)
+
+            self._report(current_time)
+
+    def _report(self, current_time):
+
+        if current_time - self._last_report_time >= self.REPORT_INTERVAL_SECONDS:
 
             megabytes = self._bytecount / 1048576.0
             kilobits  = self._bytecount * 8.0 / 1000.0 # These 'kilobits' are 1000 bits.
@@ -94,22 +388,30 @@ class AudioStreamPlayer:
 
             self._logger.info("Streamed {:.3f} MB in {}h{:02}m{:06.3f}s ({:.3f} MB/h, {:.6f} kbits/sec)".format(megabytes, hms_h, hms_m, hms_s, megabytes_per_hour, kilobits_per_second))
 
+            self._logger.info("Audio buffer: {:.1f} s ({} bytes), low watermark {:.1f} s, {} underruns.".format(
+                self.bufferTime(), self._buffer_size, self.prebuffer_time, self.underruns))
+
             self._last_report_time = current_time
 
 class MetadataLedDisplayDriver:
 
-    def __init__(self, led_device):
+    def __init__(self, led_connection):
 
         self._logger = logging.getLogger("MetadataLedDisplayDriver")
 
-        self._led_device = led_device
+        # The connection is a LedDisplayConnection, which keeps the serial port open across
+        # metadata events, or a LedDisplayWriter, which sends from its own thread so the
+        # metadata signal path never waits for serial I/O.
+        self._led_connection = led_connection
 
         self._regexp = re.compile("StreamTitle='(.*)';StreamUrl='(.*)';")
 
-        if self._led_device is not None:
-            with LedDisplay(self._led_device) as led_display:
-                led_display.setBrightnessLevel("A")
-                led_display.setSchedule("A", "A")
+        if self._led_connection is not None:
+            try:
+                self._led_connection.setBrightnessLevel("A")
+                self._led_connection.setSchedule("A", "A")
+            except CommunicationError as exception:
+                self._logger.error("Unable to configure LED display: {}".format(exception))
 
     def __enter__(self):
         return self
@@ -131,23 +433,39 @@ class MetadataLedDisplayDriver:
 
         self._logger.info("Stream title: {!r}".format(title))
 
-        if self._led_device is not None:
+        if self._led_connection is not None:
 
             # The "reggae" easter egg...
 
             reggae_triggers = "Bob Marley, Peter Tosh, Gregory Isaacs, Tenor Saw, reggae"
 
             if any(r.strip().lower() in title.lower() for r in reggae_triggers.split(",")):
-                color_directive = "<CR>" # reggae colors
+                color = Color.RASTA # reggae colors
             else:
-                color_directive = "<CG>" # regular colors
-
-            # Make led display command.
-
-            led_message = "<L1><PA><FE><MA><WB><FE><AC>{}{}          <CD><KD> <KT>".format(color_directive, title.encode("ASCII", errors = "replace").decode())
-
-            with LedDisplay(self._led_device) as led_display:
-                led_display.send(led_message)
+                color = Color.DIM_ORANGE # regular colors
+
+            # Make led display page. A title that fits on the display is shown immediately, in the
+            # widest font that fits; a longer title scrolls by in the narrow font, followed by the date and time.
+            # European characters are shown using the display's own character table.
+
+            font = chooseFont(title)
+
+            try:
+                if font is not None:
+                    led_page = PageContent(1, "A", LeadingEffect.IMMEDIATE, DisplayMethod.NORMAL, 1, LaggingEffect.SCROLL_LEFT)
+                    led_page.font(Font(font)).color(color).text(title, errors = "replace")
+                else:
+                    led_page = PageContent(1, "A", LeadingEffect.SCROLL_LEFT, DisplayMethod.NORMAL, 1, LaggingEffect.SCROLL_LEFT)
+                    led_page.font(Font.NARROW).color(color).text(title + "          ", errors = "replace")
+                    led_page.color(Color.DIM_GREEN).date().text(" ").time()
+            except ValueError as exception:
+                self._logger.error("Unable to show title on LED display: {}".format(exception))
+                return
+
+            try:
+                self._led_connection.setPageContent(led_page)
+            except CommunicationError as exception:
+                self._logger.error("Unable to update LED display: {}".format(exception))
 
 class MetadataFileWriter:
 
@@ -176,12 +494,13 @@ class MetadataFileWriter:
 
 class MetadataDatabaseWriter:
 
-    def __init__(self, filename):
+    def __init__(self, filename, station = None):
 
         self._logger = logging.getLogger("MetadataDatabaseWriter")
 
         self._logger.debug("Opening database ...")
-        self._conn = sqlite3.connect(filename)
+        # The writer may be used by a QueuedReceiver thread; it is used by one thread at a time.
+        self._conn = sqlite3.connect(filename, check_same_thread = False)
 
         cursor = self._conn.cursor()
 
@@ -189,7 +508,8 @@ class MetadataDatabaseWriter:
                     id         INTEGER NOT NULL PRIMARY KEY,
                     timestamp  REAL    NOT NULL,
                     duration   REAL        NULL,
-                    metadata   BLOB    NOT NULL
+                    metadata   BLOB    NOT NULL,
+                    station    TEXT        NULL
                 );"""
 
         query = query.split("\n")
@@ -198,6 +518,14 @@ class MetadataDatabaseWriter:
 
         cursor.execute(query)
 
+        # Databases made before the station column was introduced.
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(metadata);")]
+        if "station" not in columns:
+            cursor.execute("ALTER TABLE metadata ADD COLUMN station TEXT NULL;")
+
+        # The station name that the metadata rows are tagged with; None for a single station.
+        self._station = station
+
         self._counter = 0
         self._last_time  = None
         self._last_rowid = None
@@ -238,9 +566,9 @@ class MetadataDatabaseWriter:
             query = "UPDATE metadata SET duration = ? WHERE rowid = ?;"
             cursor.execute(query, (duration, self._last_rowid))
 
-        query = "INSERT INTO metadata(timestamp, metadata) VALUES (?, ?);"
+        query = "INSERT INTO metadata(timestamp, metadata, station) VALUES (?, ?, ?);"
 
-        cursor.execute(query, (current_time, metadata))
+        cursor.execute(query, (current_time, metadata, self._station))
 
         self._conn.commit()
 
@@ -250,6 +578,12 @@ class MetadataDatabaseWriter:
 class StreamStalledError(RuntimeError):
     pass
 
+# Stall detection uses the monotonic clock, so that steps of the wall clock (e.g. by NTP) do not matter.
+# The timestamps passed to the metadata receivers are wall-clock times.
+
+NO_DATA_WARNING_TIME   =  2.0 # seconds without data before a warning is logged (once).
+NO_DATA_THRESHOLD_TIME = 10.0 # seconds without data before the stream is considered stalled.
+
 class InternetRadioPlayer:
 
     def __init__(self, host, port, path):
@@ -265,9 +599,8 @@ class InternetRadioPlayer:
 
     def play(self):
 
-        SOCKET_RECV_TIMEOUT    =  1.0 # seconds
-        SOCKET_RECV_SIZE       = 4096 # larger than 1 regular IP packet.
-        NO_DATA_THRESHOLD_TIME = 10.0
+        SOCKET_RECV_TIMEOUT = 1.0  # seconds
+        SOCKET_RECV_SIZE    = 4096 # larger than 1 regular IP packet.
 
         address = (self._host, self._port)
 
@@ -281,114 +614,143 @@ class InternetRadioPlayer:
 
             stream_socket.send(request)
 
-            # Read the response header (HTTP-like).
+            # Demultiplex the response: header (HTTP-like), audio data, and metadata.
 
-            stream_buffer = bytearray()
             last_data_time = time.time()
+            last_data_monotonic_time = time.monotonic()
+
+            def process_headerline(headerline):
+                self._logger.info("Received response header: {!r}".format(headerline))
+
+            def process_metadata(metadata):
+                self.metadata_signal.emit(last_data_time, metadata)
 
-            in_header = True
-            icy_metadata_interval = None
-            icy_content_type = None
+            demuxer = IcyDemuxer(process_headerline, self.audiodata_signal.emit, process_metadata)
 
             while True: # Loop to read more data.
 
-                while True: # loop to process available bytes.
+                warned = False
+
+                while True:
+                    (rlist, wlist, xlist) = select.select([stream_socket], [], [stream_socket], SOCKET_RECV_TIMEOUT)
+                    idle_time = time.monotonic() - last_data_monotonic_time
+                    assert len(wlist) == 0
+                    assert len(xlist) == 0
+                    if stream_socket in rlist:
+                        break # Data available.
+                    if idle_time > NO_DATA_THRESHOLD_TIME:
+                        raise StreamStalledError()
+                    if idle_time >= NO_DATA_WARNING_TIME and not warned:
+                        self._logger.warning("No data received for {:.1f} seconds.".format(idle_time))
+                        warned = True
+
+                if warned:
+                    self._logger.info("Data received again after {:.1f} seconds.".format(idle_time))
 
-                    if in_header:
+                last_data_time = time.time()
+                last_data_monotonic_time = time.monotonic()
 
-                        idx = stream_buffer.find(b"\r\n")
+                # Receive and process the data. Receivers of the audio data get a memoryview into the
+                # demuxer's buffer, which is only valid during the call.
+                if demuxer.receiveFrom(stream_socket, SOCKET_RECV_SIZE) == 0:
+                    raise StreamStalledError("Stream closed by server.")
 
-                        if idx < 0:
-                            break # CR/LF not found. We need to read more data to proceed.
+        finally:
 
-                        # Found CR/LF ; extract and process the line.
+            self._logger.info("Closing stream socket ...")
+            stream_socket.close()
 
-                        # Extract header line from stream buffer and convert it to a string.
-                        headerline = stream_buffer[:idx].decode(errors = "replace")
+class AsyncInternetRadioPlayer:
+    """ An InternetRadioPlayer for use in an asyncio event loop, together with other tasks.
 
-                        # Discard header line and CR/LF characters from the stream buffer.
-                        del stream_buffer[:idx + 2]
+        Receivers of the signals may be coroutine functions; see AsyncSignal. Each read of the stream
+        has a timeout, so a stalled stream is noticed. To stop playing, cancel the task that runs play().
+    """
 
-                        self._logger.info("Received response header: {!r}".format(headerline))
+    def __init__(self, host, port, path):
 
-                        if headerline.startswith("icy-metaint:"):
-                            assert icy_metadata_interval is None
-                            icy_metadata_interval = int(headerline[12:])
-                        elif headerline.startswith("content-type:"):
-                            assert icy_content_type is None
-                            icy_content_type = headerline[13:]
-                        elif len(headerline) == 0:
-                            # Empty line terminates the header!
-                            assert icy_metadata_interval is not None
-                            assert icy_content_type is not None
-                            stream_audio_bytes_until_metadata = icy_metadata_interval
-                            in_header = False
+        self._logger = logging.getLogger("{}:{}".format(host, port))
 
-                    elif stream_audio_bytes_until_metadata > 0:
+        self._host = host
+        self._port = port
+        self._path = path
 
-                        # We should stream audio data.
+        self.audiodata_signal = AsyncSignal()
+        self.metadata_signal = AsyncSignal()
 
-                        if len(stream_buffer) == 0:
-                            break # No data available for streaming. Need to read more data.
+    async def _read(self, reader, size):
+        """Read data from the stream; raise StreamStalledError if no data arrives in time."""
 
-                        # Determine how much of the buffer is audio data.
-                        stream_audio_bytes = min(stream_audio_bytes_until_metadata, len(stream_buffer))
+        # StreamReader.read() can be cancelled without losing data, so it can be retried after a timeout.
+        try:
+            return await asyncio.wait_for(reader.read(size), NO_DATA_WARNING_TIME)
+        except asyncio.TimeoutError:
+            pass
 
-                        # Emit the audio stream data using a signal.
-                        self.audiodata_signal.emit(stream_buffer[:stream_audio_bytes])
+        self._logger.warning("No data received for {:.1f} seconds.".format(NO_DATA_WARNING_TIME))
 
-                        # Remove the audio stream data from the stream buffer.
-                        del stream_buffer[:stream_audio_bytes]
+        try:
+            data = await asyncio.wait_for(reader.read(size), NO_DATA_THRESHOLD_TIME - NO_DATA_WARNING_TIME)
+        except asyncio.TimeoutError:
+            raise StreamStalledError("No data received for {:.1f} seconds.".format(NO_DATA_THRESHOLD_TIME))
 
-                        # Decrease the number of bytes until the next metadata chunk.
-                        stream_audio_bytes_until_metadata -= stream_audio_bytes
+        self._logger.info("Receiving data again.")
 
-                    else:
+        return data
 
-                        # We are expecting a metadata chunk.
+    async def play(self):
 
-                        if len(stream_buffer) == 0:
-                            break # More data needed; at least the metadata chunk length byte.
+        SOCKET_RECV_SIZE = 4096 # larger than 1 regular IP packet.
 
-                        metadata_size = 16 * stream_buffer[0]
+        (reader, writer) = await asyncio.open_connection(self._host, self._port)
 
-                        if len(stream_buffer) < 1 + metadata_size:
-                            break # More data needed; metadata chunk incomplete.
+        try:
 
-                        # We have a complete metadata chunk.
-                        metadata = stream_buffer[1:1 + metadata_size]
+            request = "GET {} HTTP/1.0\r\nHost:{}\r\nIcy-MetaData: 1\r\nAccept: */*\r\n\r\n".format(self._path, self._host).encode()
 
-                        metadata = metadata.rstrip(b"\0").decode(errors = "replace")
+            self._logger.info("Sending HTTP request: {!r} ...".format(request))
 
-                        self.metadata_signal.emit(last_data_time, metadata)
+            writer.write(request)
+            await writer.drain()
 
-                        # Discard the metadata size byte as well as the metadata itself.
-                        del stream_buffer[:1 + metadata_size]
+            # The demuxer calls its receivers synchronously; collect the signals to emit, and emit them
+            # (awaiting the receivers) after each chunk of data.
 
-                        # Next traversal of data processing loop will process audio data.
-                        stream_audio_bytes_until_metadata = icy_metadata_interval
+            last_data_time = time.time()
+            pending_signals = []
 
-                # Read more data.
+            def process_headerline(headerline):
+                self._logger.info("Received response header: {!r}".format(headerline))
 
-                while True:
-                    (rlist, wlist, xlist) = select.select([stream_socket], [], [stream_socket], SOCKET_RECV_TIMEOUT)
-                    select_time = time.time()
-                    assert len(wlist) == 0
-                    assert len(xlist) == 0
-                    if stream_socket in rlist:
-                        break # Data available.
-                    self._logger.warning("No data received for {:.1f} seconds.".format(select_time - last_data_time))
-                    if select_time - last_data_time > NO_DATA_THRESHOLD_TIME:
-                        raise StreamStalledError()
+            def process_audiodata(data):
+                pending_signals.append((self.audiodata_signal, (data, )))
+
+            def process_metadata(metadata):
+                pending_signals.append((self.metadata_signal, (last_data_time, metadata)))
+
+            demuxer = IcyDemuxer(process_headerline, process_audiodata, process_metadata)
+
+            while True:
+
+                data = await self._read(reader, SOCKET_RECV_SIZE)
+
+                if len(data) == 0:
+                    raise StreamStalledError("Stream closed by server.")
 
-                last_data_time = select_time
-                packet = stream_socket.recv(SOCKET_RECV_SIZE)
-                stream_buffer.extend(packet)
+                last_data_time = time.time()
+
+                # The audio data passed on remains valid until the next call to feed().
+                demuxer.feed(data)
+
+                for (signal, args) in pending_signals:
+                    await signal.emit(*args)
+
+                del pending_signals[:]
 
         finally:
 
             self._logger.info("Closing stream socket ...")
-            stream_socket.close()
+            writer.close()
 
 def main():
 
@@ -403,6 +765,9 @@ def main():
     else:
         log_level = logging.INFO
 
+    # Run the player in an asyncio event loop, rather than blocking on select().
+    use_asyncio = "--asyncio" in sys.argv[1:]
+
     log_filename = "PlayInternetRadio_%Y%m%d_%H%M%S.log"
     log_format = "%(asctime)s | %(levelname)-10s | %(name)-25s | %(message)s"
 
@@ -410,39 +775,72 @@ def main():
 
         logger = logging.getLogger("main")
 
-        with AudioStreamPlayer("mpg123", ["-"]) as audiostream_player, \
-             MetadataLedDisplayDriver(led_device) as metadata_led_driver, \
-             MetadataDatabaseWriter("metadata.sqlite3") as metadata_database_writer, \
-             MetadataFileWriter("metadata.log") as metadata_file_writer:
+        if led_device is not None:
+            # Remember the display configuration across restarts, so it is not re-sent needlessly.
+            led_state_mirror = DeviceStateMirror("LedDisplayState.json")
+            led_connection = LedDisplayConnection(led_device, state_mirror = led_state_mirror)
+            led_writer = LedDisplayWriter(led_connection)
+        else:
+            led_connection = None
+            led_writer = None
 
-            RETRY_INTERVAL = 5.0
+        try:
 
-            while True:
+            # Prebuffer 2 seconds of audio, to ride out network hiccups.
+            with AudioStreamPlayer("mpg123", ["-"], prebuffer_time = 2.0) as audiostream_player, \
+                 MetadataLedDisplayDriver(led_writer) as metadata_led_driver, \
+                 MetadataDatabaseWriter("metadata.sqlite3") as metadata_database_writer, \
+                 MetadataFileWriter("metadata.log") as metadata_file_writer:
 
-                try:
+                RETRY_INTERVAL = 5.0
 
-                    radioPlayer = InternetRadioPlayer(host, port, path)
+                while True:
 
-                    radioPlayer.audiodata_signal.connect(audiostream_player.play)
-                    radioPlayer.metadata_signal.connect(metadata_led_driver.process)
-                    radioPlayer.metadata_signal.connect(metadata_file_writer.process)
-                    radioPlayer.metadata_signal.connect(metadata_database_writer.process)
+                    try:
+
+                        audiostream_player.startStream()
+
+                        if use_asyncio:
+                            radioPlayer = AsyncInternetRadioPlayer(host, port, path)
+                        else:
+                            radioPlayer = InternetRadioPlayer(host, port, path)
+
+                        # The metadata receivers run in their own threads, so that a slow LED display or
+                        # database does not hold up the audio. The LED display only needs the latest title.
+                        radioPlayer.audiodata_signal.connect(audiostream_player.play)
+                        radioPlayer.metadata_signal.connect(metadata_led_driver.process, queued = True, overflow = QueuedReceiver.COALESCE)
+                        radioPlayer.metadata_signal.connect(metadata_file_writer.process, queued = True)
+                        radioPlayer.metadata_signal.connect(metadata_database_writer.process, queued = True)
+
+                        try:
+                            if use_asyncio:
+                                asyncio.run(radioPlayer.play())
+                            else:
+                                radioPlayer.play() # blocking call
+                        finally:
+                            radioPlayer.metadata_signal.close()
+
+                    except KeyboardInterrupt:
+                        logger.info("Quitting by user request.")
+                        break
+                    except socket.gaierror as exception:
+                        logger.error("getaddrinfo() error: {}".format(exception))
+                    except StreamStalledError:
+                        logger.error("Stream has stalled; unable to play.")
+                    except BaseException as exception:
+                        logger.exception("Unknown exception: {!r}".format(exception))
+
+                    logger.info("Sleeping for {} seconds before retry ...".format(RETRY_INTERVAL))
+                    time.sleep(RETRY_INTERVAL)
+                    # Next traversal of loop attempts new connection.
 
-                    radioPlayer.play() # blocking call
+        finally:
 
-                except KeyboardInterrupt:
-                    logger.info("Quitting by user request.")
-                    break
-                except socket.gaierror as exception:
-                    logger.error("getaddrinfo() error: {}".format(exception))
-                except StreamStalledError:
-                    logger.error("Stream has stalled; unable to play.")
-                except BaseException as exception:
-                    logger.exception("Unknown exception: {!r}".format(exception))
+            if led_writer is not None:
+                led_writer.close()
 
-                logger.info("Sleeping for {} seconds before retry ...".format(RETRY_INTERVAL))
-                time.sleep(RETRY_INTERVAL)
-                # Next traversal of loop attempts new connection.
+            if led_connection is not None:
+                led_connection.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,93 @@
+# Unit tests for the IcyDemuxer, without sockets. Run with: python3 -m pytest
+
+import pytest
+from IcyDemuxer import IcyDemuxer
+from BenchmarkIcyDemuxer import make_stream, random_chunks
+
+@pytest.fixture(scope = "module")
+def stream():
+    return make_stream(1000 * 1000)
+
+def _demux(stream, max_chunk_size):
+
+    received_audio = bytearray()
+    received_metadata = []
+    header_lines = []
+
+    demuxer = IcyDemuxer(header_lines.append, received_audio.extend, received_metadata.append)
+
+    for chunk in random_chunks(stream, max_chunk_size, seed = max_chunk_size):
+        demuxer.feed(chunk)
+
+    return (demuxer, received_audio, received_metadata, header_lines)
+
+@pytest.mark.parametrize("max_chunk_size", [1, 7, 100, 4096, 5000, 65536, 100000])
+def test_random_splits(stream, max_chunk_size):
+
+    (data, audio, metadata_list) = stream
+
+    (demuxer, received_audio, received_metadata, header_lines) = _demux(data, max_chunk_size)
+
+    assert received_audio == audio
+    assert received_metadata == metadata_list
+    assert header_lines == ["ICY 200 OK", "content-type:audio/mpeg", "icy-metaint:16000", ""]
+    assert demuxer.icy_metadata_interval == 16000
+    assert demuxer.icy_content_type == "audio/mpeg"
+    assert demuxer.audio_bytes == len(audio)
+    assert demuxer.metadata_count == len(metadata_list)
+
+def test_stream_without_metadata():
+
+    audio = bytes(range(256)) * 100
+
+    received_audio = bytearray()
+    received_metadata = []
+
+    demuxer = IcyDemuxer(None, received_audio.extend, received_metadata.append)
+
+    for chunk in random_chunks(b"ICY 200 OK\r\n\r\n" + audio, 1000):
+        demuxer.feed(chunk)
+
+    assert received_audio == audio
+    assert received_metadata == []
+    assert demuxer.icy_metadata_interval is None
+
+def test_header_line_too_long():
+
+    demuxer = IcyDemuxer(buffer_size = IcyDemuxer.MIN_BUFFER_SIZE)
+
+    with pytest.raises(ValueError):
+        demuxer.feed(b"x" * (IcyDemuxer.MIN_BUFFER_SIZE + 1))
+
+@pytest.mark.parametrize("size", [100, 4096, 65536])
+def test_receive_from(stream, size):
+
+    (data, audio, metadata_list) = stream
+
+    class Chunks:
+        """Stands in for a socket: recv_into() returns the next chunk of the stream."""
+        def __init__(self):
+            self._chunks = random_chunks(data, size, seed = size)
+            self._chunks.reverse()
+        def recv_into(self, buffer, nbytes):
+            if not self._chunks:
+                return 0
+            chunk = self._chunks.pop()
+            if len(chunk) > nbytes:
+                self._chunks.append(chunk[nbytes:])
+                chunk = chunk[:nbytes]
+            buffer[:len(chunk)] = chunk
+            return len(chunk)
+
+    received_audio = bytearray()
+    received_metadata = []
+
+    demuxer = IcyDemuxer(None, received_audio.extend, received_metadata.append)
+
+    sock = Chunks()
+
+    while demuxer.receiveFrom(sock, size) != 0:
+        pass
+
+    assert received_audio == audio
+    assert received_metadata == metadata_list
@@ -0,0 +1,143 @@
+# Regression tests for LedDisplay, driven through the LedDisplayEmulator. Run with: python3 -m pytest
+
+import json, threading, functools, operator
+import pytest
+from LedDisplay import LedDisplay, DeviceStateMirror, CommunicationError, checksum, frameCommand
+from LedDisplayEmulator import LedDisplayEmulator
+from LedDisplayWriter import LedDisplayWriter
+
+PAGE_A = b"<L1><PA><FE><MA><WC><FE>Hello"
+PAGE_B = b"<L1><PB><FE><MA><WC><FE>World"
+
+@pytest.fixture
+def emulator():
+    with LedDisplayEmulator(seed = 0) as emulator:
+        yield emulator
+
+@pytest.fixture
+def led_display(emulator):
+    with LedDisplay(emulator.device, timeout = 0.2) as led_display:
+        yield led_display
+
+def test_checksum():
+    for data_packet in (b"", b"<BA>", PAGE_A, bytes(range(256)) * 3):
+        assert checksum(data_packet) == functools.reduce(operator.xor, data_packet, 0)
+
+def test_frame_command():
+    assert frameCommand(1, b"<BA>") == b"<ID01><BA>" + "{:02X}".format(checksum(b"<BA>")).encode() + b"<E>"
+    assert frameCommand(0xAB, b"<D*>").startswith(b"<IDAB><D*>")
+
+def test_acknowledged_command(emulator, led_display):
+    led_display.send(PAGE_A)
+    led_display.setBrightnessLevel("B")
+    assert emulator.pages[(1, "A")] == b"<FE><MA><WC><FE>Hello"
+    assert emulator.brightness == "B"
+    assert emulator.checksum_errors == 0
+    assert led_display.stats.commands == 2
+    assert led_display.stats.retries == 0
+
+def test_bad_checksum_is_not_acknowledged(emulator, led_display):
+    frame = frameCommand(1, PAGE_A)
+    bad_frame = frame[:-5] + b"00<E>" if frame[-5:-3] != b"00" else frame[:-5] + b"01<E>"
+    with pytest.raises(CommunicationError):
+        led_display._exchange(bad_frame, b"ACK", 1)
+    assert emulator.checksum_errors == 1
+    assert (1, "A") not in emulator.pages
+
+def test_other_device_id_is_ignored(emulator):
+    with LedDisplay(emulator.device, device_id = 2, timeout = 0.1) as led_display:
+        with pytest.raises(CommunicationError):
+            led_display.send(PAGE_A, max_retry = 1)
+    assert emulator.ignored_frames == 1
+
+def test_retry_after_dropped_response(emulator, led_display):
+    emulator.drop_probability = 0.5
+    for i in range(10):
+        led_display.send(PAGE_A + str(i).encode(), max_retry = 20)
+    assert emulator.pages[(1, "A")].endswith(b"Hello9")
+    assert led_display.stats.retries > 0
+
+def test_resync_after_garbled_response(emulator, led_display):
+    emulator.garble_probability = 1.0
+    with pytest.raises(CommunicationError):
+        led_display.send(PAGE_A, max_retry = 2)
+    assert led_display.stats.resyncs > 0
+    emulator.garble_probability = 0.0
+    led_display.send(PAGE_B)
+    assert emulator.pages[(1, "B")].endswith(b"World")
+
+def test_late_acknowledgement(emulator):
+    emulator.ack_delay = 0.3
+    # Without a resync gap, the resync waits the full timeout, and picks up the late ACK.
+    with LedDisplay(emulator.device, timeout = 0.2, resync_gap = None) as led_display:
+        led_display.send(PAGE_A, max_retry = 1)
+        assert led_display.stats.late_acks == 1
+
+def test_state_mirror_suppresses_redundant_commands(emulator, tmp_path):
+    filename = str(tmp_path / "state.json")
+    with LedDisplay(emulator.device, timeout = 0.2, state_mirror = DeviceStateMirror(filename)) as led_display:
+        led_display.send(PAGE_A)
+        led_display.send(PAGE_A)
+        assert led_display.suppressed_count == 1
+        # The mirror is saved after each change, not only on close().
+        assert json.load(open(filename)) == {"page 1A": PAGE_A.hex()}
+    assert emulator.frame_count == 1
+    # The mirror survives a restart.
+    with LedDisplay(emulator.device, timeout = 0.2, state_mirror = DeviceStateMirror(filename)) as led_display:
+        led_display.send(PAGE_A)
+        assert led_display.suppressed_count == 1
+        led_display.deletePage(1, "A")
+        led_display.send(PAGE_A)
+    assert emulator.frame_count == 3
+
+def test_state_mirror_forgets_failed_commands(emulator, tmp_path):
+    filename = str(tmp_path / "state.json")
+    with LedDisplay(emulator.device, timeout = 0.1, state_mirror = DeviceStateMirror(filename)) as led_display:
+        led_display.send(PAGE_A)
+        emulator.drop_probability = 1.0
+        with pytest.raises(CommunicationError):
+            led_display.send(PAGE_A[:-1], max_retry = 1)
+        # The device may or may not show the failed command; the page must be sent again.
+        assert json.load(open(filename)) == {}
+        emulator.drop_probability = 0.0
+        led_display.send(PAGE_A)
+        assert led_display.suppressed_count == 0
+
+class _GatedDisplay:
+    """Forwards commands to a LedDisplay, after the gate has been opened."""
+
+    def __init__(self, led_display):
+        self.led_display = led_display
+        self.gate = threading.Event()
+
+    def send(self, *args, **kwargs):
+        self.gate.wait()
+        self.led_display.send(*args, **kwargs)
+
+    def deletePage(self, *args, **kwargs):
+        self.gate.wait()
+        self.led_display.deletePage(*args, **kwargs)
+
+def test_writer_coalesces_page_commands(emulator, led_display):
+    display = _GatedDisplay(led_display)
+    with LedDisplayWriter(display) as writer:
+        writer.send(PAGE_B) # Keeps the worker busy until the gate opens.
+        for i in range(5):
+            writer.send(PAGE_A + str(i).encode())
+        display.gate.set()
+        writer.flush()
+        assert writer.coalesced_count == 4
+    data_packets = [data_packet for (t, data_packet) in emulator.commands]
+    assert data_packets == [PAGE_B, PAGE_A + b"4"]
+
+def test_writer_does_not_coalesce_across_delete(emulator, led_display):
+    display = _GatedDisplay(led_display)
+    with LedDisplayWriter(display) as writer:
+        writer.send(PAGE_B)
+        writer.send(PAGE_A + b"old")
+        writer.deletePage(1, "A")
+        writer.send(PAGE_A + b"new")
+        display.gate.set()
+    data_packets = [data_packet for (t, data_packet) in emulator.commands]
+    assert data_packets[-2:] == [b"<DL1PA>", PAGE_A + b"new"]
+    assert emulator.pages[(1, "A")].endswith(b"new")